@@ -2,4 +2,6 @@ from __future__ import annotations
 
 import src.main
 
-src.main.start()
+if __name__ == "__main__":
+    # Guarded, the worker processes import this module again when they start
+    src.main.start()
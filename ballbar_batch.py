@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+import sys
+
+import src.batch
+
+if __name__ == "__main__":
+    # python ballbar_batch.py <directory with runs>
+    sys.exit(src.batch.main())
@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+import sys
+
+import src.loadtest
+
+if __name__ == "__main__":
+    # python ballbar_loadtest.py --fps 240 --resolution 1920x1080
+    sys.exit(src.loadtest.main())
@@ -1,6 +1,17 @@
 from __future__ import annotations
 
+import os
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
 import numpy as np
+import numpy.typing as npt
 from PySide6.QtCore import QObject
 from PySide6.QtCore import QThread
 from PySide6.QtCore import Signal
@@ -12,52 +23,400 @@ from PySide6.QtMultimedia import QMediaDevices
 from PySide6.QtMultimedia import QVideoFrame
 from PySide6.QtMultimedia import QVideoSink
 
+from src.DataClasses import FastData
+from src.DataClasses import Sample
+from src.instrumentation import PipelineStats
+from src.pipeline import ReorderBuffer
+from src.recording import FrameRecorder
+from src.recording import FrameRecording
+from src.sampling import SubsampleBuffer
+from src.Workers import FrameReplayer
 from src.Workers import FrameSender
 from src.Workers import FrameWorker
+from src.Workers import mapped_luma
+from src.Workers import worker_backends
+
+if TYPE_CHECKING:  # Only needed for annotations, keeps the simulator out of the application
+    from src.simulation import SyntheticCamera
+
+
+def default_worker_count(num_sensors: int = 1) -> int:
+    """Frame workers per sensor, the cores shared out between the sensors, keeping one free for the GUI."""
+    return max(1, min(4, ((os.cpu_count() or 2) - 1) // max(1, num_sensors)))
+
+
+def sensor_path(path: str, sensor: int) -> str:
+    """Returns the file of `sensor` for a file named for the first sensor, e.g. run.frames and run_sensor1.frames."""
+    if not sensor:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}_sensor{sensor}{extension}"
+
+
+class CameraSession(QObject):  # type: ignore
+    """
+    One sensor: its camera, its frame workers and their threads, and its stream of measurements.
+
+    Frames are numbered as they are dispatched to the workers and the results are put back into
+    that order before they are passed on with OnAnalyserUpdate, and the previews of the displayed
+    frames with OnSensorFeedUpdate. Every session has its own workers, statistics and sequence
+    numbers, so sensors don't wait on each other. Arrival times come from the `clock` all sessions
+    of a Core share, which is what lines their samples up.
+
+    Args:
+    sensor: index of the sensor, set on the FastData of its measurements.
+    num_workers: frame workers, each on its own thread.
+    clock: arrival time in nanoseconds, time.monotonic_ns by default.
+    backend: key of Workers.worker_backends, "process" analyses every worker's frames in a process of its own.
+    """
+
+    OnSensorFeedUpdate = Signal(QPixmap)
+    OnAnalyserUpdate = Signal(FastData)  # analysed frames, in the order they were captured
+    OnFrameDone = Signal(int)  # sequence number of every frame that came back, analysed or skipped
+
+    def __init__(
+        self,
+        sensor: int = 0,
+        num_workers: int = 0,
+        clock: Callable[[], int] = time.monotonic_ns,
+        backend: str = "thread",
+    ) -> None:
+        super().__init__()
+        self.sensor = sensor
+        self.clock = clock
+        self.camera = QCamera()  # camera being used
+
+        # Raw frame recording and replay
+        self.recorder: Optional[FrameRecorder] = None  # created on the first frame once recording starts
+        self.recording_path = ""  # file frames are recorded to, empty when not recording
+        self.recording_max_bytes = 0  # size limit of the recording file
+        self.replayer: Optional[FrameReplayer] = None
+        self.synthetic_camera: Optional[SyntheticCamera] = None  # replaces the camera when set
+
+        self.stats = PipelineStats()  # frame counts and stage timings of this sensor's pipeline
+        self.captureSession = QMediaCaptureSession()
+        self.workerThreads: List[QThread] = []
+        self.frameSenders: List[FrameSender] = []
+        self.frameWorkers: List[FrameWorker] = []
+        for _ in range(num_workers or default_worker_count()):
+            worker_thread = QThread()
+            frame_sender = FrameSender()
+            frame_worker = worker_backends[backend](parent_obj=self)
+            frame_worker.moveToThread(worker_thread)
+            frame_worker.set_stats(self.stats)
+            frame_sender.OnFrameChanged.connect(frame_worker.setVideoFrame)
+            frame_sender.OnGrayFrameChanged.connect(frame_worker.setGrayFrame)
+            frame_worker.OnAnalyserUpdate.connect(self.onFrameAnalysed)
+            frame_worker.OnFrameSkipped.connect(self.onFrameSkipped)
+            worker_thread.start()
+
+            self.workerThreads.append(worker_thread)
+            self.frameSenders.append(frame_sender)
+            self.frameWorkers.append(frame_worker)
+
+        self.next_worker = 0  # round robin position
+        self.sequence = 0  # sequence number given to the next dispatched frame
+        self.reorder_buffer = ReorderBuffer()
+        self.frame_times: Dict[int, Tuple[int, int]] = {}  # frame and arrival time of frames being analysed
+
+        # Every frame is measured, only frames at this rate are turned into preview and scope images
+        self.display_rate_hz = 30.0
+        self.next_display_ns = 0  # arrival time from which the next frame is displayed
+
+        self.captureSession.setVideoSink(QVideoSink(self))
+        self.captureSession.videoSink().videoFrameChanged.connect(self.onFramePassedFromCamera)
+
+    @Slot(QVideoFrame)  # type: ignore
+    def onFramePassedFromCamera(self, frame: QVideoFrame) -> None:
+        arrival_ns = self.clock()
+        if self.replayer:
+            return  # The worker is busy with a replay
+
+        if self.recording_path:
+            self.record_frame(frame)
 
-# from src.DataClasses import Sample
+        dispatched = self.dispatch(frame.startTime(), arrival_ns)
+        if dispatched:
+            self.frameSenders[dispatched[0]].OnFrameChanged.emit(frame, *dispatched[1:])
+
+    @Slot(object, int)  # type: ignore
+    def onGrayFramePassed(self, gray: npt.NDArray[np.uint8], frame_time_us: int) -> None:
+        """Takes a frame that is already a 2D uint8 array, e.g. from a SyntheticCamera, down the camera's path."""
+        arrival_ns = self.clock()
+        if self.replayer:
+            return
+
+        if self.recording_path:
+            self.record_gray(gray, frame_time_us)
+
+        dispatched = self.dispatch(frame_time_us, arrival_ns)
+        if dispatched:
+            self.frameSenders[dispatched[0]].OnGrayFrameChanged.emit(gray, *dispatched[1:])
+
+    def dispatch(self, frame_time_us: int, arrival_ns: int) -> Optional[Tuple[int, int, bool]]:
+        """
+        Counts a live frame and hands out a worker for it.
+
+        Returns:
+        The worker's index, the frame's sequence number and if it is displayed, None when every
+        worker is busy and the frame is dropped.
+        """
+        self.stats.count("received")
+        index = self.take_ready_worker()
+        if index is None:
+            self.stats.count("dropped")
+            return None
+
+        sequence = self.sequence
+        self.frame_times[sequence] = (frame_time_us, arrival_ns)
+        self.sequence += 1
+        return index, sequence, self.display_due(arrival_ns)
+
+    def display_due(self, arrival_ns: int) -> bool:
+        """Returns if a frame that arrived at `arrival_ns` should be displayed, keeping to display_rate_hz."""
+        if arrival_ns < self.next_display_ns:
+            return False
+
+        # Scheduled from the arrival rather than the last due time, so a stall doesn't cause a burst
+        self.next_display_ns = arrival_ns + int(1e9 / self.display_rate_hz) if self.display_rate_hz > 0 else 0
+        return True
+
+    def take_ready_worker(self) -> Optional[int]:
+        """
+        Returns the next ready worker in round robin order and marks it busy, None if all are busy.
+
+        Every worker's analyser keeps its own tracking state, so while the analysers track the line
+        from frame to frame (a tracking estimator or the region of interest) only the first worker
+        is used. It then sees every frame it analyses in order, and frames are dropped instead.
+        """
+        count = len(self.frameWorkers)
+        if count and self.frameWorkers[0].analyser.is_tracking():
+            count = 1
+        for offset in range(count):
+            index = (self.next_worker + offset) % count
+            if self.frameWorkers[index].ready:
+                # Marked here rather than in the worker so a second frame can't be sent before it starts
+                self.frameWorkers[index].ready = False
+                self.next_worker = index + 1
+                return index
+        return None
+
+    @Slot(FastData)  # type: ignore
+    def onFrameAnalysed(self, data: FastData) -> None:
+        data.frame_time_us, data.host_time_ns = self.frame_times.pop(data.sequence, (-1, -1))
+        data.sensor = self.sensor
+        self.release(self.reorder_buffer.push(data.sequence, data))
+        self.OnFrameDone.emit(data.sequence)
+
+    @Slot(int)  # type: ignore
+    def onFrameSkipped(self, sequence: int) -> None:
+        self.frame_times.pop(sequence, None)
+        self.release(self.reorder_buffer.skip(sequence))
+        self.OnFrameDone.emit(sequence)
+
+    def release(self, results: List[FastData]) -> None:
+        """Passes on results that are back in frame order, with the previews of the displayed ones."""
+        for result in results:
+            if result.preview is not None:
+                self.OnSensorFeedUpdate.emit(result.preview)
+            self.OnAnalyserUpdate.emit(result)
+
+    def set_analyser_option(self, name: str, value: Any) -> None:
+        """Sets an attribute of every worker's FrameAnalyser, e.g. "smoothing" or "estimator"."""
+        for worker in self.frameWorkers:
+            setattr(worker.analyser, name, value)
+
+    def set_band_option(self, name: str, value: Any) -> None:
+        """Sets an attribute of every worker's BandTracker, e.g. "margin"."""
+        for worker in self.frameWorkers:
+            setattr(worker.analyser.band_tracker, name, value)
+
+    def set_sensor_width_mm(self, sensor_width_mm: float) -> None:
+        for worker in self.frameWorkers:
+            worker.set_sensor_width_mm(sensor_width_mm)
+
+    def shutdown(self) -> None:
+        self.stop_synthetic_camera()
+        for worker_thread in self.workerThreads:
+            worker_thread.quit()
+        for worker_thread in self.workerThreads:
+            worker_thread.wait()
+        for worker in self.frameWorkers:
+            worker.close()
+
+    def start_recording(self, path: str, max_bytes: int = 2 * 1024**3) -> None:
+        """Records every frame from the camera to `path`, including the ones the worker has to drop."""
+        self.stop_recording()
+        self.recording_path = path
+        self.recording_max_bytes = max_bytes
+
+    def stop_recording(self) -> None:
+        if self.recorder:
+            self.recorder.close()
+        self.recorder = None
+        self.recording_path = ""
+
+    def record_frame(self, frame: QVideoFrame) -> None:
+        with mapped_luma(frame) as (gray, _):
+            if gray is not None:
+                self.record_gray(gray, frame.startTime())
+
+    def record_gray(self, gray: npt.NDArray[np.uint8], timestamp_us: int) -> None:
+        # The file is sized from the first frame
+        if self.recorder is None:
+            self.recorder = FrameRecorder(self.recording_path, gray.shape[0], gray.shape[1], self.recording_max_bytes)
+
+        self.recorder.write(gray, timestamp_us)
+
+    def start_replay(self, path: str, recorded_speed: bool = True) -> None:
+        """Replays a recording through the first frame worker, live camera frames are ignored meanwhile."""
+        self.stop_replay()
+        self.replayer = FrameReplayer(FrameRecording(path), recorded_speed)
+        self.replayer.OnFrameChanged.connect(self.send_replay_frame)
+        self.replayer.OnFinished.connect(self.stop_replay)
+        self.OnFrameDone.connect(self.replayer.frame_done)  # Skipped frames move the replay on too
+        self.replayer.start()
+
+    def stop_replay(self) -> None:
+        if self.replayer:
+            self.replayer.stop()
+            self.OnFrameDone.disconnect(self.replayer.frame_done)
+        self.replayer = None
+
+    @Slot(object, int)  # type: ignore
+    def send_replay_frame(self, gray: npt.NDArray[np.uint8], frame_time_us: int) -> None:
+        arrival_ns = self.clock()
+        self.frame_times[self.sequence] = (frame_time_us, arrival_ns)
+        self.frameSenders[0].OnGrayFrameChanged.emit(gray, self.sequence, self.display_due(arrival_ns))
+        self.sequence += 1
+
+    def start_synthetic_camera(self, camera: SyntheticCamera) -> None:
+        """Takes the frames from `camera` instead of the webcam, e.g. to load test the pipeline headless."""
+        self.stop_synthetic_camera()
+        if self.camera:
+            self.camera.stop()
+
+        self.synthetic_camera = camera
+        camera.OnFrameChanged.connect(self.onGrayFramePassed)
+        camera.start()
+
+    def stop_synthetic_camera(self) -> None:
+        if self.synthetic_camera:
+            self.synthetic_camera.stop()
+            self.synthetic_camera.OnFrameChanged.disconnect(self.onGrayFramePassed)
+        self.synthetic_camera = None
+
+    def set_camera(self, index: int) -> None:
+        self.stop_synthetic_camera()
+        if self.camera:
+            self.camera.stop()
+
+        available_cameras = QMediaDevices.videoInputs()
+        if not 0 <= index < len(available_cameras):
+            return
+
+        camera_info = available_cameras[index]
+        self.camera = QCamera(cameraDevice=camera_info, parent=self)
+
+        self.captureSession.setCamera(self.camera)
+        self.camera.start()
 
 
 class Core(QObject):  # type: ignore
+    """
+    The measurement side of the application: the camera sessions and the static samples.
+
+    There is one CameraSession per mounted sensor, the first one is the main sensor whose
+    measurements and preview the signals below pass on. Every session runs its own workers. Worker
+    threads share the GIL, which keeps the analysis of all sessions to about one core, with the
+    "process" backend every worker analyses on a core of its own and a second sensor takes cores
+    of its own instead of half of the first one's.
+
+    Args:
+    num_workers: frame workers per sensor, the cores shared out between the sensors by default.
+    num_sensors: camera sessions to start with, more can be added with add_sensor.
+    backend: where the frame workers analyse frames, "thread" or "process", see CameraSession.
+    """
+
     OnSensorFeedUpdate = Signal(QPixmap)
-    OnAnalyserUpdate = Signal(list)
+    OnAnalyserUpdate = Signal(FastData)  # analysed frames of the main sensor, in the order they were captured
     OnSubsampleProgressUpdate = Signal(list)
     OnSampleComplete = Signal()
     OnUnitsChanged = Signal(str)
 
-    def __init__(self) -> None:
+    def __init__(self, num_workers: int = 0, num_sensors: int = 1, backend: str = "thread") -> None:
         super().__init__()
 
         self.pixmap = None  # pixmap used for the camera feed
         self.histo = None  # histogram values used in analyser
-        self.camera = QCamera()  # camera being used
         self.centre = 0.0  # The found centre of the histogram
         self.zero = 0.0  # The zero point
         self.analyser_widget_height = 0  # The height of the widget so we can calculate the offset
-        self.subsamples = 0  # total number of subsamples
-        self.outliers = 0  # percentage value of how many outliers to remove from a sample
+        self.subsamples = 30  # total number of subsamples
+        self.outliers = 10  # percentage value of how many outliers to remove from a sample
         self.units = ""  # string representing the units
         self.sensor_width = 0  # width of the sensor in millimeters (mm)
         self.setting_zero_sample = False  # boolean if we are setting zero or a sample
         self.replacing_sample = False  # If we are replacing a sample
         self.replacing_sample_index = 0  # the index of the sample we are replacing
         self.line_data = np.empty(0)  # numpy array of the fitted line through the samples
-        # self.samples: list[Sample] = []
+        self.samples: List[Sample] = []  # static point measurements, relative to zero
+        self.sample_worker = SubsampleBuffer()  # averages the frames of the sample being taken
 
-        # Frame worker
-        self.workerThread = QThread()
-        self.captureSession = QMediaCaptureSession()
-        self.frameSender = FrameSender()
-        self.frameWorker = FrameWorker(parent_obj=self)
-        self.frameWorker.moveToThread(self.workerThread)
-        self.workerThread.start()
+        # Camera sessions, one per sensor, all stamping their frames from the same clock
+        self.clock = time.monotonic_ns
+        self.num_workers = num_workers or default_worker_count(num_sensors)
+        self.backend = backend
+        self.display_rate_hz = 30.0
+        self.sessions: List[CameraSession] = []
+        for _ in range(num_sensors):
+            self.add_sensor()
 
-        self.captureSession.setVideoSink(QVideoSink(self))
-        self.captureSession.videoSink().videoFrameChanged.connect(self.onFramePassedFromCamera)
-        self.frameSender.OnFrameChanged.connect(self.frameWorker.setVideoFrame)
+        self.OnAnalyserUpdate.connect(self.subsample_progress_update)
 
-    # def subsample_progress_update(self, subsample: Sample) -> None:
-    #     self.OnSubsampleProgressUpdate.emit([subsample, self.subsamples])  # current sample and total
+    @property
+    def session(self) -> CameraSession:
+        """The main sensor's session."""
+        return self.sessions[0]
+
+    @property
+    def stats(self) -> PipelineStats:
+        return self.session.stats
+
+    def add_sensor(self, num_workers: int = 0) -> CameraSession:
+        """Starts the session of one more sensor, its measurements come from the session's OnAnalyserUpdate."""
+        session = CameraSession(len(self.sessions), num_workers or self.num_workers, self.clock, self.backend)
+        session.display_rate_hz = self.display_rate_hz
+        if not self.sessions:
+            session.OnAnalyserUpdate.connect(self.OnAnalyserUpdate)
+            session.OnSensorFeedUpdate.connect(self.OnSensorFeedUpdate)
+        self.sessions.append(session)
+        return session
+
+    @Slot(FastData)  # type: ignore
+    def subsample_progress_update(self, data: FastData) -> None:
+        """Adds a measured frame to the sample being taken, and stores the sample once it is complete."""
+        if not self.sample_worker.active:
+            return
+
+        complete = self.sample_worker.push(data.sample_micron_value, data.sample_pixel_space_value)
+        self.OnSubsampleProgressUpdate.emit([self.sample_worker.count, self.sample_worker.subsamples])  # done, total
+        if not complete:
+            return
+
+        self.sample_worker.stop()
+        sample = self.sample_worker.result()
+        if sample is None:
+            return
+        if self.setting_zero_sample:
+            self.zero = sample.micron
+        sample.micron -= self.zero
+
+        if self.replacing_sample and 0 <= self.replacing_sample_index < len(self.samples):
+            self.samples[self.replacing_sample_index] = sample
+        else:
+            self.samples.append(sample)
+        self.OnSampleComplete.emit()
 
     def set_units(self, units: str) -> None:
         self.units = units
@@ -71,14 +430,54 @@ class Core(QObject):  # type: ignore
         if zero:  # if we are zero, we reset everything
             self.line_data = np.empty(0)
             self.zero = 0.0
+            self.samples = []
 
         self.setting_zero_sample = zero
         self.sample_worker.start(self.subsamples, self.outliers)
+        self.OnSubsampleProgressUpdate.emit([0, self.sample_worker.subsamples])
 
-    @Slot(QVideoFrame)  # type: ignore
-    def onFramePassedFromCamera(self, frame: QVideoFrame):
-        if self.frameWorker.ready:
-            self.frameSender.OnFrameChanged.emit(frame)
+    def set_display_rate(self, display_rate_hz: float) -> None:
+        self.display_rate_hz = display_rate_hz
+        for session in self.sessions:
+            session.display_rate_hz = display_rate_hz
+
+    def set_analyser_option(self, name: str, value: Any) -> None:
+        """Sets an attribute of every worker's FrameAnalyser on every sensor, e.g. "smoothing" or "estimator"."""
+        for session in self.sessions:
+            session.set_analyser_option(name, value)
+
+    def set_band_option(self, name: str, value: Any) -> None:
+        """Sets an attribute of every worker's BandTracker on every sensor, e.g. "margin"."""
+        for session in self.sessions:
+            session.set_band_option(name, value)
+
+    def set_sensor_width_mm(self, sensor_width_mm: float) -> None:
+        for session in self.sessions:
+            session.set_sensor_width_mm(sensor_width_mm)
+
+    def reset_stats(self) -> None:
+        for session in self.sessions:
+            session.stats.reset()
+
+    def shutdown(self) -> None:
+        for session in self.sessions:
+            session.shutdown()
+
+    def start_recording(self, path: str, max_bytes: int = 2 * 1024**3) -> None:
+        """Records the frames of every sensor, the main one to `path` and the others next to it."""
+        for session in self.sessions:
+            session.start_recording(sensor_path(path, session.sensor), max_bytes)
+
+    def stop_recording(self) -> None:
+        for session in self.sessions:
+            session.stop_recording()
+
+    def start_replay(self, path: str, recorded_speed: bool = True) -> None:
+        """Replays a recording through the main sensor's session, its live frames are ignored meanwhile."""
+        self.session.start_replay(path, recorded_speed)
+
+    def stop_replay(self) -> None:
+        self.session.stop_replay()
 
     def get_cameras(self) -> list[str]:
         cams = []
@@ -87,16 +486,11 @@ class Core(QObject):  # type: ignore
 
         return cams
 
-    def set_camera(self, index: int) -> None:
-        if self.camera:
-            self.camera.stop()
+    def set_camera(self, index: int, sensor: int = 0) -> None:
+        self.sessions[sensor].set_camera(index)
 
-        available_cameras = QMediaDevices.videoInputs()
-        if not available_cameras:
-            return
-
-        camera_info = available_cameras[index]
-        self.camera = QCamera(cameraDevice=camera_info, parent=self)
+    def start_synthetic_camera(self, camera: SyntheticCamera, sensor: int = 0) -> None:
+        self.sessions[sensor].start_synthetic_camera(camera)
 
-        self.captureSession.setCamera(self.camera)
-        self.camera.start()
+    def stop_synthetic_camera(self, sensor: int = 0) -> None:
+        self.sessions[sensor].stop_synthetic_camera()
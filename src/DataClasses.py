@@ -1,13 +1,129 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import Optional
+from typing import Sequence
+from typing import TYPE_CHECKING
 
-from PySide6.QtGui import QPixmap
+import numpy as np
+import numpy.typing as npt
+
+if TYPE_CHECKING:  # Only needed for annotations, keeps the sample types usable without Qt
+    from PySide6.QtGui import QPixmap
+
+# One stored measurement. Times are -1 when unknown, e.g. for samples loaded from old pickles.
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("sequence", "<i8"),  # monotonic frame number, gaps are frames that were dropped
+        ("frame_time_us", "<i8"),  # QVideoFrame start time in microseconds
+        ("host_time_ns", "<i8"),  # time.monotonic_ns() when the frame arrived from the camera
+        ("pixel", "<f8"),  # peak position in pixels
+        ("micron", "<f8"),  # peak offset from the sensor middle in microns
+        ("contrast", "<f4"),  # peak to background difference in grey levels, low values are unreliable fits
+        ("estimator_ms", "<f4"),  # time the peak estimator took
+    ]
+)
 
 
 @dataclass
 class FastData:
-    def __init__(self, pixmap: QPixmap, sample_pixel_space_value: float, sample_micron_value: float) -> None:
+    def __init__(
+        self,
+        pixmap: Optional[QPixmap],
+        sample_pixel_space_value: float,
+        sample_micron_value: float,
+        estimator_ms: float = 0.0,
+        sequence: int = -1,
+        frame_time_us: int = -1,
+        host_time_ns: int = -1,
+        contrast: float = 0.0,
+        sensor: int = 0,
+        preview: Optional[QPixmap] = None,
+    ) -> None:
         self.pixmap = pixmap
         self.sample_pixel_space_value = sample_pixel_space_value
         self.sample_micron_value = sample_micron_value
+        self.estimator_ms = estimator_ms  # time spent finding the peak in milliseconds
+        self.sequence = sequence  # order the frame was dispatched in, -1 when it was not numbered
+        self.frame_time_us = frame_time_us  # QVideoFrame start time in microseconds
+        self.host_time_ns = host_time_ns  # time.monotonic_ns() when the frame arrived
+        self.contrast = contrast  # peak to background difference of the profile in grey levels
+        self.sensor = sensor  # index of the camera session that measured it
+        self.preview = preview  # the rotated camera frame of a displayed frame, None when it isn't displayed
+
+
+@dataclass
+class Sample:
+    """A static point measurement, averaged over subsamples with the outliers dropped."""
+
+    micron: float  # trimmed mean offset from the sensor middle in microns
+    pixel: float  # trimmed mean peak position in pixels
+    subsamples: int  # measurements the mean was taken over, after dropping the outliers
+    spread_um: float  # standard deviation of those measurements, how repeatable the sample was
+
+
+class SampleBuffer:
+    """
+    Growable structured array of SAMPLE_DTYPE measurements.
+
+    The storage doubles when it is full, so appending a sample is amortised O(1) and the samples
+    are always available as one contiguous array.
+    """
+
+    def __init__(self, capacity: int = 4096) -> None:
+        self.buffer = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def samples(self) -> npt.NDArray[np.void]:
+        """The stored samples, a view that is only valid until the next append."""
+        return self.buffer[: self.count]
+
+    def clear(self) -> None:
+        self.count = 0
+
+    def reserve(self, count: int) -> None:
+        if count > self.buffer.shape[0]:
+            buffer = np.zeros(max(count, 2 * self.buffer.shape[0]), dtype=SAMPLE_DTYPE)
+            buffer[: self.count] = self.buffer[: self.count]
+            self.buffer = buffer
+
+    def append(self, data: FastData) -> None:
+        self.reserve(self.count + 1)
+        self.buffer[self.count] = (
+            data.sequence,
+            data.frame_time_us,
+            data.host_time_ns,
+            data.sample_pixel_space_value,
+            data.sample_micron_value,
+            data.contrast,
+            data.estimator_ms,
+        )
+        self.count += 1
+
+    def extend(self, samples: npt.NDArray[np.void]) -> None:
+        start, end = self.count, self.count + samples.shape[0]
+        self.reserve(end)
+        self.buffer[start:end] = samples
+        self.count = end
+
+    @classmethod
+    def from_samples(cls, samples: npt.NDArray[np.void]) -> SampleBuffer:
+        """Builds a buffer that stores its samples in `samples`, a SAMPLE_DTYPE array, without copying them."""
+        buffer = cls(0)
+        buffer.buffer = samples
+        buffer.count = samples.shape[0]
+        return buffer
+
+    @classmethod
+    def from_values(cls, values: Sequence[float]) -> SampleBuffer:
+        """Builds a buffer from bare micron values, as stored by older versions."""
+        samples = np.zeros(len(values), dtype=SAMPLE_DTYPE)
+        samples["sequence"] = np.arange(len(values))
+        samples["frame_time_us"] = -1
+        samples["host_time_ns"] = -1
+        samples["micron"] = values
+        return cls.from_samples(samples)
@@ -6,9 +6,11 @@ from typing import Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
+import numpy.typing as npt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PySide6.QtCore import QRegularExpression
 from PySide6.QtCore import Qt
+from PySide6.QtCore import QTimer
 from PySide6.QtCore import Signal
 from PySide6.QtGui import QColor
 from PySide6.QtGui import QFont
@@ -19,6 +21,7 @@ from PySide6.QtGui import QPen
 from PySide6.QtGui import QPixmap
 from PySide6.QtGui import QRegularExpressionValidator
 from PySide6.QtGui import QResizeEvent
+from PySide6.QtWidgets import QLabel
 from PySide6.QtWidgets import QLineEdit
 from PySide6.QtWidgets import QSizePolicy
 from PySide6.QtWidgets import QTableWidgetItem
@@ -26,6 +29,8 @@ from PySide6.QtWidgets import QVBoxLayout
 from PySide6.QtWidgets import QWidget
 
 from src.DataClasses import FastData
+from src.instrumentation import PipelineStats
+from src.lod import TracePyramid
 from src.utils import get_units
 
 # from src.DataClasses import Sample
@@ -52,13 +57,51 @@ style = {
 }
 plt.style.use(style)
 
+# Label and colour of the samples1 and samples2 traces of the Graph
+TRACE_STYLES = (("Counterclockwise", "blue"), ("Clockwise", "red"))
+
+
+class LiveTrace:
+    """
+    Polar points of a trace that is still being measured, in preallocated arrays.
+
+    When the arrays are full every other point is dropped and from then on only every other
+    incoming point is kept, so memory and drawing cost stay bounded however long the run is.
+    """
+
+    def __init__(self, capacity: int = 1 << 13) -> None:
+        self.theta = np.empty(capacity)
+        self.r = np.empty(capacity)
+        self.count = 0
+        self.stride = 1  # keep one of every `stride` incoming points
+        self.seen = 0
+
+    def append(self, theta: float, r: float) -> None:
+        self.seen += 1
+        if (self.seen - 1) % self.stride:
+            return
+
+        if self.count == self.theta.shape[0]:
+            kept = slice(0, self.count, 2)
+            half = self.count // 2
+            self.theta[:half] = self.theta[kept]
+            self.r[:half] = self.r[kept]
+            self.count = half
+            self.stride *= 2
+
+        self.theta[self.count] = theta
+        self.r[self.count] = r
+        self.count += 1
+
 
 class Graph(QWidget):
     def __init__(self, padding: float = 0.05):
         super().__init__()
 
-        self.samples1: List[float] = []
-        self.samples2: List[float] = []
+        self.samples1: npt.NDArray[np.float64] = np.zeros(0)
+        self.samples2: npt.NDArray[np.float64] = np.zeros(0)
+        self.theta1: Optional[np.ndarray] = None  # angles of samples1, evenly spaced when None
+        self.theta2: Optional[np.ndarray] = None  # angles of samples2, evenly spaced when None
         self.units = ""
         self.padding = padding  # Padding variable
 
@@ -81,34 +124,125 @@ class Graph(QWidget):
 
         main_layout.addWidget(self.canvas)
 
+        # Live mode, the trace is drawn while the run is going
+        self.live = False
+        self.live_traces: List[LiveTrace] = []
+        self.live_lines: List[Any] = []
+        self.live_dirty = False
+        self.background: Any = None  # the axes without the live lines, restored before blitting
+        self.live_timer = QTimer(self)
+        self.live_timer.timeout.connect(self.redraw_live)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+        # Level of detail, traces are drawn from min/max pyramids at the resolution of the plot
+        self.pyramids: List[TracePyramid] = []
+        self.lines: List[Any] = []
+        self.lod_budget = 0  # points per trace the lines were last decimated to
+        self.canvas.mpl_connect("resize_event", self.on_resize)
+
+    def start_live(self, lap_time_s: float, threshold: float, max_redraw_hz: float = 10.0) -> None:
+        """
+        Plots samples as they are added with `add_live_sample`, at most `max_redraw_hz` times a second.
+
+        Only the trace lines are redrawn, onto a saved copy of the axes. Samples above `threshold`
+        are off the sensor, each time the line comes back on the sensor a new rotation starts and
+        the direction flips. Angles come from the sample times and the expected `lap_time_s`.
+        """
+        self.live = True
+        self.lap_time_s = lap_time_s
+        self.threshold = threshold
+        self.rotation = -1  # index of the current rotation, -1 before the first one
+        self.rotation_start = 0.0
+        self.on_sensor = False
+        self.live_traces = [LiveTrace(), LiveTrace()]
+
+        self.ax.clear()
+        self.lines = []
+        self.live_lines = [
+            self.ax.plot([], [], label=label, color=color, animated=True)[0] for label, color in TRACE_STYLES
+        ]
+        self.ax.set_ylim(-1.0, 1.0)
+        self.ax.legend()
+        self.canvas.draw()  # Saves the background through on_draw
+        self.live_timer.start(int(1000 / max_redraw_hz))
+
+    def add_live_sample(self, micron: float, time_s: float) -> None:
+        if not self.live:
+            return
+
+        if micron > self.threshold:
+            self.on_sensor = False
+            return
+        if not self.on_sensor:
+            self.on_sensor = True
+            self.rotation += 1
+            self.rotation_start = time_s
+
+        # The rotations alternate counterclockwise and clockwise, in the order of TRACE_STYLES and run_steps
+        direction = self.rotation % 2
+        theta = 2 * np.pi * (time_s - self.rotation_start) / self.lap_time_s
+        self.live_traces[direction].append(theta if direction == 0 else -theta, micron)
+        self.live_dirty = True
+
+    def stop_live(self) -> None:
+        self.live_timer.stop()
+        self.live = False
+        self.live_traces = []
+        self.live_lines = []
+        self.background = None
+
+    def on_draw(self, event: Any) -> None:
+        """Saves the freshly drawn axes for blitting and draws the live lines on top."""
+        if not self.live:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for line in self.live_lines:
+            self.ax.draw_artist(line)
+
+    def redraw_live(self) -> None:
+        if not self.live_dirty or self.background is None:
+            return
+        self.live_dirty = False
+
+        for line, trace in zip(self.live_lines, self.live_traces):
+            line.set_data(trace.theta[: trace.count], trace.r[: trace.count])
+
+        # A new radial range changes the grid, so the whole canvas has to be drawn again
+        filled = [trace for trace in self.live_traces if trace.count]
+        if filled:
+            r_min = min(trace.r[: trace.count].min() for trace in filled)
+            r_max = max(trace.r[: trace.count].max() for trace in filled)
+            low, high = self.ax.get_ylim()
+            if r_min < low or r_max > high:
+                padding = 0.25 * max(r_max - r_min, 1.0)
+                self.ax.set_ylim(min(low, r_min - padding), max(high, r_max + padding))
+                self.canvas.draw()
+                return
+
+        self.canvas.restore_region(self.background)
+        for line in self.live_lines:
+            self.ax.draw_artist(line)
+        self.canvas.blit(self.ax.bbox)
+
     def update_graph(self) -> None:
         # Clear the axis and plot the data
         self.ax.clear()
+        self.lines = []
 
-        if not self.samples1 and not self.samples2:
+        if not len(self.samples1) and not len(self.samples2):
             self.canvas.draw()
             return
 
-        num_samples1 = len(self.samples1)
-        num_samples2 = len(self.samples2)
-        theta1 = np.linspace(0, 2 * np.pi, num_samples1, endpoint=False)
-        theta2 = np.linspace(0, 2 * np.pi, num_samples2, endpoint=False)
-        r1 = np.array(self.samples1)
-        r2 = np.array(self.samples2)
-
-        # Ensure the graph wraps around by appending the first point to the end
-        theta1 = np.concatenate([theta1, [theta1[0]]])
-        r1 = np.concatenate([r1, [r1[0]]])
-        theta2 = np.concatenate([theta2, [theta2[0]]])
-        r2 = np.concatenate([r2, [r2[0]]])
-
-        # Plot data points for both datasets
-        self.ax.plot(theta1, r1, marker="", markersize=5, label="Counterclockwise", color="blue")
-        self.ax.plot(theta2, r2, marker="", markersize=5, label="Clockwise", color="red")
+        # Plot data points for both datasets, decimated to what the plot can show
+        self.lod_budget = self.point_budget()
+        for pyramid, (label, color) in zip(self.pyramids, TRACE_STYLES):
+            theta, r = pyramid.points(self.lod_budget)
+            self.lines.append(self.ax.plot(theta, r, marker="", markersize=5, label=label, color=color)[0])
 
         # Adjust radial limits based on data
-        r_min = min(np.min(r1), np.min(r2))
-        r_max = max(np.max(r1), np.max(r2))
+        ranges = [pyramid.r_range for pyramid in self.pyramids if len(pyramid)]
+        r_min = min(low for low, _ in ranges)
+        r_max = max(high for _, high in ranges)
         r_range = r_max - r_min
         padding = 0.1 * r_range  # Add some padding around the data
 
@@ -117,16 +251,49 @@ class Graph(QWidget):
         self.ax.legend()
         self.canvas.draw()
 
-    def set_data(self, new_samples1: List[float], new_samples2: List[float]) -> None:
+    def point_budget(self) -> int:
+        """Returns how many points a trace needs at the current size, a min and a max per pixel of the circle."""
+        side = min(self.canvas.width(), self.canvas.height()) * self.canvas.devicePixelRatioF()
+        return max(int(2 * np.pi * side * (1 - 2 * self.padding)), 256)
+
+    def on_resize(self, event: Any) -> None:
+        """Swaps in the pyramid level that matches the new size, the canvas redraws itself afterwards."""
+        if self.live or not self.lines:
+            return
+        budget = self.point_budget()
+        if all(pyramid.level_for(budget) == pyramid.level_for(self.lod_budget) for pyramid in self.pyramids):
+            return
+
+        self.lod_budget = budget
+        for line, pyramid in zip(self.lines, self.pyramids):
+            line.set_data(*pyramid.points(budget))
+
+    def set_data(
+        self,
+        new_samples1: npt.NDArray[np.float64],
+        new_samples2: npt.NDArray[np.float64],
+        new_theta1: Optional[np.ndarray] = None,
+        new_theta2: Optional[np.ndarray] = None,
+    ) -> None:
         """
         Update the graph with two sets of sample data.
 
         Args:
-            new_samples1 (list): A list of float values representing the first set of sample data.
-            new_samples2 (list): A list of float values representing the second set of sample data.
+            new_samples1 (array): The float values of the first set of sample data.
+            new_samples2 (array): The float values of the second set of sample data.
+            new_theta1 (array): Optional angles in radians of the first set, e.g. from their timestamps.
+            new_theta2 (array): Optional angles in radians of the second set.
         """
         self.samples1 = new_samples1
         self.samples2 = new_samples2
+        self.theta1 = new_theta1
+        self.theta2 = new_theta2
+
+        self.pyramids = []
+        for samples, theta in ((new_samples1, new_theta1), (new_samples2, new_theta2)):
+            if theta is None:
+                theta = np.linspace(0, 2 * np.pi, len(samples), endpoint=False)
+            self.pyramids.append(TracePyramid(theta, samples))
         self.update_graph()
 
 
@@ -168,6 +335,7 @@ class AnalyserWidget(QWidget):  # type: ignore
         self.sample = 0  # location of the sample in pixel space on the widget
         self.zero = 960  # Center of the widget for zero (half of the sensor width)
         self.text = ""  # Text to display shows the distance from zero
+        self.cost_text = ""  # Text showing how long the peak estimator took
         self.sensor_height_mm = sensor_height_mm  # Height of the sensor in mm
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 
@@ -202,7 +370,16 @@ class AnalyserWidget(QWidget):  # type: ignore
             y = sample_y - (text_height / 2)
             painter.drawText(int(x), int(y), self.text)
 
+        # Display the estimator cost in the corner so estimators can be compared live
+        if self.cost_text:
+            painter.setFont(QFont("Arial", 9))
+            painter.setPen(Qt.gray)
+            painter.drawText(4, self.height() - 4, self.cost_text)
+
     def set_data(self, data: FastData) -> None:
+        if data.pixmap is None:
+            return  # Measured but not displayed, the widget only follows the display rate
+
         self.pixmap = data.pixmap
 
         # Calculate the sample position relative to zero, using the input range (0.0-1920.0)
@@ -210,9 +387,54 @@ class AnalyserWidget(QWidget):  # type: ignore
 
         # Update the text to show the distance from zero in microns
         self.text = f"{data.sample_micron_value:+.2f} µm"
+        self.cost_text = f"fit {data.estimator_ms:.2f} ms"
         self.update()
 
 
+class StatsWidget(QWidget):  # type: ignore
+    def __init__(self, stats: PipelineStats, interval_ms: int = 1000) -> None:
+        super().__init__()
+        self.stats = stats
+        self.last_processed = 0
+        self.last_received = 0
+
+        self.label = QLabel()
+        self.label.setFont(QFont("Monospace", 9))
+        self.label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.label)
+        self.setLayout(layout)
+
+        # Refresh on a timer rather than per frame so the panel costs nothing on the frame path
+        self.interval_ms = interval_ms
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(interval_ms)
+
+    def refresh(self) -> None:
+        stats = self.stats
+        seconds = self.interval_ms / 1000.0
+
+        # The counters restart when the stats are reset at the start of a run
+        received_fps = max(stats.received - self.last_received, 0) / seconds
+        processed_fps = max(stats.processed - self.last_processed, 0) / seconds
+        self.last_received, self.last_processed = stats.received, stats.processed
+
+        lines = [
+            f"received  {stats.received:>8}  {received_fps:6.1f} fps",
+            f"processed {stats.processed:>8}  {processed_fps:6.1f} fps",
+            f"dropped   {stats.dropped:>8}",
+            "",
+            f"{'stage':<11}{'mean':>8}{'p95':>8}{'max':>8}  ms",
+        ]
+        for name, histogram in stats.stages.items():
+            mean_ms, p95_ms, max_ms = histogram.mean * 1000, histogram.percentile(95) * 1000, histogram.max * 1000
+            lines.append(f"{name:<11}{mean_ms:8.2f}{p95_ms:8.2f}{max_ms:8.2f}")
+        self.label.setText("\n".join(lines))
+
+
 class TableUnit(QTableWidgetItem):  # type: ignore
     def __init__(self) -> None:
         super().__init__()
@@ -1,117 +1,345 @@
 from __future__ import annotations
 
+import time
+from contextlib import contextmanager
 from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Type
 
 import numpy as np
+import numpy.typing as npt
 import qimage2ndarray
+from PySide6.QtCore import QElapsedTimer
 from PySide6.QtCore import QObject
+from PySide6.QtCore import QTimer
 from PySide6.QtCore import Signal
 from PySide6.QtCore import Slot
 from PySide6.QtGui import QImage
 from PySide6.QtGui import QPixmap
 from PySide6.QtGui import QTransform
 from PySide6.QtMultimedia import QVideoFrame
+from PySide6.QtMultimedia import QVideoFrameFormat
 
-from src.curves import fit_gaussian
+from src.analyser_process import AnalyserProcess
 from src.DataClasses import FastData
+from src.instrumentation import PipelineStats
+from src.processing import FrameAnalyser
+from src.recording import FrameRecording
+
+
+def _luma_layouts() -> Dict[Any, Tuple[int, int, int]]:
+    """(plane, byte offset, byte step) of the luma bytes in each YUV pixel format Qt knows about."""
+    layouts = {
+        # 8 bit planar and semi-planar formats, the first plane is the grayscale image
+        "Format_NV12": (0, 0, 1),
+        "Format_NV21": (0, 0, 1),
+        "Format_YUV420P": (0, 0, 1),
+        "Format_YUV422P": (0, 0, 1),
+        "Format_YV12": (0, 0, 1),
+        "Format_IMC1": (0, 0, 1),
+        "Format_IMC2": (0, 0, 1),
+        "Format_IMC3": (0, 0, 1),
+        "Format_IMC4": (0, 0, 1),
+        "Format_Y8": (0, 0, 1),
+        # 16 bit little endian luma, MSB aligned so the high byte is the 8 bit value. YUV420P10 is LSB
+        # aligned, its high byte only holds the top 2 bits, so it goes through the QImage conversion.
+        "Format_Y16": (0, 1, 2),
+        "Format_P010": (0, 1, 2),
+        "Format_P016": (0, 1, 2),
+        # Packed formats, luma interleaved with chroma
+        "Format_YUYV": (0, 0, 2),
+        "Format_UYVY": (0, 1, 2),
+        "Format_AYUV": (0, 1, 4),
+        "Format_AYUV_Premultiplied": (0, 1, 4),
+    }
+    # Not every Qt version has every format
+    formats = QVideoFrameFormat.PixelFormat
+    return {getattr(formats, name): layout for name, layout in layouts.items() if hasattr(formats, name)}
+
+
+LUMA_LAYOUTS = _luma_layouts()
+
+
+@contextmanager
+def mapped_luma(frame: QVideoFrame) -> Iterator[Tuple[Optional[npt.NDArray[np.uint8]], Optional[QImage]]]:
+    """
+    Gives the luma of a video frame as a (H, W) uint8 array and a grayscale QImage of it.
+
+    YUV frames are mapped read-only and the luma plane is viewed in place with its own row stride,
+    no colour conversion or copy is made, so both are only valid inside the with block. Packed
+    formats need one strided copy to make the rows contiguous. RGB frames, or frames that can't be
+    mapped, go through the QImage grayscale conversion. Both are None for an invalid frame.
+    """
+    layout = LUMA_LAYOUTS.get(frame.pixelFormat())
+    if layout is None or not frame.map(QVideoFrame.MapMode.ReadOnly):
+        image = frame.toImage().convertToFormat(QImage.Format_Grayscale8)
+        try:
+            gray = qimage2ndarray.raw_view(image)
+        except ValueError as e:
+            print("Invalid QImage:", e)
+            yield None, None
+        else:
+            yield gray, image
+        return
+
+    try:
+        plane, offset, step = layout
+        height, width = frame.height(), frame.width()
+        stride = frame.bytesPerLine(plane)
+        rows = np.frombuffer(frame.bits(plane), dtype=np.uint8, count=stride * height).reshape(height, stride)
+        gray = rows[:, slice(offset, offset + width * step, step)]
+        if step == 1:
+            image = QImage(rows.data, width, height, stride, QImage.Format_Grayscale8)  # Shares the mapped memory
+        else:
+            gray = np.ascontiguousarray(gray)
+            image = QImage(gray.data, width, height, width, QImage.Format_Grayscale8)
+        yield gray, image
+    finally:
+        frame.unmap()
 
 
 class FrameWorker(QObject):  # type: ignore
-    OnPixmapChanged = Signal(QPixmap)
     OnAnalyserUpdate = Signal(FastData)
+    OnFrameSkipped = Signal(int)  # sequence number of a frame that could not be analysed
 
     def __init__(self, parent_obj: Any):
         super().__init__(None)
         self.ready = True
-        self.analyser_smoothing = 0
         self.centre = 0.0
         self.analyser_widget_height = 0
         self.parent_obj = parent_obj
         self.data_width = 0
 
-        self.sensor_width_mm = 10000000.0
+        self.analyser = FrameAnalyser()  # the Qt free measurement pipeline
+        self.scope_renderer = ScopeRenderer()
+        self.stats: Optional[PipelineStats] = None
 
     def set_sensor_width_mm(self, sensor_width_mm: float) -> None:
         if not sensor_width_mm:
-            self.sensor_width_mm = 0.0
+            self.analyser.sensor_width_mm = 0.0
         else:
-            self.sensor_width_mm = float(sensor_width_mm)
+            self.analyser.sensor_width_mm = float(sensor_width_mm)
 
-    @Slot(QVideoFrame)  # type: ignore
-    def setVideoFrame(self, frame: QVideoFrame) -> None:
+    @Slot(QVideoFrame, int, bool)  # type: ignore
+    def setVideoFrame(self, frame: QVideoFrame, sequence: int = -1, display: bool = True) -> None:
         self.ready = False
+        frame_data = None
+        try:
+            # Get the frame as a gray scale image, straight from the luma plane when there is one
+            conversion_start = time.perf_counter()
+            with mapped_luma(frame) as (gray, image):
+                if gray is not None:
+                    frame_data = self.process(gray, image if display else None, sequence, conversion_start)
+        except Exception as e:
+            print(f"Frame {sequence} could not be analysed:", e)
+        finally:
+            self.deliver(frame_data, sequence)
 
-        # Get the frame as a gray scale image
-        image = frame.toImage().convertToFormat(QImage.Format_Grayscale8)
+    @Slot(object, int, bool)  # type: ignore
+    def setGrayFrame(self, gray: npt.NDArray[np.uint8], sequence: int = -1, display: bool = True) -> None:
+        """Analyses a frame that is already a 2D uint8 array, e.g. one replayed from a recording."""
+        self.ready = False
+        frame_data = None
         try:
-            histo = np.mean(qimage2ndarray.raw_view(image), axis=0)
-        except ValueError as e:
-            print("Invalid QImage:", e)
+            conversion_start = time.perf_counter()
+            gray = np.ascontiguousarray(gray)
+            image = None
+            if display:
+                image = QImage(gray.data, gray.shape[1], gray.shape[0], gray.strides[0], QImage.Format_Grayscale8)
+
+            frame_data = self.process(gray, image, sequence, conversion_start)
+        except Exception as e:
+            print(f"Frame {sequence} could not be analysed:", e)
+        finally:
+            self.deliver(frame_data, sequence)
+
+    def process(
+        self, gray: npt.NDArray[np.uint8], image: Optional[QImage], sequence: int, conversion_start: float
+    ) -> FastData:
+        """
+        Measures a frame, and builds the preview and scope images when it is given the frame's QImage.
+
+        The measurement always runs on the native resolution profile. Only frames picked for
+        display pay for the pixmap conversion, the rotation and the scope render.
+        """
+        conversion_stop = time.perf_counter()
+
+        record, profile = self.analyse_frame(gray, image is not None)
+
+        # The preview travels with the measurement, so it is shown in frame order too
+        preview_start = time.perf_counter()
+        preview = None if image is None else QPixmap.fromImage(image).transformed(QTransform().rotate(-90))
+
+        render_start = time.perf_counter()
+        scope_image = None if image is None or profile is None else self.scope_renderer.render(profile)
+        render_stop = time.perf_counter()
+
+        if self.stats:
+            self.stats.record("conversion", conversion_stop - conversion_start)
+            if image is not None:
+                self.stats.record("preview", render_start - preview_start)
+            self.stats.record("render", render_stop - render_start)
+
+        return FastData(
+            scope_image,
+            float(record["pixel"]),
+            float(record["micron"]),
+            estimator_ms=self.analyser.estimator_ms,
+            sequence=sequence,
+            contrast=float(record["contrast"]),
+            preview=preview,
+        )
+
+    def analyse_frame(
+        self, gray: npt.NDArray[np.uint8], with_profile: bool
+    ) -> Tuple[np.void, Optional[npt.NDArray[np.float64]]]:
+        """Returns the measurement record of a frame, and the profile for the scope when `with_profile` is set."""
+        return self.analyser.analyse_frame(gray)
+
+    def deliver(self, frame_data: Optional[FastData], sequence: int) -> None:
+        """
+        Passes on the result of a frame and makes the worker ready for the next one.
+
+        Without a result, because the frame was invalid or analysing it failed, the frame is
+        reported with OnFrameSkipped, so the session doesn't wait for its sequence number.
+        """
+        self.ready = True
+        if frame_data is None:
+            self.OnFrameSkipped.emit(sequence)
             return
 
-        pixmap = QPixmap.fromImage(image).transformed(QTransform().rotate(-90))
+        emit_start = time.perf_counter()
+        self.OnAnalyserUpdate.emit(frame_data)
 
-        self.OnPixmapChanged.emit(pixmap)
+        if self.stats:
+            self.stats.record("emit", time.perf_counter() - emit_start)
+            self.stats.count("processed")
 
-        # Create the smoothing kernel
-        kernel = np.ones(2 * self.analyser_smoothing + 1) / (2 * self.analyser_smoothing + 1)
+    def set_stats(self, stats: Optional[PipelineStats]) -> None:
+        """Records the frame counts and stage timings of this worker into `stats`."""
+        self.stats = stats
+        self.analyser.stats = stats
 
-        # Apply convolution with 'valid' mode
-        smoothed_histo = np.convolve(histo, kernel, mode="valid")
+    def close(self) -> None:
+        """Releases what the worker holds outside its thread, called once the thread has finished."""
 
-        # Generate x values for interpolation
-        x = np.linspace(0, len(smoothed_histo) - 1, len(smoothed_histo))
-        x_new = np.linspace(0, len(smoothed_histo) - 1, pixmap.height())
 
-        # Interpolate to match original length
-        resized_histo = np.interp(x_new, x, smoothed_histo)
+class ProcessFrameWorker(FrameWorker):
+    """
+    A FrameWorker that analyses its frames in a process of its own.
 
-        # Find the min and max values
-        min_value, max_value = resized_histo.min(), resized_histo.max()
+    Threads running Python share the GIL, so more FrameWorkers on threads don't make use of more
+    cores. The thread of this worker only gets the luma and builds the images, and waits on the
+    AnalyserProcess meanwhile, which does the measurement on a core of its own. `analyser` holds
+    the settings, set_analyser_option changes it the same way as for a FrameWorker.
+    """
 
-        # Rescale the intensity values to have a range between 0 and 255
-        normal_histo = ((resized_histo - min_value) * (255.0 / (max_value - min_value))).clip(0, 255).astype(np.uint8)
+    def __init__(self, parent_obj: Any):
+        super().__init__(parent_obj)
+        self.analyser_process = AnalyserProcess(self.analyser)
 
-        # Generate the image
-        # Define the scope image data as the width (long side) of the image x 256 for pixels
-        scopeData = np.zeros((normal_histo.shape[0], 256), dtype=np.uint8)
+    def analyse_frame(
+        self, gray: npt.NDArray[np.uint8], with_profile: bool
+    ) -> Tuple[np.void, Optional[npt.NDArray[np.float64]]]:
+        return self.analyser_process.analyse_frame(gray, with_profile)
 
-        # Replace NaN values with 0
-        self.histo = np.nan_to_num(normal_histo)
+    def close(self) -> None:
+        self.analyser_process.close()
 
-        sample_pixel_position = fit_gaussian(self.histo)  # Specify the y position of the line
 
-        sensor_height_pixels = pixmap.height()
-        middle_pixel_position = sensor_height_pixels / 2
-        pixel_to_micron = self.sensor_width_mm / sensor_height_pixels * 1000
-        sample_micron_value = sample_pixel_position * pixel_to_micron
-        middle_micron_offset = middle_pixel_position * pixel_to_micron
-        sample_micron_value -= middle_micron_offset
+# Where frame workers analyse their frames, by name of the worker class
+worker_backends: Dict[str, Type[FrameWorker]] = {
+    "thread": FrameWorker,
+    "process": ProcessFrameWorker,
+}
 
-        # Set scope data
-        for i, intensity in enumerate(self.histo):
-            scopeData[i, : int(intensity)] = 128
 
-        # Create QImage directly from the scope data
-        qimage = QImage(
-            scopeData.data,
-            scopeData.shape[1],
-            scopeData.shape[0],
-            scopeData.strides[0],
-            QImage.Format_Grayscale8,
-        )
+class ScopeRenderer:
+    """
+    Draws the analyser scope image (one bar per histogram value) into a reused buffer.
 
-        # Create QPixmap from QImage
-        scope_image = QPixmap.fromImage(qimage)
+    The buffer and the QImage wrapping it are only rebuilt when the histogram length changes.
+    Rows are drawn bottom up, which replaces the vertical flip transform.
+    """
 
-        # Create a vertical flip transform and apply it to the QPixmap
-        scope_image = scope_image.transformed(QTransform().scale(1, -1))
+    def __init__(self) -> None:
+        self.columns = np.arange(256, dtype=np.uint8)
+        self.scope_data = np.zeros((0, 256), dtype=np.uint8)
+        self.qimage = QImage()
 
-        frame_data = FastData(scope_image, sample_pixel_position, sample_micron_value)
-        self.OnAnalyserUpdate.emit(frame_data)
+    def render(self, histo: npt.NDArray[np.float64]) -> QPixmap:
+        if self.scope_data.shape[0] != histo.shape[0]:
+            self.scope_data = np.zeros((histo.shape[0], 256), dtype=np.uint8)
 
-        self.ready = True
+            # The QImage shares the buffer memory, so it stays valid as long as the buffer does
+            self.qimage = QImage(
+                self.scope_data.data,
+                self.scope_data.shape[1],
+                self.scope_data.shape[0],
+                self.scope_data.strides[0],
+                QImage.Format_Grayscale8,
+            )
+
+        # Every pixel left of its row's (flipped) intensity is lit, in one broadcast comparison
+        np.less(self.columns, histo[::-1, None], out=self.scope_data.view(np.bool_))
+        self.scope_data *= 128
+
+        # fromImage copies the pixels, so the buffer can be reused for the next frame straight away
+        return QPixmap.fromImage(self.qimage)
 
 
 class FrameSender(QObject):  # type: ignore
-    OnFrameChanged = Signal(QVideoFrame)
+    OnFrameChanged = Signal(QVideoFrame, int, bool)  # frame, its sequence number and if it is displayed
+    OnGrayFrameChanged = Signal(object, int, bool)
+
+
+class FrameReplayer(QObject):  # type: ignore
+    """
+    Feeds the frames of a FrameRecording back into the frame pipeline.
+
+    Every frame is passed on with OnFrameChanged, the next one only after `frame_done` reported
+    the previous one back, analysed or skipped, so a replay always gives the same measurements.
+    At recorded speed the replay also waits until the frame's recorded time, otherwise it runs as
+    fast as the worker can go.
+    """
+
+    OnFrameChanged = Signal(object, int)  # frame and its recorded start time in microseconds
+    OnFinished = Signal()
+
+    def __init__(self, recording: FrameRecording, recorded_speed: bool = True) -> None:
+        super().__init__()
+        self.recording = recording
+        self.recorded_speed = recorded_speed
+        self.index = 0
+        self.clock = QElapsedTimer()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.send_frame)
+
+    def start(self) -> None:
+        self.index = 0
+        self.clock.start()
+        self.send_frame()
+
+    def stop(self) -> None:
+        self.timer.stop()
+        self.index = len(self.recording)
+
+    def send_frame(self) -> None:
+        if self.index >= len(self.recording):
+            self.OnFinished.emit()
+            return
+
+        self.OnFrameChanged.emit(self.recording.frame(self.index), self.recording.timestamp(self.index))
+        self.index += 1
+
+    @Slot(int)  # type: ignore
+    def frame_done(self, sequence: int) -> None:
+        delay = 0
+        if self.recorded_speed and self.index < len(self.recording):
+            due_us = self.recording.timestamp(self.index) - self.recording.timestamp(0)
+            delay = max(0, int(due_us / 1000 - self.clock.elapsed()))
+        self.timer.start(delay)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.instrumentation import PipelineStats
+from src.processing import FrameAnalyser
+
+# Attributes of a FrameAnalyser, and of its BandTracker, that are copied to the analyser in the process
+ANALYSER_SETTINGS = ("smoothing", "estimator", "sensor_width_mm", "roi_enabled")
+BAND_SETTINGS = ("margin", "row_fraction", "min_contrast")
+
+
+def analyser_settings(analyser: FrameAnalyser) -> Tuple[Any, ...]:
+    """Returns the settings of `analyser` that decide its measurements, as ANALYSER_SETTINGS then BAND_SETTINGS."""
+    return tuple(getattr(analyser, name) for name in ANALYSER_SETTINGS) + tuple(
+        getattr(analyser.band_tracker, name) for name in BAND_SETTINGS
+    )
+
+
+def apply_settings(analyser: FrameAnalyser, settings: Tuple[Any, ...]) -> None:
+    """Sets settings taken with analyser_settings on another analyser."""
+    for name, value in zip(ANALYSER_SETTINGS, settings):
+        setattr(analyser, name, value)
+    first_band = len(ANALYSER_SETTINGS)
+    for name, value in zip(BAND_SETTINGS, settings[first_band:]):
+        setattr(analyser.band_tracker, name, value)
+
+
+class StageTimings(PipelineStats):
+    """Keeps the stage timings of the last frame instead of adding them up, to pass them to another process."""
+
+    def reset(self) -> None:
+        super().reset()
+        self.timings: List[Tuple[str, float]] = []
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.timings.append((stage, seconds))
+
+
+def serve(connection: Connection) -> None:
+    """
+    Runs in the analyser process, analysing the frames an AnalyserProcess sends until the pipe is closed.
+
+    Every frame comes as a header, (shape, settings or None when unchanged, if the profile is
+    wanted), followed by the raw bytes of the frame. The reply is the measurement record, the
+    profile or None, the estimator time and the stage timings, or a message when it failed.
+    """
+    analyser = FrameAnalyser()
+    analyser.stats = timings = StageTimings()
+    buffer = bytearray()
+
+    while True:
+        try:
+            shape, settings, with_profile = connection.recv()
+            size = shape[0] * shape[1]
+            if len(buffer) < size:
+                buffer = bytearray(size)
+            connection.recv_bytes_into(buffer)
+        except (EOFError, OSError):
+            return  # The worker closed its end
+
+        try:
+            if settings is not None:
+                apply_settings(analyser, settings)
+            gray = np.frombuffer(buffer, dtype=np.uint8, count=size).reshape(shape)
+
+            timings.timings.clear()
+            record, profile = analyser.analyse_frame(gray)
+            reply: Any = (record, profile.copy() if with_profile else None, analyser.estimator_ms, timings.timings)
+        except Exception as e:
+            reply = f"{type(e).__name__}: {e}"
+        connection.send(reply)
+
+
+class AnalyserProcess:
+    """
+    Analyses frames with a FrameAnalyser in a process of its own, outside the GIL of this process.
+
+    `analyser` stays in this process and only holds the settings, they are sent along with the
+    next frame whenever they change. The tracking state, of the band and of a tracking estimator,
+    lives in the process, which is why one AnalyserProcess serves one stream of frames. Frames go
+    down a pipe as raw bytes, one copy of the luma plane, and only the profile of a frame that is
+    displayed comes back.
+
+    Args:
+    analyser: the analyser whose settings, estimator time and stats stand for the one in the process.
+    """
+
+    def __init__(self, analyser: FrameAnalyser) -> None:
+        self.analyser = analyser
+        self.settings: Optional[Tuple[Any, ...]] = None  # last settings sent to the process
+
+        # Spawned rather than forked, a fork would copy the state of the Qt threads of this process
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def analyse_frame(
+        self, gray: npt.NDArray[np.uint8], with_profile: bool = True
+    ) -> Tuple[np.void, Optional[npt.NDArray[np.float64]]]:
+        """
+        Measures the laser line in one (H, W) uint8 frame, like FrameAnalyser.analyse_frame.
+
+        Returns:
+        The measurement record and the profile it was measured on, None unless `with_profile`.
+        """
+        settings = analyser_settings(self.analyser)
+        changed = settings if settings != self.settings else None
+        self.settings = settings
+
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        self.connection.send((gray.shape, changed, with_profile))
+        self.connection.send_bytes(gray.reshape(-1).data)
+        reply = self.connection.recv()
+        if isinstance(reply, str):
+            raise RuntimeError(reply)
+
+        record, profile, self.analyser.estimator_ms, timings = reply
+        if self.analyser.stats:
+            for stage, seconds in timings:
+                self.analyser.stats.record(stage, seconds)
+        return record, profile
+
+    def close(self) -> None:
+        """Stops the process, it ends once it sees the pipe closed."""
+        self.connection.close()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
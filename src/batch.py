@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from src.data_filtering import isolate_trace
+from src.data_filtering import OFF_SENSOR_THRESHOLD
+from src.diagnostics import analyse_trace
+from src.diagnostics import DIAGNOSTICS_DTYPE
+from src.diagnostics import diagnostics_to_dict
+from src.journal import JOURNAL_EXTENSION
+from src.linuxcnc_ballbar_check import BALLBAR_RADIUS
+from src.positions import on_circle
+from src.runfile import load_angles
+from src.runfile import open_samples
+from src.runfile import Run
+from src.runfile import RUN_EXTENSION
+
+# Columns of the summary table, one row per run
+SUMMARY_COLUMNS = ("run", "samples", "dropped_frames") + (DIAGNOSTICS_DTYPE.names or ())[1:] + ("error",)
+
+
+def find_runs(directory: str) -> List[str]:
+    """Returns the run files in `directory`, preferring a .bbr over a .pkl or journal of the same run."""
+    runs: Dict[str, str] = {}
+    for extension in (".pkl", JOURNAL_EXTENSION, RUN_EXTENSION):
+        for path in sorted(glob.glob(os.path.join(directory, f"*{extension}"))):
+            runs[os.path.splitext(path)[0]] = path
+    return sorted(runs.values())
+
+
+def analyse_run_file(path: str, threshold: float = OFF_SENSOR_THRESHOLD, laps: int = 1) -> Dict[str, Any]:
+    """
+    Loads, segments and analyses one run file into a row of the summary table.
+
+    A run that can't be read or analysed gives a row with only its name and the error, so one
+    bad file doesn't stop a batch.
+    """
+    row: Dict[str, Any] = {"run": os.path.basename(path)}
+    try:
+        # Run files are analysed straight from their mapped columns, and know their radius and laps
+        samples = open_samples(path)
+        radius_mm = BALLBAR_RADIUS
+        if isinstance(samples, Run):
+            radius_mm = samples.metadata.get("radius_mm", radius_mm)
+            laps = samples.metadata.get("laps", laps)
+
+        sequence = samples["sequence"]
+        row["dropped_frames"] = int(sequence[-1] - sequence[0] + 1 - len(samples)) if len(samples) else 0
+
+        # All laps count towards the diagnostics, their angles wrap around. The samples of the moves on and off
+        # the circle are left out when the run has the machine positions.
+        clockwise, counterclockwise, clockwise_theta, counterclockwise_theta = isolate_trace(
+            samples, threshold, laps, lap=None, theta=load_angles(path), keep=on_circle(samples, radius_mm)
+        )
+        diagnostics = analyse_trace(clockwise, counterclockwise, clockwise_theta, counterclockwise_theta, radius_mm)
+        row.update(diagnostics_to_dict(diagnostics))
+    except Exception as error:  # Reported in the table instead
+        row["error"] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def analyse_directory(
+    directory: str, threshold: float = OFF_SENSOR_THRESHOLD, laps: int = 1, workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Analyses every run in `directory` in a pool of processes, returns the rows in file order."""
+    paths = find_runs(directory)
+    if not paths:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))  # Few round trips, still balanced when runs differ in size
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                analyse_run_file,
+                paths,
+                [threshold] * len(paths),
+                [laps] * len(paths),
+                chunksize=chunksize,
+            )
+        )
+
+
+def write_summary(rows: List[Dict[str, Any]], path: str) -> None:
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_COLUMNS, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyse every saved ballbar run in a directory.")
+    parser.add_argument("directory", help="directory with .bbr, .journal or .pkl run files")
+    parser.add_argument("-o", "--output", default="", help="summary CSV, <directory>/summary.csv by default")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, one per core by default")
+    parser.add_argument(
+        "--threshold", type=float, default=OFF_SENSOR_THRESHOLD, help="microns above which the ballbar is off"
+    )
+    parser.add_argument("--laps", type=int, default=1, help="laps per rotation, the P word of the G02/G03 moves")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = analyse_directory(args.directory, args.threshold, args.laps, args.jobs)
+    output = args.output or os.path.join(args.directory, "summary.csv")
+    write_summary(rows, output)
+
+    failed = sum(1 for row in rows if "error" in row)
+    print(f"{len(rows)} runs analysed in {time.perf_counter() - start:.2f} s, {failed} failed, summary: {output}")
+    for row in rows:
+        if "error" in row:
+            print(f"{row['run']}: {row['error']}", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.curves import estimator_names
+from src.instrumentation import PipelineStats
+from src.processing import FrameAnalyser
+
+# (height, width) of the benchmarked frames
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "640x480": (480, 640),
+    "1280x720": (720, 1280),
+    "1920x1080": (1080, 1920),
+    "3840x2160": (2160, 3840),
+}
+
+# Laser lines the accuracy is measured on, keyword arguments of synthetic_frames
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "clean": {},
+    "noisy": {"noise": 12.0},
+    "narrow": {"sigma": 1.5},
+    "wide": {"sigma": 20.0},
+    "saturated": {"peak": 600.0},
+    "tilted": {"tilt_deg": 3.0},
+    "jumping": {"step": 0.0},
+}
+
+# Relative slowdown, and relative plus absolute growth of the error, that count as a regression
+FPS_TOLERANCE = 0.2
+ERROR_TOLERANCE = 0.2
+ERROR_FLOOR_PX = 0.01
+
+
+def synthetic_frames(
+    height: int,
+    width: int,
+    count: int,
+    sigma: float = 6.0,
+    noise: float = 2.0,
+    peak: float = 200.0,
+    background: float = 20.0,
+    tilt_deg: float = 0.0,
+    step: float = 4.0,
+    seed: int = 0,
+) -> Tuple[npt.NDArray[np.uint8], npt.NDArray[np.float64]]:
+    """
+    Renders grayscale sensor frames of a vertical Gaussian laser line at known sub-pixel positions.
+
+    Args:
+    height: frame height in pixels.
+    width: frame width in pixels.
+    count: number of frames, with the line in the middle half of the frame.
+    sigma: standard deviation of the line profile in pixels.
+    noise: standard deviation of the added sensor noise in grey levels.
+    peak: line brightness above the background, values above 255 saturate.
+    background: background level in grey levels.
+    tilt_deg: angle of the line from vertical, the position is where it crosses the middle row.
+    step: largest movement of the line between frames in pixels, like a real run. With 0 every
+          frame has an independent random position.
+    seed: seed of the random positions and noise.
+
+    Returns:
+    A (count, height, width) uint8 stack and the true line position of each frame in pixels.
+    """
+    rng = np.random.default_rng(seed)
+    low, span = width * 0.25, width * 0.5
+    if step:
+        # Random walk from a random start, folded back into the middle half
+        walk = rng.uniform(0, span) + np.cumsum(rng.uniform(-step, step, count))
+        folded = walk % (2 * span)
+        positions = low + np.where(folded > span, 2 * span - folded, folded)
+    else:
+        positions = rng.uniform(low, low + span, count)
+    columns = np.arange(width, dtype=np.float32)
+    shift = np.tan(np.radians(tilt_deg)) * (np.arange(height, dtype=np.float32) - (height - 1) / 2)
+
+    frames = np.empty((count, height, width), dtype=np.uint8)
+    for frame, position in zip(frames, positions):
+        offset = columns[None, :] - (position + shift[:, None])
+        image = background + peak * np.exp(-0.5 * (offset / sigma) ** 2)
+        image += rng.normal(0.0, noise, image.shape).astype(np.float32)
+        np.clip(image, 0, 255, out=image)
+        frame[...] = image
+    return frames, positions
+
+
+def measure_frames(
+    analyser: FrameAnalyser, frames: npt.NDArray[np.uint8], positions: npt.NDArray[np.float64]
+) -> Dict[str, Any]:
+    """Runs frames through the live analyse_frame path, returns its rate, stage timings and position error."""
+    analyser.stats = stats = PipelineStats()
+    analyser.reset_tracking()
+    errors = np.empty(frames.shape[0])
+    durations = np.empty(frames.shape[0])
+
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        record, _ = analyser.analyse_frame(frame)
+        durations[index] = time.perf_counter() - start
+
+        plan = analyser.plans.get(frame.shape[1], analyser.smoothing, frame.shape[1])
+        errors[index] = float(plan.to_profile_position(record["pixel"])) - positions[index]
+    analyser.stats = None
+
+    return {
+        "fps": 1.0 / np.median(durations),  # The median is robust against the odd slow frame on a busy machine
+        "stages_ms": {stage: stats.stages[stage].mean * 1000.0 for stage in ("reduction", "smoothing", "fit")},
+        "rms_px": float(np.sqrt(np.mean(errors**2))),
+        "max_px": float(np.abs(errors).max()),
+    }
+
+
+def measure_batch(analyser: FrameAnalyser, frames: npt.NDArray[np.uint8], repeats: int = 3) -> float:
+    """Returns the frames per second of the vectorised analyse path on a stack, the best of `repeats` runs."""
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        analyser.analyse(frames)
+        elapsed.append(time.perf_counter() - start)
+    return float(frames.shape[0] / min(elapsed))
+
+
+def run_benchmark(
+    resolutions: List[str], estimator_names: List[str], count: int = 30, smoothing: int = 0
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks every estimator at every resolution.
+
+    Throughput is measured on the clean scenario and the position error on every scenario in
+    SCENARIOS, on `count` frames each.
+
+    Returns:
+    Results keyed by "<resolution>/<estimator>".
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for resolution in resolutions:
+        height, width = RESOLUTIONS[resolution]
+        stacks = {name: synthetic_frames(height, width, count, **scenario) for name, scenario in SCENARIOS.items()}
+
+        for estimator in estimator_names:
+            analyser = FrameAnalyser()
+            analyser.estimator = estimator
+            analyser.smoothing = smoothing
+
+            frames, positions = stacks["clean"]
+            measure_frames(analyser, frames[:2], positions[:2])  # Warm up the plans and caches
+            result = measure_frames(analyser, frames, positions)
+            result["batch_fps"] = measure_batch(analyser, frames)
+            result["errors"] = {}
+            for name, (frames, positions) in stacks.items():
+                measured = measure_frames(analyser, frames, positions)
+                result["errors"][name] = {"rms_px": measured["rms_px"], "max_px": measured["max_px"]}
+            results[f"{resolution}/{estimator}"] = result
+    return results
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Compares results with a stored baseline, returns a description of every regression."""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+
+        for rate in ("fps", "batch_fps"):
+            if rate in reference and result[rate] < reference[rate] * (1 - FPS_TOLERANCE):
+                regressions.append(f"{key} {rate}: {result[rate]:.1f} was {reference[rate]:.1f}")
+
+        for scenario, errors in result["errors"].items():
+            expected = reference.get("errors", {}).get(scenario)
+            if expected and errors["rms_px"] > expected["rms_px"] * (1 + ERROR_TOLERANCE) + ERROR_FLOOR_PX:
+                regressions.append(
+                    f"{key} {scenario} rms error: {errors['rms_px']:.4f} px was {expected['rms_px']:.4f} px"
+                )
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    scenarios = list(SCENARIOS)
+    header = f"{'resolution/estimator':<30} {'fps':>8} {'batch':>8} {'reduce':>7} {'smooth':>7} {'fit':>7}"
+    print(header + "".join(f" {name:>9}" for name in scenarios))
+    print(" " * 48 + "ms per frame" + " " * 10 + "rms position error in px")
+    for key, result in results.items():
+        stages = result["stages_ms"]
+        line = f"{key:<30} {result['fps']:>8.1f} {result['batch_fps']:>8.1f}"
+        line += f" {stages['reduction']:>7.3f} {stages['smoothing']:>7.3f} {stages['fit']:>7.3f}"
+        line += "".join(f" {result['errors'][name]['rms_px']:>9.4f}" for name in scenarios)
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the speed and accuracy of the frame analyser.")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--estimators", nargs="+", default=estimator_names, choices=estimator_names)
+    parser.add_argument("--frames", type=int, default=30, help="frames per measurement")
+    parser.add_argument("--smoothing", type=int, default=0, help="half width of the moving average")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.resolutions, args.estimators, args.frames, args.smoothing)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    # Frame rates depend on the machine, so every machine keeps its own baseline
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline to store one", file=sys.stderr)
+        return 1
+
+    with open(args.baseline) as file:
+        regressions = find_regressions(results, json.load(file))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    # python -m src.benchmark [--resolutions 640x480 1280x720] [--save-baseline]
+    sys.exit(main())
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+from typing import List
+
+from PySide6.QtCore import QObject
+from PySide6.QtCore import QTimer
+from PySide6.QtCore import Signal
+
+from src.linuxcnc_ballbar_check import BALLBAR_RADIUS
+from src.linuxcnc_ballbar_check import machine_ready
+from src.linuxcnc_ballbar_check import OPERATION_FEED
+from src.linuxcnc_ballbar_check import prep_steps
+from src.linuxcnc_ballbar_check import run_steps
+
+try:
+    import linuxcnc
+except ImportError:  # Only available on the machine, a simulator can be passed in instead
+    linuxcnc = None
+
+# States of the BallbarController, in the order a check goes through them
+IDLE = "idle"
+PREP = "prep"  # moving to the start position
+INSTALL = "install"  # waiting for the ballbar to be installed
+RUN = "run"  # running the circles
+DONE = "done"
+CANCELLED = "cancelled"
+ERROR = "error"
+
+
+class BallbarController(QObject):  # type: ignore
+    """
+    Drives the ballbar check on LinuxCNC from inside the GUI process, without blocking or spinning.
+
+    The check is a state machine, prep -> install -> run -> done. In prep and run the MDI commands
+    of the state are issued one at a time, and the machine status is polled from a QTimer every
+    `poll_interval_ms` until the command was received and the interpreter is idle again. The event
+    loop, and the frame workers, keep running in between. `cancel` aborts the motion in any state.
+
+    Args:
+    cnc: the linuxcnc module, or anything with the same stat, command and error_channel API such
+         as a simulator. Defaults to the real module when it is installed.
+    poll_interval_ms: time between status polls.
+    ack_timeout_s: how long LinuxCNC may take to receive a command before the check fails.
+    """
+
+    OnStateChanged = Signal(str)
+    OnProgress = Signal(int, int)  # commands done and total in the current state
+    OnCommand = Signal(str)  # MDI command that was just issued
+    OnError = Signal(str)
+
+    def __init__(self, cnc: Any = None, poll_interval_ms: int = 50, ack_timeout_s: float = 5.0) -> None:
+        super().__init__()
+        self.cnc = cnc if cnc is not None else linuxcnc
+        self.stat: Any = None
+        self.command: Any = None
+        self.errors: Any = None
+
+        self.radius = BALLBAR_RADIUS  # in mm
+        self.operation_feed = OPERATION_FEED  # in mm/min
+        self.laps = 1  # laps per circle, the P word of the G02/G03 moves
+        self.ack_timeout_s = ack_timeout_s
+
+        self.state = IDLE
+        self.steps: List[str] = []  # commands of the current state
+        self.step_index = 0  # command being executed
+        self.serial = 0  # serial number of the command being executed
+        self.issued_at = 0.0  # time.monotonic() the command was issued
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(poll_interval_ms)
+        self.timer.timeout.connect(self.poll)
+
+    @property
+    def active(self) -> bool:
+        return self.state in (PREP, INSTALL, RUN)
+
+    def connect_machine(self) -> bool:
+        """Opens the LinuxCNC channels on first use, reports an error when LinuxCNC is not available."""
+        if self.stat is not None:
+            return True
+        if self.cnc is None:
+            self.fail("LinuxCNC is not available on this machine")
+            return False
+
+        self.stat = self.cnc.stat()
+        self.command = self.cnc.command()
+        self.errors = self.cnc.error_channel()
+        return True
+
+    def start_prep(self) -> None:
+        """Moves the machine to the start position, the state then goes to INSTALL."""
+        if self.active or not self.connect_machine():
+            return
+
+        self.stat.poll()
+        if not machine_ready(self.stat, self.cnc):
+            self.fail("The machine is not ready, it must be out of estop, enabled, homed and idle")
+            return
+
+        self.command.mode(self.cnc.MODE_MDI)
+        self.command.wait_complete()  # An MDI command sent before the mode switch is done is rejected
+        self.begin(PREP, prep_steps(self.radius))
+
+    def start_run(self) -> None:
+        """Runs the circles once the ballbar is installed, the state then goes to DONE."""
+        if self.state != INSTALL:
+            return
+        self.begin(RUN, run_steps(self.radius, self.operation_feed, self.laps))
+
+    def cancel(self) -> None:
+        """Stops the check, aborting any motion in progress."""
+        if not self.active:
+            return
+        self.timer.stop()
+        if self.command is not None:
+            self.command.abort()
+        self.set_state(CANCELLED)
+
+    def begin(self, state: str, steps: List[str]) -> None:
+        self.steps = steps
+        self.step_index = 0
+        self.set_state(state)
+        self.issue()
+        self.timer.start()
+
+    def issue(self) -> None:
+        """Sends the current command, its completion is picked up by `poll`."""
+        step = self.steps[self.step_index]
+        self.command.mdi(step)
+        self.serial = self.command.serial
+        self.issued_at = time.monotonic()
+        self.OnCommand.emit(step)
+
+    def poll(self) -> None:
+        self.stat.poll()
+
+        error = self.errors.poll()
+        if error:
+            kind, text = error
+            if kind in (self.cnc.NML_ERROR, self.cnc.OPERATOR_ERROR):
+                self.fail(text)
+                return
+
+        if self.stat.estop or not self.stat.enabled:
+            self.fail("The machine was stopped during the check")
+            return
+
+        # The command counts as done once LinuxCNC has received it and the interpreter is idle again
+        if self.stat.echo_serial_number < self.serial:
+            if time.monotonic() - self.issued_at > self.ack_timeout_s:
+                self.fail(f"LinuxCNC did not receive {self.steps[self.step_index]}")
+            return
+        if self.stat.interp_state != self.cnc.INTERP_IDLE:
+            return
+
+        self.step_index += 1
+        self.OnProgress.emit(self.step_index, len(self.steps))
+        if self.step_index < len(self.steps):
+            self.issue()
+            return
+
+        self.timer.stop()
+        self.set_state(INSTALL if self.state == PREP else DONE)
+
+    def fail(self, message: str) -> None:
+        self.timer.stop()
+        if self.command is not None and self.active:
+            self.command.abort()
+        self.OnError.emit(message)
+        self.set_state(ERROR)
+
+    def set_state(self, state: str) -> None:
+        self.state = state
+        self.OnStateChanged.emit(state)
@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
 import numpy as np
 import numpy.typing as npt
 from scipy.optimize import curve_fit
 
 
-def fit_gaussian(curve: npt.NDArray) -> float:
+def fit_gaussian(curve: npt.NDArray[np.float64]) -> float:
     """
     Fits a Gaussian curve to the given data points.
 
@@ -25,7 +30,7 @@ def fit_gaussian(curve: npt.NDArray) -> float:
         return 0
 
     # Define the Gaussian function with amplitude, mean, and standard deviation
-    def gaussian(x: npt.NDArray, amplitude: float, mean: float, stddev: float) -> npt.NDArray:
+    def gaussian(x: npt.NDArray[np.float64], amplitude: float, mean: float, stddev: float) -> npt.NDArray[np.float64]:
         return amplitude * np.exp(-((x - mean) ** 2) / (2 * stddev**2))
 
     # Generate x data points
@@ -42,3 +47,469 @@ def fit_gaussian(curve: npt.NDArray) -> float:
     else:
         # Return the mean of the fitted Gaussian curve
         return float(popt[1])
+
+
+# Status codes returned by fit_gaussian_batch for each row
+FIT_FAILED = 0  # The row could not be fitted, fit_gaussian would return 0
+FIT_CONVERGED = 1  # The fit converged
+FIT_MAX_ITERATIONS = 2  # The fit ran out of iterations before converging
+
+
+def fit_gaussian_batch(
+    curves: npt.NDArray[np.float64], max_iterations: int = 200, tolerance: float = 1.49012e-08, chunk_size: int = 1024
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64], npt.NDArray[np.float64], npt.NDArray[np.int8]]:
+    """
+    Fits a Gaussian curve to every row of a stack of profiles at once.
+
+    This is the batched equivalent of `fit_gaussian`: the same model is fitted by Levenberg-Marquardt,
+    but the iterations run on all rows together with vectorised Jacobians and rows drop out as soon
+    as they converge. Each row starts from the same initial guess as fit_gaussian, so both converge
+    to the same mean.
+
+    Args:
+    curves: 2D array of shape (N, width), one profile per row.
+    max_iterations: iteration limit per row, roughly matching the maxfev=800 of fit_gaussian.
+    tolerance: relative change in cost or parameters below which a row counts as converged.
+    chunk_size: number of rows fitted together, bounds the memory used for the Jacobians.
+
+    Returns:
+    A tuple of arrays of shape (N,): means, standard deviations, amplitudes and fit status
+    (FIT_FAILED, FIT_CONVERGED or FIT_MAX_ITERATIONS). Rows that did not converge are all 0,
+    like the return value of fit_gaussian.
+    """
+    curves = np.atleast_2d(np.asarray(curves, dtype=np.float64))
+    params = np.zeros((curves.shape[0], 3))
+    status = np.full(curves.shape[0], FIT_FAILED, dtype=np.int8)
+
+    for start in range(0, curves.shape[0], chunk_size):
+        stop = start + chunk_size
+        params[start:stop], status[start:stop] = _levenberg_marquardt(curves[start:stop], max_iterations, tolerance)
+
+    params[status != FIT_CONVERGED] = 0.0
+    return params[:, 1], np.abs(params[:, 2]), params[:, 0], status
+
+
+def _levenberg_marquardt(
+    curves: npt.NDArray[np.float64], max_iterations: int, tolerance: float
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.int8]]:
+    x = np.arange(curves.shape[1], dtype=np.float64)
+
+    # Same rejection rules as fit_gaussian
+    with np.errstate(invalid="ignore"):
+        curve_max = curves.max(axis=1)
+        curve_std = np.nanstd(curves, axis=1)
+    valid = np.isfinite(curve_max) & np.isfinite(curve_std) & (curve_max != 0) & (curve_std != 0)
+
+    # Same initial guess as fit_gaussian: amplitude, the middle of the curve and its standard deviation
+    params = np.stack([curve_max, np.full(curves.shape[0], x.mean()), curve_std], axis=1)
+    status = np.full(curves.shape[0], FIT_FAILED, dtype=np.int8)
+    status[valid] = FIT_MAX_ITERATIONS
+
+    def residuals(
+        p: npt.NDArray[np.float64], y: npt.NDArray[np.float64]
+    ) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        exponent = np.exp(-((x - p[:, 1:2]) ** 2) / (2 * p[:, 2:3] ** 2))
+        return p[:, 0:1] * exponent - y, exponent
+
+    # Only the rows still iterating are carried along, indexed back into params by `active`
+    active = np.flatnonzero(valid)
+    y = curves[active]
+    p = params[active]
+    damping = np.full(active.size, 1e-3)
+    residual, exponent = residuals(p, y)
+    cost = np.einsum("ij,ij->i", residual, residual)
+
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore", under="ignore"):
+        for _ in range(max_iterations):
+            if not active.size:
+                break
+
+            # Analytic Jacobian of the Gaussian with respect to amplitude, mean and stddev
+            offset = x - p[:, 1:2]
+            d_mean = p[:, 0:1] * exponent * offset / p[:, 2:3] ** 2
+            jacobian = np.stack([exponent, d_mean, d_mean * offset / p[:, 2:3]], axis=1)  # (n, 3, width)
+
+            jtj = np.einsum("niw,njw->nij", jacobian, jacobian)
+            jtr = np.einsum("niw,nw->ni", jacobian, residual)
+
+            # Marquardt scaling: damp each parameter relative to its own curvature
+            diagonal = np.maximum(np.einsum("nii->ni", jtj), 1e-12)
+            system = jtj + (damping[:, None] * diagonal)[:, :, None] * np.eye(3)
+            step = np.linalg.solve(system, -jtr[..., None])[..., 0]
+
+            trial = p + step
+            trial_residual, trial_exponent = residuals(trial, y)
+            trial_cost = np.einsum("ij,ij->i", trial_residual, trial_residual)
+
+            improved = np.isfinite(trial_cost) & (trial_cost <= cost)
+            small_cost_change = improved & (cost - trial_cost <= tolerance * cost)
+            small_step = np.all(np.abs(step) <= tolerance * (np.abs(p) + tolerance), axis=1)
+
+            p[improved] = trial[improved]
+            residual[improved] = trial_residual[improved]
+            exponent[improved] = trial_exponent[improved]
+            cost[improved] = trial_cost[improved]
+            damping = np.where(improved, np.maximum(damping / 3.0, 1e-12), damping * 4.0)
+
+            # Rows that converged, or whose damping exploded on a non finite model, leave the iteration
+            converged = small_cost_change | small_step
+            diverged = ~converged & (~np.isfinite(p).all(axis=1) | (damping > 1e16))
+            done = converged | diverged
+            params[active[done]] = p[done]
+            status[active[converged]] = FIT_CONVERGED
+            status[active[diverged]] = FIT_FAILED
+
+            keep = ~done
+            active, y, p, damping = active[keep], y[keep], p[keep], damping[keep]
+            residual, exponent, cost = residual[keep], exponent[keep], cost[keep]
+
+    params[active] = p
+    return params, status
+
+
+class PeakTracker:
+    """
+    Gaussian peak estimator that follows the laser line from frame to frame.
+
+    An alpha-beta filter predicts where the peak will be in the next frame, and the Gaussian is
+    only fitted to a window around that prediction, seeded with the amplitude and width of the last
+    frame. Started that close, the fit converges in a few iterations instead of searching the
+    whole curve. When the windowed fit fails, its residual spikes above the running level or it
+    lands too far from the prediction, the whole curve is fitted again from its brightest sample.
+    A clean fit of a line as wide as the tracked one is taken as the line having moved. Otherwise
+    the frame is a glitch and the prediction is returned instead, until `max_misses` frames in a
+    row are glitches.
+
+    Calls must come in frame order, the tracker keeps state between them.
+
+    Args:
+    alpha: position gain of the alpha-beta filter.
+    beta: velocity gain of the alpha-beta filter.
+    window_sigmas: half width of the fitted window in standard deviations of the last fit.
+    min_window: smallest half width of the fitted window in samples.
+    gate: largest distance from the prediction, in standard deviations, that a fit may land, at
+          least `min_window` samples.
+    residual_gate: multiple of the running residual level that counts as a spike.
+    max_misses: glitches in a row after which any fit is taken as the new position.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.85,
+        beta: float = 0.3,
+        window_sigmas: float = 4.0,
+        min_window: int = 8,
+        gate: float = 3.0,
+        residual_gate: float = 4.0,
+        max_misses: int = 2,
+    ) -> None:
+        self.alpha = alpha
+        self.beta = beta
+        self.window_sigmas = window_sigmas
+        self.min_window = min_window
+        self.gate = gate
+        self.residual_gate = residual_gate
+        self.max_misses = max_misses
+        self.max_iterations = 200  # iteration limit of a fit of the whole curve
+        self.window_iterations = 20  # iteration limit of a warm started fit, needing more means the line was lost
+        self.residual_floor = 0.01  # residual level, relative to the amplitude, below which nothing is a spike
+
+        self.iterations = 0  # fit iterations spent on the last curve
+        self.reacquisitions = 0  # number of times the whole curve had to be fitted
+        self.glitches = 0  # number of frames rejected in favour of the prediction
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the tracked line, the next curve is searched as a whole."""
+        self.position: Optional[float] = None  # filtered peak position, None when not tracking
+        self.velocity = 0.0  # change of the position per frame
+        self.params = np.zeros(3)  # amplitude, mean and width of the last accepted fit
+        self.residual_level: Optional[float] = None  # running RMS residual of the accepted fits
+        self.misses = 0
+
+    def predict(self) -> Optional[float]:
+        """Returns where the peak is expected on the next curve, None when not tracking."""
+        return None if self.position is None else self.position + self.velocity
+
+    def __call__(self, curve: npt.NDArray[np.float64]) -> float:
+        curve = np.asarray(curve, dtype=np.float64)
+        self.iterations = 0
+        predicted = self.predict()
+
+        if predicted is not None:
+            start, stop = self._window(curve.size, predicted, self.params[2])
+            if stop - start >= 4:
+                # Warm start: the last amplitude and width, at the brightest sample near the prediction
+                seed = (self.params[0], float(np.argmax(curve[start:stop])), self.params[2])
+                fit = self._fit(curve, start, stop, seed, self.window_iterations)
+                if fit is not None and self._consistent(fit, predicted):
+                    return self._accept(*fit, predicted)
+
+        # Lost, or the windowed fit spiked, so search the whole curve
+        self.reacquisitions += 1
+        fit = self._fit(curve, 0, curve.size, None, self.max_iterations)
+        if fit is None:
+            return self._miss(predicted)
+        if predicted is None or self._consistent(fit, predicted):
+            return self._accept(*fit, predicted)
+        if not self._glitch(fit):
+            return self._accept(*fit, predicted, restart=True)
+        return self._miss(predicted)
+
+    def track(self, curves: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """Runs the tracker over the rows of a (N, width) stack in order, returns the N peak positions."""
+        curves = np.atleast_2d(curves)
+        return np.array([self(curve) for curve in curves], dtype=np.float64)
+
+    def _window(self, size: int, centre: float, stddev: float) -> Tuple[int, int]:
+        half_width = max(self.min_window, self.window_sigmas * stddev)
+        return max(0, int(centre - half_width)), min(size, int(centre + half_width) + 2)
+
+    def _fit(
+        self,
+        curve: npt.NDArray[np.float64],
+        start: int,
+        stop: int,
+        seed: Optional[Tuple[float, float, float]],
+        max_iterations: int,
+    ) -> Optional[Tuple[npt.NDArray[np.float64], float]]:
+        """
+        Fits a Gaussian to curve[start:stop] by Levenberg-Marquardt, like fit_gaussian_batch.
+
+        A single short curve is fitted without the bookkeeping of the batched fit, which would
+        cost more than the few iterations a warm start needs. Without a seed it starts at the
+        brightest sample, as fit_gaussian_batch does.
+
+        Returns:
+        The amplitude, mean and width in curve samples, and the RMS residual around the peak over
+        the amplitude. None when the fit failed.
+        """
+        y = curve[start:stop]
+        x = np.arange(y.size, dtype=np.float64)
+        if seed is None:
+            curve_max = y.max()
+            if not np.isfinite(curve_max) or curve_max == 0 or y.std() == 0:
+                return None
+            seed = (curve_max, float(np.argmax(y)), max(np.count_nonzero(y > curve_max / 2) / 2.3548, 1.0))
+
+        p = np.array(seed, dtype=np.float64)
+        damping = 1e-3
+        tolerance = 1.49012e-08
+        converged = False
+        with np.errstate(over="ignore", invalid="ignore", divide="ignore", under="ignore"):
+            exponent = np.exp(-((x - p[1]) ** 2) / (2 * p[2] ** 2))
+            residual = p[0] * exponent - y
+            cost = residual @ residual
+            for iteration in range(1, max_iterations + 1):
+                offset = x - p[1]
+                d_mean = p[0] * exponent * offset / p[2] ** 2
+                jacobian = np.array([exponent, d_mean, d_mean * offset / p[2]])
+                jtj = jacobian @ jacobian.T
+                system = jtj + damping * np.diag(np.maximum(np.diag(jtj), 1e-12))
+                try:
+                    step = np.linalg.solve(system, -(jacobian @ residual))
+                except np.linalg.LinAlgError:
+                    break
+
+                trial = p + step
+                trial_exponent = np.exp(-((x - trial[1]) ** 2) / (2 * trial[2] ** 2))
+                trial_residual = trial[0] * trial_exponent - y
+                trial_cost = trial_residual @ trial_residual
+
+                small_step = np.all(np.abs(step) <= tolerance * (np.abs(p) + tolerance))
+                if np.isfinite(trial_cost) and trial_cost <= cost:
+                    converged = bool(cost - trial_cost <= tolerance * cost)
+                    p, exponent, residual, cost = trial, trial_exponent, trial_residual, trial_cost
+                    damping = max(damping / 3.0, 1e-12)
+                else:
+                    damping *= 4.0
+                if converged or small_step or damping > 1e16 or not np.isfinite(p).all():
+                    converged = converged or bool(small_step)
+                    break
+        self.iterations += iteration
+
+        amplitude, mean, stddev = p
+        if not converged or not np.isfinite(p).all() or amplitude <= 0 or not 0 <= mean < y.size:
+            return None
+
+        # The residual is taken over the same window around the peak for windowed and global fits
+        params = np.array([amplitude, mean + start, abs(stddev)])
+        near_start, near_stop = self._window(curve.size, params[1], params[2])
+        near = np.arange(near_start, near_stop, dtype=np.float64)
+        model = amplitude * np.exp(-((near - params[1]) ** 2) / (2 * stddev**2))
+        return params, float(np.sqrt(np.mean((model - curve[near_start:near_stop]) ** 2))) / amplitude
+
+    def _spiked(self, residual: float) -> bool:
+        return residual > self.residual_gate * max(self.residual_level or 0.0, self.residual_floor)
+
+    def _consistent(self, fit: Tuple[npt.NDArray[np.float64], float], predicted: float) -> bool:
+        """Checks a fit landed within the gate of the prediction without a residual spike."""
+        params, residual = fit
+        if abs(params[1] - predicted) > max(self.gate * params[2], self.min_window):
+            return False
+        return not self._spiked(residual) and 0.5 <= params[2] / self.params[2] <= 2.0
+
+    def _glitch(self, fit: Tuple[npt.NDArray[np.float64], float]) -> bool:
+        """Checks if a fit away from the prediction looks unlike the tracked line, rather than the line having moved."""
+        params, residual = fit
+        if self.misses >= self.max_misses:
+            return False
+        return self._spiked(residual) or not 0.5 <= params[2] / self.params[2] <= 2.0
+
+    def _accept(
+        self, params: npt.NDArray[np.float64], residual: float, predicted: Optional[float], restart: bool = False
+    ) -> float:
+        mean = float(params[1])
+        if predicted is None or restart or self.misses:
+            # New line, or it moved, so the filter starts again from this fit
+            self.position = mean
+            self.velocity = 0.0
+        else:
+            innovation = mean - predicted
+            self.position = predicted + self.alpha * innovation
+            self.velocity += self.beta * innovation
+
+        self.params = params
+        self.residual_level = residual if self.residual_level is None else 0.9 * self.residual_level + 0.1 * residual
+        self.misses = 0
+        return mean
+
+    def _miss(self, predicted: Optional[float]) -> float:
+        if predicted is None or self.misses >= self.max_misses:
+            self.reset()
+            return 0.0
+
+        # Coast on the prediction, a single bad frame doesn't move the line
+        self.misses += 1
+        self.glitches += 1
+        self.position = predicted
+        return predicted
+
+
+def log_parabola_peak(curves: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Estimates the sub-pixel peak position with a three-point log-parabola (Caruana) fit.
+
+    A Gaussian is a parabola in log space, so fitting a parabola through the log of the
+    maximum sample and its two neighbours gives the peak position in closed form.
+
+    Args:
+    curves: array of shape (..., width) of non-negative intensities.
+
+    Returns:
+    Array of shape (...) with the peak position of each curve, 0 where it cannot be found.
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+    width = curves.shape[-1]
+    if width < 3:
+        return np.zeros(curves.shape[:-1])
+
+    # Keep the peak away from the edges so both neighbours exist
+    peak = np.clip(np.argmax(curves, axis=-1), 1, width - 2)[..., None]
+
+    # Clamp to a small positive value so the log stays finite on dark pixels
+    neighbours = np.log(np.maximum(np.take_along_axis(curves, peak + np.arange(-1, 2), axis=-1), 1e-6))
+    left, centre, right = neighbours[..., 0], neighbours[..., 1], neighbours[..., 2]
+
+    denominator = left - 2.0 * centre + right
+    valid = denominator < 0  # Must curve downwards to be a peak
+    offset = np.divide(left - right, 2.0 * denominator, out=np.zeros_like(denominator), where=valid)
+
+    return np.where(valid, peak[..., 0] + offset, 0.0)
+
+
+def centroid_peak(curves: npt.NDArray[np.float64], threshold: float = 0.5) -> npt.NDArray[np.float64]:
+    """
+    Estimates the peak position as the intensity weighted centroid of each curve.
+
+    Only the samples above `threshold` of each curve's peak height contribute, so the
+    background does not pull the centroid towards the middle of the sensor.
+
+    Args:
+    curves: array of shape (..., width) of intensities.
+    threshold: fraction of the peak height below which samples are ignored.
+
+    Returns:
+    Array of shape (...) with the centroid of each curve, 0 where the curve is flat.
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+    signal = curves - curves.min(axis=-1, keepdims=True)
+    weights = np.maximum(signal - threshold * signal.max(axis=-1, keepdims=True), 0.0)
+    total = weights.sum(axis=-1)
+    moment = weights @ np.arange(curves.shape[-1], dtype=np.float64)
+
+    centroid: npt.NDArray[np.float64] = np.divide(moment, total, out=np.zeros_like(total), where=total > 0)
+    return centroid
+
+
+def linear_gaussian_peak(curves: npt.NDArray[np.float64], threshold: float = 0.2) -> npt.NDArray[np.float64]:
+    """
+    Estimates the peak position with a linearised least-squares Gaussian fit.
+
+    Taking the log of a Gaussian turns it into a quadratic, which is solved directly with
+    weighted linear least squares (Guo's method, weights y^2) over the samples above
+    `threshold` of each curve's peak. Unlike `fit_gaussian` this needs no iterations.
+
+    Args:
+    curves: array of shape (..., width) of non-negative intensities.
+    threshold: fraction of the peak height below which samples are ignored.
+
+    Returns:
+    Array of shape (...) with the fitted mean of each curve, 0 where it cannot be fitted.
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+
+    # Only fit the samples that belong to the peak, the tails are dominated by noise in log space
+    floor = curves.min(axis=-1, keepdims=True)
+    height = curves.max(axis=-1, keepdims=True) - floor
+    signal = curves - floor
+    above = signal > threshold * height
+    weights = np.where(above, signal, 0.0) ** 2
+    log_signal = np.log(np.maximum(signal, 1e-6))
+
+    # Work relative to the brightest sample so the powers of x stay well conditioned
+    peak = np.argmax(curves, axis=-1)
+    u = np.arange(curves.shape[-1], dtype=np.float64) - peak[..., None]
+
+    # Normal equations for log(y) = a + b*u + c*u^2, weighted by y^2
+    powers = u[..., None] ** np.arange(5)  # (..., width, 5) holding u^0 .. u^4
+    moments = np.einsum("...w,...wk->...k", weights, powers)
+    rhs = np.einsum("...w,...wk->...k", weights * log_signal, powers[..., :3])
+    normal = moments[..., np.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])]
+
+    # A quadratic needs at least three samples, solve the rows without them as identity
+    valid = np.count_nonzero(above, axis=-1) >= 3
+    normal[~valid] = np.eye(3)
+    coefficients = np.linalg.solve(normal, rhs[..., None])[..., 0]
+    b, c = coefficients[..., 1], coefficients[..., 2]
+
+    valid &= c < 0  # Must curve downwards to be a peak
+    return np.where(valid, peak + np.divide(-b, 2.0 * c, out=np.zeros_like(b), where=valid), 0.0)
+
+
+# Selectable peak estimators, fastest first. Each takes a 1D curve and returns the peak position in samples.
+estimators: Dict[str, Callable[[npt.NDArray[np.float64]], float]] = {
+    "Centroid": lambda curve: float(centroid_peak(curve)),
+    "Log-parabola": lambda curve: float(log_parabola_peak(curve)),
+    "Linear Gaussian": lambda curve: float(linear_gaussian_peak(curve)),
+    "Gaussian fit": fit_gaussian,
+}
+
+default_estimator = "Gaussian fit"
+
+# Estimators that follow the line from frame to frame, by name of a factory of one instance per frame stream
+tracking_estimators: Dict[str, Callable[[], PeakTracker]] = {
+    "Tracked Gaussian": PeakTracker,
+}
+
+# Every selectable estimator name
+estimator_names = list(estimators) + list(tracking_estimators)
+
+# The same estimators working on (N, width) stacks of curves, returning N peak positions. Tracking
+# estimators have their `track` method instead, one instance following the rows in frame order.
+batch_estimators: Dict[str, Callable[[npt.NDArray[np.float64]], npt.NDArray[np.float64]]] = {
+    "Centroid": centroid_peak,
+    "Log-parabola": log_parabola_peak,
+    "Linear Gaussian": linear_gaussian_peak,
+    "Gaussian fit": lambda curves: fit_gaussian_batch(curves)[0],
+}
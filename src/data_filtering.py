@@ -1,57 +1,214 @@
-def filter_and_isolate_data(data, threshold:int=500)->list:
-    # Step 1: Filter out values above the threshold
-    filtered_data = [value if value <= threshold else None for value in data]
-    
-    # Step 2: Identify contiguous segments
-    def identify_segments(filtered_data):
-        segments = []
-        current_segment = []
-        for value in filtered_data:
-            if value is not None:
-                current_segment.append(value)
-            else:
-                if current_segment:
-                    segments.append(current_segment)
-                    current_segment = []
-        if current_segment:
-            segments.append(current_segment)
-        return segments
-    
-    # Get all contiguous segments of filtered data
-    segments = identify_segments(filtered_data)
-    
-    # Step 3: Determine start and stop of rotations
-    def determine_rotation_bounds(segments):
-        bounds = []
-        for segment in segments:
-            if segment:
-                bounds.append((data.index(segment[0]), data.index(segment[-1])))
-        return bounds
-    
-    bounds = determine_rotation_bounds(segments)
-
-    # Step 4: Isolate clockwise and counterclockwise data
-    def isolate_rotations(data, bounds):
-        isolated_data = {"clockwise": [], "counterclockwise": []}
-        for start, end in bounds:
-            rotation_data = data[start:end+1]
-            if len(rotation_data) > 1:
-                # Assuming first and last segments are clockwise and counterclockwise respectively
-                if start == 0 or (len(isolated_data["clockwise"]) == 0 and len(rotation_data) > 1):
-                    isolated_data["clockwise"].append(rotation_data)
-                else:
-                    isolated_data["counterclockwise"].append(rotation_data)
-        return isolated_data
-
-    isolated_data = isolate_rotations(data, bounds)
-    
+from __future__ import annotations
+
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+from src.utils import angles_from_timestamps
+
+if TYPE_CHECKING:  # Only needed for annotations
+    from src.runfile import Run
+
+DIRECTIONS = ("counterclockwise", "clockwise")  # in the order run_steps moves, G03 then G02
+OFF_SENSOR_THRESHOLD = 700  # microns, samples further off are taken as the ballbar being off the sensor
+
+
+def find_segments(data: npt.ArrayLike, threshold: float = 500, min_length: int = 2) -> npt.NDArray[np.intp]:
+    """
+    Finds the contiguous runs of values at or below `threshold` in one pass.
+
+    Values above the threshold (and NaN) are where the ballbar is off the sensor, between and
+    around the rotations.
+
+    Returns:
+    A (N, 2) array of [start, stop) index ranges, runs shorter than `min_length` are left out.
+    """
+    inside = np.asarray(data) <= threshold
+    edges = np.diff(inside.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    keep = stops - starts >= min_length
+    return np.column_stack((starts[keep], stops[keep]))
+
+
+def split_laps(start: int, stop: int, laps: int, timestamps: Optional[npt.ArrayLike] = None) -> npt.NDArray[np.intp]:
+    """
+    Splits the index range of a P > 1 rotation (G02/G03 ... P`laps`) into one range per lap.
+
+    The feed is constant, so the laps are equal in time when timestamps are given and equal in
+    number of samples otherwise.
+
+    Returns:
+    A (laps, 2) array of [start, stop) index ranges.
+    """
+    if timestamps is None or stop - start < 2:
+        cuts = np.linspace(start, stop, laps + 1).round().astype(np.intp)
+    else:
+        times = np.asarray(timestamps)[start:stop].astype(np.float64)
+        period = (times[-1] - times[0] + np.median(np.diff(times))) / laps
+        cuts = start + np.searchsorted(times, times[0] + period * np.arange(laps + 1))
+        cuts[0], cuts[-1] = start, stop
+    return np.column_stack((cuts[:-1], cuts[1:]))
+
+
+def rotation_direction(theta: npt.ArrayLike) -> Optional[str]:
+    """Returns the direction the machine angles of one rotation run in, None when they don't tell."""
+    theta = np.asarray(theta, dtype=np.float64)
+    if theta.size < 2 or not np.isfinite(theta).all():
+        return None
+    sweep = np.sign(np.diff(np.unwrap(theta))).sum()
+    return None if sweep == 0 else ("counterclockwise" if sweep > 0 else "clockwise")
+
+
+def find_rotations(
+    data: npt.ArrayLike,
+    threshold: float = 500,
+    timestamps: Optional[npt.ArrayLike] = None,
+    laps: int = 1,
+    min_length: int = 2,
+    theta: Optional[npt.ArrayLike] = None,
+) -> Dict[str, npt.NDArray[np.intp]]:
+    """
+    Finds the index ranges of the clockwise and counterclockwise rotations in a run.
+
+    Every segment on the sensor is a rotation, and each is split into `laps` laps. A rotation
+    whose machine angles are all known runs in the direction they turn in, the others in the
+    order of DIRECTIONS and then alternating, as run_steps runs the G03 circle before the G02 one.
+
+    Args:
+    data: the micron values of the run.
+    threshold: values above this are off the sensor.
+    timestamps: sample times, used to split the laps when given.
+    laps: laps per rotation, the P word of the G02/G03 moves.
+    min_length: shortest segment that counts as a rotation, shorter ones are noise.
+    theta: the machine angle of every sample, from join_positions.
+
+    Returns:
+    A (N, 2) array of [start, stop) lap ranges per direction, under "clockwise" and "counterclockwise".
+    """
+    ranges: Dict[str, List[npt.NDArray[np.intp]]] = {direction: [] for direction in DIRECTIONS}
+    for index, (start, stop) in enumerate(find_segments(data, threshold, min_length)):
+        direction = None if theta is None else rotation_direction(np.asarray(theta)[start:stop])
+        ranges[direction or DIRECTIONS[index % 2]].append(split_laps(start, stop, laps, timestamps))
+
+    return {
+        direction: np.concatenate(found) if found else np.zeros((0, 2), dtype=np.intp)
+        for direction, found in ranges.items()
+    }
+
+
+def filter_and_isolate_data(
+    data: npt.ArrayLike, threshold: float = 500, timestamps: Optional[npt.ArrayLike] = None, laps: int = 1
+) -> Dict[str, List[npt.NDArray[Any]]]:
+    """
+    Isolates the clockwise and counterclockwise laps of a run.
+
+    Returns:
+    One array per lap under "clockwise" and "counterclockwise", views into `data` when it is an
+    array. When timestamps are given they are isolated alongside, under "clockwise_timestamps" and
+    "counterclockwise_timestamps", so samples can be placed by time instead of by index.
+    """
+    data = np.asarray(data)
+    rotations = find_rotations(data, threshold, timestamps, laps)
+
+    times = None if timestamps is None else np.asarray(timestamps)
+
+    isolated_data = {}
+    for direction, ranges in rotations.items():
+        isolated_data[direction] = [data[start:stop] for start, stop in ranges]
+        if times is not None:
+            isolated_data[f"{direction}_timestamps"] = [times[start:stop] for start, stop in ranges]
     return isolated_data
 
-# # Example data and usage
-# data = [1000, 1000, 1000, 1010, 9997, 1000, 140, 121, 123, 33, 122, 1002, 1008, 1120, 110, 100, 133, 110, 1000, 1000, 1000, 1002]
-# threshold = 500
 
-# isolated_data = filter_and_isolate_data(data, threshold)
+def isolate_trace(
+    samples: Union[npt.NDArray[np.void], Run],
+    threshold: float = 500,
+    laps: int = 1,
+    lap: Optional[int] = 0,
+    theta: Optional[npt.NDArray[np.float64]] = None,
+    keep: Optional[npt.NDArray[np.bool_]] = None,
+) -> Tuple[
+    npt.NDArray[np.float64],
+    npt.NDArray[np.float64],
+    Optional[npt.NDArray[np.float64]],
+    Optional[npt.NDArray[np.float64]],
+]:
+    """
+    Isolates the traces of a run of SAMPLE_DTYPE samples, or of a Run's columns, the way they are plotted.
+
+    The clockwise trace is reversed and its angles are measured back from its last sample, so
+    both traces are in one angle frame. Angles come from the frame times when every sample has
+    one, otherwise they are None and the samples are taken as evenly spaced.
+
+    Args:
+    laps: laps per rotation, the P word of the G02/G03 moves.
+    lap: the lap to return, or None for all laps one after the other.
+    theta: the machine angle of every sample, from join_positions. Used instead of the frame
+           times for the laps where every sample has one, and for the direction of the rotations.
+    keep: the samples to return, e.g. from positions.on_circle. The rotations and their laps are
+          still found over all samples.
+
+    Returns:
+    The clockwise and counterclockwise micron values and their angles, empty when the run has no
+    such rotation.
+    """
+    timestamps = samples["frame_time_us"] if len(samples) and (samples["frame_time_us"] >= 0).all() else None
+    rotations = find_rotations(samples["micron"], threshold, timestamps, laps, theta=theta)
+    chosen = slice(None) if lap is None else slice(lap, lap + 1)
+
+    traces: List[Any] = []
+    for direction, reverse in (("clockwise", True), ("counterclockwise", False)):
+        order = slice(None, None, -1) if reverse else slice(None)
+        ranges = rotations[direction][chosen]
+        kept = [slice(None) if keep is None else keep[start:stop] for start, stop in ranges]
+        values = [samples["micron"][start:stop][lap_kept][order] for (start, stop), lap_kept in zip(ranges, kept)]
+        traces.append(np.concatenate(values) if values else np.zeros(0))
+
+        if timestamps is None and theta is None:
+            traces.append(None)
+            continue
+
+        angles = []
+        for (start, stop), lap_kept in zip(ranges, kept):
+            if theta is not None and np.isfinite(theta[start:stop]).all():
+                lap_angles = theta[start:stop]
+            elif timestamps is not None:
+                lap_angles = angles_from_timestamps(timestamps[start:stop], reverse=reverse)
+            else:
+                lap_angles = np.linspace(0, 2 * np.pi, stop - start, endpoint=False)
+            angles.append(lap_angles[lap_kept][order])
+        traces.append(np.concatenate(angles) if angles else np.zeros(0))
+
+    clockwise, clockwise_theta, counterclockwise, counterclockwise_theta = traces
+    return clockwise, counterclockwise, clockwise_theta, counterclockwise_theta
+
+
+if __name__ == "__main__":
+    # python -m src.data_filtering
+    # Benchmark on a synthetic 10M sample trace: two rotations of 5 laps between off-sensor values
+    size = 10_000_000
+    rng = np.random.default_rng(0)
+    trace = rng.normal(0.0, 20.0, size)
+    edge, gap_start, gap_stop = size // 20, size // 2 - size // 40, size // 2 + size // 40
+    trace[:edge] = 1000.0
+    trace[gap_start:gap_stop] = 1000.0
+    trace[-edge:] = 1000.0
+    times = np.arange(size, dtype=np.int64) * 8333
 
-# print("Clockwise Data:", isolated_data["clockwise"])
-# print("Counterclockwise Data:", isolated_data["counterclockwise"])
+    for label, timestamps in (("index", None), ("timestamps", times)):
+        start_time = time.perf_counter()
+        rotations = find_rotations(trace, 500, timestamps, laps=5)
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{label:>10}: {elapsed * 1000:.1f} ms for {size:,} samples ({size / elapsed / 1e6:.0f} M samples/s), "
+            f"{len(rotations['clockwise'])} + {len(rotations['counterclockwise'])} laps"
+        )
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# Result of analyse_trace, all deviations in microns
+DIAGNOSTICS_DTYPE = np.dtype(
+    [
+        ("samples", np.int64),  # samples used, both directions
+        ("radius_error_um", np.float64),  # mean radial deviation, the error of the nominal radius
+        ("centre_x_um", np.float64),  # offset of the least-squares circle centre
+        ("centre_y_um", np.float64),
+        ("scale_mismatch_um", np.float64),  # X minus Y scale over the radius, the cos(2θ) ellipse
+        ("squareness_um_per_m", np.float64),  # out of squareness of X and Y, the sin(2θ) ellipse
+        ("circularity_um", np.float64),  # ISO 230-4 circular deviation over both directions
+        ("circularity_cw_um", np.float64),
+        ("circularity_ccw_um", np.float64),
+        ("backlash_x_um", np.float64),  # step where X reverses, the part common to both directions
+        ("backlash_y_um", np.float64),
+        ("lateral_play_x_um", np.float64),  # step where X reverses, the part that flips with direction
+        ("lateral_play_y_um", np.float64),
+        ("reversal_spike_x_um", np.float64),  # peak over the flanks right where X reverses
+        ("reversal_spike_y_um", np.float64),
+    ]
+)
+
+# Angles where the axes reverse on a circle around the origin
+X_REVERSALS = (0.0, np.pi)
+Y_REVERSALS = (np.pi / 2, 3 * np.pi / 2)
+
+
+def _finite_mean(values: npt.ArrayLike) -> float:
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    return float(finite.mean()) if finite.size else np.nan
+
+
+def _finite_max(values: npt.ArrayLike) -> float:
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[np.isfinite(values)]
+    return float(finite.max()) if finite.size else np.nan
+
+
+def harmonic_basis(theta: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """Returns the (5, N) basis 1, cos θ, sin θ, cos 2θ, sin 2θ used to model a ballbar trace."""
+    basis = np.empty((5, theta.size))
+    basis[0] = 1.0
+    np.cos(theta, out=basis[1])
+    np.sin(theta, out=basis[2])
+    np.subtract(basis[1] * basis[1], basis[2] * basis[2], out=basis[3])
+    np.multiply(2.0 * basis[1], basis[2], out=basis[4])
+    return basis
+
+
+def fit_harmonics(basis: npt.NDArray[np.float64], r: npt.NDArray[np.float64]) -> npt.NDArray[np.floating[Any]]:
+    """
+    Least-squares fit of r = a0 + a1 cos θ + b1 sin θ + a2 cos 2θ + b2 sin 2θ.
+
+    Solved through the 5x5 normal equations, one pass over the data whatever its size.
+    """
+    return np.linalg.solve(basis @ basis.T, basis @ r)
+
+
+def reversal_steps(
+    theta: npt.NDArray[np.float64],
+    residual: npt.NDArray[np.float64],
+    angle: float,
+    travel: int,
+    window: float,
+    guard: float,
+) -> Tuple[float, float]:
+    """
+    Measures the step and the spike of the residual where an axis reverses at `angle`.
+
+    The step is the mean after the reversal minus the mean before it, over `window` radians
+    either side and leaving out `guard` radians around the reversal. The spike is the largest
+    residual within the guard above the mean of both flanks.
+
+    Args:
+    travel: 1 when the machine moved towards increasing θ, -1 when it moved the other way.
+    """
+    offset = (theta - angle + np.pi) % (2 * np.pi) - np.pi
+    after = travel * offset
+    before_values = residual[(after < -guard) & (after > -window)]
+    after_values = residual[(after > guard) & (after < window)]
+    spike_values = residual[np.abs(after) <= guard]
+    if not before_values.size or not after_values.size:
+        return np.nan, np.nan
+
+    before_mean = before_values.mean()
+    after_mean = after_values.mean()
+    spike = spike_values.max() - (before_mean + after_mean) / 2 if spike_values.size else np.nan
+    return after_mean - before_mean, spike
+
+
+def analyse_trace(
+    clockwise: npt.ArrayLike,
+    counterclockwise: npt.ArrayLike,
+    clockwise_theta: Optional[npt.ArrayLike] = None,
+    counterclockwise_theta: Optional[npt.ArrayLike] = None,
+    radius_mm: float = 1.0,
+    window_deg: float = 10.0,
+    guard_deg: float = 1.0,
+) -> np.void:
+    """
+    Computes the ISO 230-4 style diagnostics of a ballbar check.
+
+    The traces are the radial deviations in microns from filter_and_isolate_data, with their
+    angles in one frame where counterclockwise travel goes towards increasing θ and clockwise
+    travel towards decreasing θ, as plotted by the Graph. Without angles the samples are taken as
+    evenly spaced over one lap. Multi-lap traces are fine, angles are taken modulo 2π.
+
+    Everything comes from one closed-form least-squares fit per direction plus a few masked
+    means, a few milliseconds for a typical check and well under a second for millions of samples.
+
+    Args:
+    radius_mm: nominal radius of the circle, to express the squareness as an angle.
+    window_deg: width of the flanks either side of a reversal that steps are measured over, below 45°.
+    guard_deg: part right around a reversal that is left out of the flanks and holds the spike.
+
+    Returns:
+    A DIAGNOSTICS_DTYPE record, fields that could not be measured are NaN.
+    """
+    result: np.void = np.zeros(1, dtype=DIAGNOSTICS_DTYPE)[0]
+    for field in (DIAGNOSTICS_DTYPE.names or ())[1:]:
+        result[field] = np.nan
+    window = np.radians(window_deg)
+    guard = np.radians(guard_deg)
+
+    coefficients = []
+    circularity = []
+    steps: Dict[Tuple[str, int], Tuple[float, float]] = {}
+    total = 0
+    for r, theta, travel in ((clockwise, clockwise_theta, -1), (counterclockwise, counterclockwise_theta, 1)):
+        r = np.asarray(r, dtype=np.float64)
+        if r.size < 5:
+            circularity.append(np.nan)
+            continue
+        theta = np.linspace(0, 2 * np.pi, r.size, endpoint=False) if theta is None else np.asarray(theta)
+        total += r.size
+
+        basis = harmonic_basis(theta)
+        coefficient = fit_harmonics(basis, r)
+        coefficients.append(coefficient)
+
+        # Circular deviation is measured from the least-squares circle, so only the centre and radius are removed
+        residual = r - coefficient[:3] @ basis[:3]
+        circularity.append(residual.max() - residual.min())
+
+        # Steps and spikes against the full model, so the ellipse doesn't show up as a step
+        residual -= coefficient[3:] @ basis[3:]
+
+        # Only the samples within the window of a reversal, every 90°, take part in the steps
+        near = np.abs((theta + np.pi / 4) % (np.pi / 2) - np.pi / 4) < window
+        near_theta = theta[near]
+        near_residual = residual[near]
+        for axis, angles in (("x", X_REVERSALS), ("y", Y_REVERSALS)):
+            found = np.array(
+                [reversal_steps(near_theta, near_residual, angle, travel, window, guard) for angle in angles]
+            )
+            steps[axis, travel] = _finite_mean(found[:, 0]), _finite_mean(found[:, 1])
+
+    result["samples"] = total
+    result["circularity_cw_um"], result["circularity_ccw_um"] = circularity
+    if not coefficients:
+        return result
+
+    mean = np.mean(coefficients, axis=0)
+    result["radius_error_um"] = mean[0]
+    result["centre_x_um"] = mean[1]
+    result["centre_y_um"] = mean[2]
+    result["scale_mismatch_um"] = 2 * mean[3]
+    result["squareness_um_per_m"] = 2 * mean[4] / radius_mm * 1000.0
+    result["circularity_um"] = _finite_max(circularity)
+
+    for axis in ("x", "y"):
+        step_cw, spike_cw = steps.get((axis, -1), (np.nan, np.nan))
+        step_ccw, spike_ccw = steps.get((axis, 1), (np.nan, np.nan))
+        result[f"backlash_{axis}_um"] = _finite_mean([step_cw, step_ccw])
+        result[f"lateral_play_{axis}_um"] = (step_ccw - step_cw) / 2
+        result[f"reversal_spike_{axis}_um"] = _finite_max([spike_cw, spike_ccw])
+    return result
+
+
+def diagnostics_to_dict(record: np.void) -> Dict[str, Any]:
+    """Converts a DIAGNOSTICS_DTYPE record to plain floats, e.g. for JSON, NaN becomes None."""
+    values = {}
+    for name in record.dtype.names or ():
+        value = record[name].item()
+        values[name] = None if isinstance(value, float) and np.isnan(value) else value
+    return values
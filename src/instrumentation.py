@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+import time
+from typing import Any
+from typing import Dict
+
+import numpy as np
+
+# Stages of the frame pipeline, in the order they run
+PIPELINE_STAGES = ("conversion", "reduction", "smoothing", "fit", "preview", "render", "emit")
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations with logarithmic bins from 1 µs to 10 s.
+
+    Adding a value is a binary search and an increment, cheap enough to do for every frame.
+    """
+
+    def __init__(self, bins_per_decade: int = 10) -> None:
+        self.edges = list(np.logspace(-6, 1, 7 * bins_per_decade + 1))  # bin edges in seconds
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)  # first and last bins catch outliers
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Returns the upper edge of the bin holding the q-th percentile (0-100), in seconds."""
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        return float(self.edges[min(index, len(self.edges) - 1)])
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": self.mean * 1000.0,
+            "p50_ms": self.percentile(50) * 1000.0,
+            "p95_ms": self.percentile(95) * 1000.0,
+            "p99_ms": self.percentile(99) * 1000.0,
+            "max_ms": self.max * 1000.0,
+            "edges_s": self.edges,
+            "counts": self.counts.tolist(),
+        }
+
+
+class PipelineStats:
+    """
+    Frame counters and per-stage latency histograms for the capture pipeline.
+
+    `received` and `dropped` are counted where frames arrive from the camera, `processed` and the
+    stage timings where the frames are analysed. Several workers can share one instance.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.monotonic()
+        self.received = 0  # frames delivered by the camera
+        self.processed = 0  # frames the analyser finished
+        self.dropped = 0  # frames discarded because the worker was busy
+        self.stages = {stage: LatencyHistogram() for stage in PIPELINE_STAGES}
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage].add(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed_s": elapsed,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "received_fps": self.received / elapsed if elapsed else 0.0,
+            "processed_fps": self.processed / elapsed if elapsed else 0.0,
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+        }
+
+    def dump(self, path: str) -> None:
+        """Writes the summary, including the full histograms, to a JSON file."""
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from typing import List
+from typing import Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from src.DataClasses import FastData
+from src.DataClasses import SAMPLE_DTYPE
+from src.DataClasses import SampleBuffer
+
+JOURNAL_EXTENSION = ".journal"
+JOURNAL_MAGIC = b"BBJOURNL"
+JOURNAL_VERSION = 1
+
+# Header at the start of a journal, followed by SAMPLE_DTYPE records until the end of the file
+JOURNAL_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("record_size", "<u4"),  # bytes per record, to catch a journal written with another SAMPLE_DTYPE
+        ("reserved", "V48"),
+    ]
+)
+
+
+class SampleJournal:
+    """
+    Streams samples to an append-only file while a run is going.
+
+    Samples are collected in fixed size chunks on the calling thread. Full chunks are written by a
+    background thread, which also flushes the file to disk every `flush_interval` seconds, and
+    written chunks are reused. Memory use is a few chunks however long the run is, and after a
+    crash everything up to the last flush can be read back with `read_journal`.
+
+    Args:
+    path: file to write, overwritten if it exists.
+    chunk_size: number of samples written at once.
+    flush_interval: seconds between flushes, a part filled chunk is also written after this long.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 4096, flush_interval: float = 1.0) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.count = 0  # samples appended, written or not
+
+        header = np.zeros(1, dtype=JOURNAL_HEADER_DTYPE)
+        header["magic"] = JOURNAL_MAGIC
+        header["version"] = JOURNAL_VERSION
+        header["record_size"] = SAMPLE_DTYPE.itemsize
+        self.file = open(path, "wb")
+        self.file.write(header.tobytes())
+
+        self.chunk = SampleBuffer(chunk_size)
+        self.free_chunks: List[SampleBuffer] = []
+        self.free_lock = threading.Lock()
+        self.last_handoff = time.monotonic()
+        self.error: Optional[OSError] = None  # set when the writer thread failed
+
+        self.chunks: queue.Queue[Optional[SampleBuffer]] = queue.Queue()
+        self.writer = threading.Thread(target=self._write_chunks, name="SampleJournal", daemon=True)
+        self.writer.start()
+
+    def append(self, data: FastData) -> None:
+        self.chunk.append(data)
+        self.count += 1
+        if len(self.chunk) >= self.chunk_size or time.monotonic() - self.last_handoff > self.flush_interval:
+            self._handoff()
+
+    def _handoff(self) -> None:
+        """Passes the current chunk to the writer thread and starts a new one."""
+        self.last_handoff = time.monotonic()
+        if not len(self.chunk):
+            return
+
+        self.chunks.put(self.chunk)
+        with self.free_lock:
+            self.chunk = self.free_chunks.pop() if self.free_chunks else SampleBuffer(self.chunk_size)
+
+    def _write_chunks(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                chunk = self.chunks.get(timeout=self.flush_interval)
+            except queue.Empty:
+                chunk = None
+            else:
+                if chunk is None:
+                    break  # Closed
+
+            if chunk is not None:
+                try:
+                    self.file.write(chunk.samples.tobytes())
+                except OSError as error:
+                    self.error = error
+                chunk.clear()
+                with self.free_lock:
+                    self.free_chunks.append(chunk)
+
+            if time.monotonic() - last_flush > self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+
+        self._flush()
+
+    def _flush(self) -> None:
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as error:
+            self.error = error
+
+    def close(self) -> None:
+        """Writes the remaining samples, waits for the writer thread and closes the file."""
+        if self.file.closed:
+            return
+        self._handoff()
+        self.chunks.put(None)
+        self.writer.join()
+        self.file.close()
+        if self.error:
+            raise self.error
+
+
+def read_journal(path: str) -> npt.NDArray[np.void]:
+    """
+    Memory-maps the samples of a journal, also one that was not closed properly.
+
+    A record cut short by a crash at the end of the file is left out.
+    """
+    header = np.fromfile(path, dtype=JOURNAL_HEADER_DTYPE, count=1)
+    if not header.size or header["magic"][0] != JOURNAL_MAGIC:
+        raise ValueError(f"{path} is not a sample journal")
+    if header["version"][0] > JOURNAL_VERSION:
+        raise ValueError(f"{path} has unsupported journal version {header['version'][0]}")
+    if header["record_size"][0] != SAMPLE_DTYPE.itemsize:
+        raise ValueError(f"{path} was written with a different sample layout")
+
+    count = (os.path.getsize(path) - JOURNAL_HEADER_DTYPE.itemsize) // SAMPLE_DTYPE.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=SAMPLE_DTYPE)  # Can't map an empty file
+    return np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", offset=JOURNAL_HEADER_DTYPE.itemsize, shape=(count,))
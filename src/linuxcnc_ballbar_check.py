@@ -1,76 +1,112 @@
 from __future__ import annotations
 
+import math
 import sys
 import time
+from typing import Any
+from typing import List
 
-import linuxcnc
+try:
+    import linuxcnc
+except ImportError:  # Only available on the machine, the GUI still imports the settings below
+    linuxcnc = None
+
+BALLBAR_RADIUS = 267.939  # in mm
+OPERATION_FEED = 1000  # operation feed in mm/min
+
+
+def lap_time(radius: float = BALLBAR_RADIUS, feed: float = OPERATION_FEED) -> float:
+    """Returns the time one lap of the circle takes at `feed`, in seconds."""
+    return 2 * math.pi * radius / feed * 60.0
+
+
+POLL_INTERVAL = 0.05  # seconds between status polls while waiting on the machine
+
+
+def prep_steps(radius: float = BALLBAR_RADIUS) -> List[str]:
+    """Returns the MDI commands that move the machine to the start position, ready to install the ballbar."""
+    return [
+        "G17",  # Select the XY plane
+        "G90",  # Absolute distance mode
+        "G53 G0 Z1",  # Move Z to the machine safe height offset by 1mm
+        "G54",  # select the G54 coordinate system
+        f"G0 X{radius + 1} Y0",  # Move in the XY plane to the starting position
+        "G0 Z0",
+    ]
+
+
+def run_steps(radius: float = BALLBAR_RADIUS, feed: float = OPERATION_FEED, laps: int = 1) -> List[str]:
+    """
+    Returns the MDI commands of the check: a counterclockwise then a clockwise circle of `laps` laps.
+
+    The ballbar is moved 1 mm off the sensor and held there for a second around each circle, so
+    the rotations can be told apart in the samples.
+    """
+    return [
+        # We set the feed that we'll be operating the rotation.
+        # We might set this to other speeds depending on what we are measuring
+        f"G1 F{feed}",
+        "G4 P1",  # dwell 1 second
+        f"G1 X{radius}",  # move in 1.0mm
+        f"G03 I-{radius} J0 P{laps}",  # Initiate the circular motion
+        f"G1 X{radius + 1}",  # move out 1.0mm
+        "G4 P1",
+        f"G1 X{radius}",  # move in 1.0mm
+        f"G02 I-{radius} J0 P{laps}",
+        f"G1 X{radius + 1}",  # move out 1.0mm
+        "G4 P1",
+        # "G53 G0 Z1",  # Move Z to the machine safe height offset by 1mm
+    ]
+
+
+def machine_ready(stat: Any, cnc: Any) -> bool:
+    """Returns if the machine is out of estop, enabled, homed and the interpreter is idle, from a polled stat."""
+    return (
+        not stat.estop
+        and stat.enabled
+        and (stat.homed.count(1) == stat.joints)
+        and (stat.interp_state == cnc.INTERP_IDLE)
+    )
 
 
 class BallbarCheck(object):
+    """
+    Runs the check from the command line, one blocking MDI command at a time.
+
+    The GUI uses the event driven BallbarController instead, this is for running the moves by hand.
+    """
+
     def __init__(self) -> None:
         super().__init__()
         self.stat = linuxcnc.stat()
         self.command = linuxcnc.command()
 
-        self.radius = 267.939  # in mm
+        self.radius = BALLBAR_RADIUS  # in mm
         self.goto_feed = 1000  # goto position feed
-        self.operation_feed = 1000  # operation feed
+        self.operation_feed = OPERATION_FEED  # operation feed
         self.num_times = 1  # number of times to run it
 
     def ready(self) -> bool:
         self.stat.poll()
-        return (
-            not self.stat.estop
-            and self.stat.enabled
-            and (self.stat.homed.count(1) == self.stat.joints)
-            and (self.stat.interp_state == linuxcnc.INTERP_IDLE)
-        )
+        return machine_ready(self.stat, linuxcnc)
 
     def cmd(self, cmd: str) -> None:
         print(cmd)
         self.command.mdi(cmd)
-        self.command.wait_complete()  # wait until mode switch executed
+        self.command.wait_complete()  # wait until the command was received
         while not self.ready():
-            continue
+            time.sleep(POLL_INTERVAL)  # Poll, don't spin a core the frame workers need
 
     def prep_run(self) -> None:
         self.command.mode(linuxcnc.MODE_MDI)
         self.command.wait_complete()  # wait until mode switch executed
 
-        self.cmd("G17")  # Select the XY plane
-        self.cmd("G90")  # Absolute distance mode
-
-        self.cmd("G53 G0 Z1")  # Move Z to the machine safe height offset by 1mm
-        self.cmd("G54")  # select the G54 coordinate system
-        self.cmd(f"G0 X{self.radius + 1} Y0")  # Move in the XY plane to the starting position
-
-        self.cmd("G0 Z0")
+        for step in prep_steps(self.radius):
+            self.cmd(step)
 
     def do_run(self) -> None:
-        # We set the feed that we'll be operating the rotation.
-        # We might set this to other speeds depending on what we are measuring
-        self.cmd(f"G1 F{self.operation_feed}")
-
-        time.sleep(1)
-
-        self.cmd(f"G1 X{self.radius}")  # move in 1.0mm
-
-        # Initiate the circular motion
-        self.cmd(f"G03 I-{self.radius} J0 P{self.num_times}")
-
-        self.cmd(f"G1 X{self.radius + 1}")  # move out 1.0mm
-
-        time.sleep(1)
-
-        self.cmd(f"G1 X{self.radius}")  # move out 1.0mm
-
-        self.cmd(f"G02 I-{self.radius} J0 P{self.num_times}")
-
-        self.cmd(f"G1 X{self.radius + 1}")  # move out 1.0mm
-
-        time.sleep(1)
-
-        # self.cmd("G53 G0 Z1")  # Move Z to the machine safe height offset by 1mm
+        for step in run_steps(self.radius, self.operation_feed, self.num_times):
+            self.cmd(step)
 
 
 if __name__ == "__main__":
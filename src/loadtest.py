@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QGuiApplication
+
+from src.benchmark import RESOLUTIONS
+from src.controller import BallbarController
+from src.controller import CANCELLED
+from src.controller import DONE
+from src.controller import ERROR
+from src.controller import INSTALL
+from src.controller import RUN
+from src.Core import Core
+from src.data_filtering import isolate_trace
+from src.data_filtering import OFF_SENSOR_THRESHOLD
+from src.DataClasses import FastData
+from src.DataClasses import SampleBuffer
+from src.diagnostics import analyse_trace
+from src.diagnostics import diagnostics_to_dict
+from src.pipeline import align_samples
+from src.positions import join_positions
+from src.positions import on_circle
+from src.positions import PositionSampler
+from src.positions import with_positions
+from src.runfile import write_run
+from src.simulation import MachineErrors
+from src.simulation import SimulatedLinuxCNC
+from src.simulation import SyntheticCamera
+from src.Workers import worker_backends
+
+
+def run_loadtest(
+    resolution: str = "1280x720",
+    fps: float = 120.0,
+    speed: float = 10.0,
+    num_workers: int = 0,
+    radius: float = 50.0,
+    laps: int = 1,
+    estimator: str = "",
+    errors: Optional[MachineErrors] = None,
+    num_sensors: int = 1,
+    backend: str = "thread",
+) -> Dict[str, Any]:
+    """
+    Runs a whole ballbar check on a simulated machine and camera, through Core, the controller and the position join.
+
+    The controller runs the prep and the circles on a SimulatedLinuxCNC, the ballbar counts as
+    installed straight away, and a SyntheticCamera renders the line from the machine's readings.
+    Pipeline statistics are taken over the run only. With more sensors every one gets its own
+    camera, rendering the same readings with its own noise, and its own session in Core.
+
+    Args:
+    resolution: a key of benchmark.RESOLUTIONS.
+    fps: frame rate of the camera.
+    speed: simulated seconds per real second, the frame rate is per real second.
+    num_workers: frame workers per sensor, the cores shared out between the sensors by default.
+    radius: length of the simulated ballbar in mm.
+    laps: laps per circle.
+    estimator: peak estimator of the analyser, the default one when empty.
+    errors: geometric errors of the simulated machine.
+    num_sensors: camera sessions.
+    backend: where the frame workers analyse the frames, "thread" or "process".
+
+    Returns:
+    The final controller state, the backend and frame workers per sensor, the pipeline summary of
+    every sensor, the RMS of the measured minus the rendered readings, the median difference of
+    every other sensor from the main one once aligned on the host clock, the diagnostics found and
+    the main sensor's samples with their joined positions.
+    """
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+    height, width = RESOLUTIONS[resolution]
+
+    machine = SimulatedLinuxCNC(speed=speed, errors=errors, radius=radius)
+    cameras = [SyntheticCamera(machine, width, height, fps, seed=sensor) for sensor in range(num_sensors)]
+    camera = cameras[0]
+    core = Core(num_workers, num_sensors, backend)
+    core.set_sensor_width_mm(camera.sensor_width_mm)
+    if estimator:
+        core.set_analyser_option("estimator", estimator)
+
+    controller = BallbarController(cnc=machine, poll_interval_ms=10)
+    controller.radius = radius
+    controller.laps = laps
+    streams = [SampleBuffer() for _ in range(num_sensors)]
+    samples = streams[0]
+    position_sampler = PositionSampler(machine.stat())
+
+    def store_data(data: FastData) -> None:
+        if controller.state == RUN:
+            streams[data.sensor].append(data)
+
+    def state_changed(state: str) -> None:
+        if state == INSTALL:
+            controller.start_run()  # The simulated ballbar is installed straight away
+        elif state == RUN:
+            core.reset_stats()
+            position_sampler.start()
+        elif state in (DONE, CANCELLED, ERROR):
+            QTimer.singleShot(0, app.quit)
+
+    for session in core.sessions:
+        session.OnAnalyserUpdate.connect(store_data)
+    controller.OnStateChanged.connect(state_changed)
+    controller.OnError.connect(lambda message: print(f"error: {message}", file=sys.stderr))
+
+    for sensor, sensor_camera in enumerate(cameras):
+        core.start_synthetic_camera(sensor_camera, sensor)
+    controller.start_prep()
+    if controller.active:
+        app.exec()
+
+    pipelines = [session.stats.summary() for session in core.sessions]
+    core.shutdown()
+    joined = join_positions(samples.samples["host_time_ns"], position_sampler.stop())
+    measured = with_positions(samples.samples, joined)
+
+    # Frames where the line is on the sensor, the rest are between the circles
+    readings = camera.readings(measured["frame_time_us"])
+    on_sensor = np.abs(readings) < OFF_SENSOR_THRESHOLD
+    difference = measured["micron"][on_sensor] - readings[on_sensor]
+
+    # The other sensors see the same readings, so once aligned they differ by the noise only. Only
+    # samples on the circle count, and the median keeps out the few next to the moves on and off
+    # the sensor, which are over within a frame or two.
+    circle = on_circle(measured, radius)
+    alignment = []
+    for stream in streams[1:]:
+        aligned = align_samples(measured["host_time_ns"][circle], stream.samples)
+        offsets = aligned - measured["micron"][circle]
+        offsets = offsets[np.isfinite(offsets)]
+        alignment.append(float(np.median(np.abs(offsets))) if offsets.size else np.nan)
+
+    traces = isolate_trace(measured, OFF_SENSOR_THRESHOLD, laps, lap=None, theta=measured["theta"], keep=circle)
+    diagnostics = analyse_trace(*traces, radius_mm=radius)
+    return {
+        "state": controller.state,
+        "backend": backend,
+        "workers": core.num_workers,
+        "pipelines": pipelines,
+        "skipped_frames": sum(sensor_camera.skipped for sensor_camera in cameras),
+        "rms_error_um": float(np.sqrt(np.mean(difference**2))) if difference.size else np.nan,
+        "alignment_um": alignment,
+        "diagnostics": diagnostics_to_dict(diagnostics),
+        "samples": measured,
+    }
+
+
+def print_report(result: Dict[str, Any], errors: MachineErrors, radius: float) -> None:
+    print(f"{result['state']}: {result['skipped_frames']} frames not rendered in time")
+    print(
+        f"{len(result['pipelines'])} sensors, {result['workers']} {result['backend']} workers each "
+        f"on {os.cpu_count()} cores"
+    )
+    for sensor, pipeline in enumerate(result["pipelines"]):
+        print(
+            f"sensor {sensor}: {pipeline['received']} frames received ({pipeline['received_fps']:.1f} fps), "
+            f"{pipeline['processed']} processed ({pipeline['processed_fps']:.1f} fps), {pipeline['dropped']} dropped"
+        )
+        for stage, histogram in pipeline["stages"].items():
+            print(f"  {stage:<11} mean {histogram['mean_ms']:7.3f} ms  p99 {histogram['p99_ms']:7.3f} ms")
+    print(f"measured minus rendered reading: {result['rms_error_um']:.3f} µm rms")
+    for sensor, difference in enumerate(result["alignment_um"], 1):
+        print(f"sensor {sensor} minus sensor 0, aligned on the host clock: {difference:.3f} µm median")
+
+    # What the diagnostics should find, see the ellipse terms in analyse_trace
+    expected = {
+        "scale_mismatch_um": (errors.scale_x_ppm - errors.scale_y_ppm) * radius * 1e-3,
+        "squareness_um_per_m": errors.squareness_um_per_m,
+    }
+    diagnostics = result["diagnostics"]
+    for name, value in diagnostics.items():
+        line = f"  {name:<22} {value if value is not None else float('nan'):10.3f}"
+        if name in expected:
+            line += f"  simulated {expected[name]:.3f}"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a ballbar check headless on a simulated machine and camera.")
+    parser.add_argument("--resolution", default="1280x720", choices=list(RESOLUTIONS))
+    parser.add_argument("--fps", type=float, default=120.0, help="frame rate of the synthetic camera")
+    parser.add_argument("--speed", type=float, default=10.0, help="simulated seconds per real second")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="frame workers per sensor, the cores shared out by default"
+    )
+    parser.add_argument("--sensors", type=int, default=1, help="synthetic cameras, each in its own camera session")
+    parser.add_argument(
+        "--backend", default="thread", choices=list(worker_backends), help="where the frame workers analyse frames"
+    )
+    parser.add_argument("--radius", type=float, default=50.0, help="ballbar length in mm")
+    parser.add_argument("--laps", type=int, default=1, help="laps per circle, the P word of the G02/G03 moves")
+    parser.add_argument("--estimator", default="", help="peak estimator, the analyser's default when empty")
+    parser.add_argument(
+        "--min-fps", type=float, default=0.0, help="fail when a sensor processes fewer frames per second"
+    )
+    parser.add_argument("--stats", default="", help="JSON file to write the pipeline summary to")
+    parser.add_argument("--output", default="", help="run file to write the samples to")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    errors = MachineErrors()
+    start = time.perf_counter()
+    result = run_loadtest(
+        args.resolution,
+        args.fps,
+        args.speed,
+        args.workers,
+        args.radius,
+        args.laps,
+        args.estimator,
+        errors,
+        args.sensors,
+        args.backend,
+    )
+    print(f"check simulated in {time.perf_counter() - start:.1f} s")
+    print_report(result, errors, args.radius)
+
+    if args.stats:
+        with open(args.stats, "w") as file:
+            json.dump(result["pipelines"], file, indent=2)
+    if args.output:
+        write_run(args.output, result["samples"], {"radius_mm": args.radius, "simulated": True})
+
+    if result["state"] != DONE:
+        return 1
+    slowest = min(pipeline["processed_fps"] for pipeline in result["pipelines"])
+    return 1 if slowest < args.min_fps else 0
+
+
+if __name__ == "__main__":
+    # QT_QPA_PLATFORM=offscreen python -m src.loadtest --fps 240 --resolution 640x480
+    sys.exit(main())
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import List
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+def gap_indices(theta: npt.NDArray[np.float64], factor: float = 1.5) -> npt.NDArray[np.intp]:
+    """Returns the indices after which the angle step is more than `factor` times the typical step."""
+    if theta.size < 3:
+        return np.zeros(0, dtype=np.intp)
+    steps = np.abs(np.diff(theta))
+    return np.flatnonzero(steps > factor * np.median(steps))
+
+
+def mean_angle(a: npt.NDArray[np.float64], b: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Returns the circular mean of two angles, on the side of `a`.
+
+    A pair on either side of 0/2π, e.g. 6.28 and 0.001, merges to about 6.282 rather than π.
+    """
+    step = (b - a + np.pi) % (2 * np.pi) - np.pi
+    mean: npt.NDArray[np.float64] = a + step / 2
+    return mean
+
+
+class TracePyramid:
+    """
+    Min/max decimation pyramid of a polar trace, to draw millions of samples at screen resolution.
+
+    Level 0 is the trace itself. Every next level merges pairs of neighbouring blocks, keeping their
+    circular mean angle and the smallest and largest radius, so spikes such as reversal marks survive any
+    amount of decimation. Building it is O(n) and the pyramid takes about twice the memory of the
+    trace. `points` picks the level that has about as many points as the screen can show.
+
+    Args:
+    theta: angles of the samples in radians, in sample order.
+    r: radius of each sample.
+    """
+
+    def __init__(self, theta: npt.ArrayLike, r: npt.ArrayLike) -> None:
+        self.theta: npt.NDArray[np.float64] = np.asarray(theta, dtype=np.float64)
+        self.r: npt.NDArray[np.float64] = np.asarray(r, dtype=np.float64)
+        self.levels: List[Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64], npt.NDArray[np.float64]]] = [
+            (self.theta, self.r, self.r)
+        ]
+
+        angles, low, high = self.levels[0]
+        while angles.size > 1:
+            pairs = angles.size // 2 * 2
+            merged_angles = mean_angle(angles[0:pairs:2], angles[1:pairs:2])
+            merged_low = np.minimum(low[0:pairs:2], low[1:pairs:2])
+            merged_high = np.maximum(high[0:pairs:2], high[1:pairs:2])
+            if pairs < angles.size:  # An odd block at the end is carried up unchanged
+                merged_angles = np.append(merged_angles, angles[-1])
+                merged_low = np.append(merged_low, low[-1])
+                merged_high = np.append(merged_high, high[-1])
+            angles, low, high = merged_angles, merged_low, merged_high
+            self.levels.append((angles, low, high))
+
+    def __len__(self) -> int:
+        return self.theta.size
+
+    @property
+    def r_range(self) -> Tuple[float, float]:
+        """Smallest and largest radius of the whole trace, read from the top of the pyramid."""
+        if not self.theta.size:
+            return np.nan, np.nan
+        _, low, high = self.levels[-1]
+        return float(low[0]), float(high[0])
+
+    def level_for(self, max_points: int) -> int:
+        """Returns the finest level that draws with at most `max_points` points."""
+        for index, (theta, _, _) in enumerate(self.levels):
+            if theta.size * (1 if index == 0 else 2) <= max_points:
+                return index
+        return len(self.levels) - 1
+
+    def points(self, max_points: int, closed: bool = True) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        """
+        Returns the angles and radii to draw the trace with at most about `max_points` points.
+
+        Decimated blocks are drawn as a vertical stroke from their minimum to their maximum. NaN
+        points break the line where samples are missing, and with `closed` the first point is
+        repeated at the end so the trace wraps around.
+        """
+        level = self.level_for(max_points)
+        theta, low, high = self.levels[level]
+        if not theta.size:
+            return theta, low
+
+        if level:
+            theta = np.repeat(theta, 2)
+            r = np.empty(theta.size)
+            r[0::2] = low
+            r[1::2] = high
+            gaps = (gap_indices(theta[0::2]) + 1) * 2
+        else:
+            r = low
+            gaps = gap_indices(theta) + 1
+
+        if closed:
+            theta = np.append(theta, theta[0])
+            r = np.append(r, r[0])
+        if gaps.size:
+            theta = np.insert(theta, gaps, np.nan)
+            r = np.insert(r, gaps, np.nan)
+        return theta, r
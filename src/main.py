@@ -1,17 +1,17 @@
 from __future__ import annotations
 
 import os
-import pickle
 import sys
-from typing import List
+from typing import Optional
+from typing import Union
 
+import numpy as np
 import qdarktheme
 from PySide6.QtCore import QSettings
 from PySide6.QtCore import Qt
-from PySide6.QtCore import QThread
-from PySide6.QtCore import Signal
 from PySide6.QtGui import QCloseEvent
 from PySide6.QtWidgets import QApplication
+from PySide6.QtWidgets import QCheckBox
 from PySide6.QtWidgets import QComboBox
 from PySide6.QtWidgets import QFileDialog
 from PySide6.QtWidgets import QFormLayout
@@ -22,29 +22,45 @@ from PySide6.QtWidgets import QMainWindow
 from PySide6.QtWidgets import QMessageBox
 from PySide6.QtWidgets import QPushButton
 from PySide6.QtWidgets import QSlider
+from PySide6.QtWidgets import QSpinBox
 from PySide6.QtWidgets import QSplitter
 from PySide6.QtWidgets import QVBoxLayout
 from PySide6.QtWidgets import QWidget
 
+from src.controller import BallbarController
+from src.controller import CANCELLED
+from src.controller import DONE
+from src.controller import ERROR
+from src.controller import INSTALL
+from src.controller import RUN
 from src.Core import Core
-from src.data_filtering import filter_and_isolate_data
+from src.curves import default_estimator
+from src.curves import estimator_names
+from src.data_filtering import isolate_trace
+from src.data_filtering import OFF_SENSOR_THRESHOLD
 from src.DataClasses import FastData
+from src.DataClasses import SAMPLE_DTYPE
+from src.diagnostics import analyse_trace
+from src.diagnostics import diagnostics_to_dict
+from src.journal import JOURNAL_EXTENSION
+from src.journal import read_journal
+from src.journal import SampleJournal
+from src.linuxcnc_ballbar_check import lap_time
+from src.positions import join_positions
+from src.positions import on_circle
+from src.positions import PositionSampler
+from src.positions import with_positions
+from src.runfile import load_angles
+from src.runfile import open_samples
+from src.runfile import Run
+from src.runfile import RUN_EXTENSION
+from src.runfile import write_run
 from src.Widgets import AnalyserWidget
 from src.Widgets import FloatLineEdit
 from src.Widgets import Graph
 from src.Widgets import PixmapWidget
-
-
-class CommandWorker(QThread):  # type: ignore
-    finished = Signal()  # Signal to notify when the command execution is finished
-
-    def __init__(self, command: str) -> None:
-        super().__init__()
-        self.command = command
-
-    def run(self) -> None:
-        os.system(self.command)  # Run the command
-        # no need to emit finished as it will by default from the QThread
+from src.Widgets import StatsWidget
+from src.Workers import worker_backends
 
 
 # Define the main window
@@ -54,7 +70,10 @@ class MainWindow(QMainWindow):  # type: ignore
 
         self.setWindowTitle("Awesome Ballbar")
 
-        self.core = Core()  # where all the magic happens
+        # Where the frames are analysed is only read at start up, the workers are created with Core
+        backend = QSettings("awesome-ballbar", "AwesomeBallbar").value("worker_backend", "thread")
+        self.core = Core(backend=backend if backend in worker_backends else "thread")  # where all the magic happens
+        self.controller = BallbarController()  # drives the machine through the check
 
         # Widgets:
         self.left_splitter = QSplitter()
@@ -66,11 +85,19 @@ class MainWindow(QMainWindow):  # type: ignore
         plot_box = QGroupBox("Plot")
         commands_box = QGroupBox("Commands")
         settings_box = QGroupBox("Settings")
+        pipeline_box = QGroupBox("Pipeline")
         self.sensor_width = FloatLineEdit()
 
         start_btn = QPushButton("Start")
+        cancel_btn = QPushButton("Cancel")
+        self.check_status = QLabel("Idle")
 
-        self.data: List[float] = []
+        # Measurements of the last finished or loaded run, by column. A loaded run file stays memory-mapped.
+        self.samples: Union[np.ndarray, Run] = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.journal: Optional[SampleJournal] = None  # streams the samples of a run in progress to disk
+        self.sample_theta: Optional[np.ndarray] = None  # machine angle of every sample, when it was recorded
+        self.position_sampler: Optional[PositionSampler] = None  # polls the machine position during a run
+        self.diagnostics = analyse_trace([], [])  # of the samples in the graph
 
         self.analyser_widget = AnalyserWidget()
         self.sensor_feed_widget = PixmapWidget()
@@ -79,30 +106,73 @@ class MainWindow(QMainWindow):  # type: ignore
         self.smoothing = QSlider(Qt.Horizontal)
         self.smoothing.setRange(0, 200)
         self.smoothing.setTickInterval(1)
+        self.estimator_combo = QComboBox()
+        self.estimator_combo.addItems(estimator_names)
+        self.estimator_combo.setCurrentText(default_estimator)
+        self.roi_check = QCheckBox("Track line")
+        self.roi_margin = QSpinBox()
+        self.roi_margin.setRange(8, 2000)
+        self.roi_margin.setValue(self.core.session.frameWorkers[0].analyser.band_tracker.margin)
+        self.roi_margin.setSuffix(" px")
+        self.roi_rows = QSpinBox()
+        self.roi_rows.setRange(1, 100)
+        self.roi_rows.setValue(100)
+        self.roi_rows.setSuffix(" %")
+        self.record_frames = QCheckBox("Record frames during a run")
+        self.worker_backend = QComboBox()
+        self.worker_backend.addItems(list(worker_backends))
+        self.worker_backend.setCurrentText(self.core.backend)
+        self.worker_backend.setToolTip(
+            "Where the frames are analysed, processes make use of more cores. Takes effect on the next start"
+        )
+        self.plot_rate = QSpinBox()
+        self.plot_rate.setRange(1, 60)
+        self.plot_rate.setValue(10)
+        self.plot_rate.setSuffix(" Hz")
+        self.plot_rate.setToolTip("How often the plot is redrawn during a run")
+        self.preview_rate = QSpinBox()
+        self.preview_rate.setRange(1, 120)
+        self.preview_rate.setValue(int(self.core.display_rate_hz))
+        self.preview_rate.setSuffix(" Hz")
+        self.preview_rate.setToolTip(
+            "How often the camera preview and scope are redrawn, every frame is still measured"
+        )
         save_btn = QPushButton("Save")
         load_btn = QPushButton("Load")
+        replay_btn = QPushButton("Replay Frames")
 
         self.graph = Graph()
+        self.stats_widget = StatsWidget(self.core.stats)
 
         # Layouts
         settings_form = QFormLayout()
         settings_form.addRow("Sensor Width", self.sensor_width)
+        settings_form.addRow("Recording", self.record_frames)
+        settings_form.addRow("Live Plot", self.plot_rate)
+        settings_form.addRow("Preview Rate", self.preview_rate)
+        settings_form.addRow("Workers", self.worker_backend)
 
         settings_layout = QVBoxLayout()
         settings_layout.addLayout(settings_form)
         settings_layout.addWidget(save_btn)
         settings_layout.addWidget(load_btn)
+        settings_layout.addWidget(replay_btn)
         settings_box.setLayout(settings_layout)
 
         control_layout = QHBoxLayout()
         commands_layout = QVBoxLayout()
-        for btn in [start_btn]:
+        for btn in [start_btn, cancel_btn]:
             btn.setFixedHeight(60)
             commands_layout.addWidget(btn)
+        commands_layout.addWidget(self.check_status)
         commands_layout.addStretch()
         commands_box.setLayout(commands_layout)
         control_layout.addWidget(settings_box)
         control_layout.addWidget(commands_box)
+        pipeline_layout = QVBoxLayout()
+        pipeline_layout.addWidget(self.stats_widget)
+        pipeline_box.setLayout(pipeline_layout)
+        control_layout.addWidget(pipeline_box)
         control_box.setLayout(control_layout)
 
         central_widget = QWidget()
@@ -123,6 +193,10 @@ class MainWindow(QMainWindow):  # type: ignore
 
         analyser_form = QFormLayout()
         analyser_form.addRow("Smoothing", self.smoothing)
+        analyser_form.addRow("Estimator", self.estimator_combo)
+        analyser_form.addRow("ROI", self.roi_check)
+        analyser_form.addRow("ROI Margin", self.roi_margin)
+        analyser_form.addRow("ROI Rows", self.roi_rows)
         analyser_layout = QVBoxLayout()
         analyser_layout.addLayout(analyser_form)
         analyser_layout.addWidget(self.analyser_widget)
@@ -146,45 +220,67 @@ class MainWindow(QMainWindow):  # type: ignore
         self.core.set_camera(self.camera_combo.currentIndex())
 
         # Signals
-        self.core.frameWorker.OnAnalyserUpdate.connect(self.analyser_widget.set_data)
+        self.core.OnAnalyserUpdate.connect(self.analyser_widget.set_data)
         self.sensor_feed_widget.OnHeightChanged.connect(self.analyser_widget.setMaximumHeight)
         self.sensor_feed_widget.OnHeightChanged.connect(
-            lambda value: setattr(self.core.frameWorker, "analyser_widget_height", value)
+            lambda value: setattr(self.core, "analyser_widget_height", value)
         )
-        self.core.frameWorker.OnPixmapChanged.connect(self.sensor_feed_widget.setPixmap)
-        self.smoothing.valueChanged.connect(lambda value: setattr(self.core.frameWorker, "analyser_smoothing", value))
-        start_btn.clicked.connect(self.prep_ballbar)
-        self.sensor_width.textChanged.connect(self.core.frameWorker.set_sensor_width_mm)
+        self.core.OnSensorFeedUpdate.connect(self.sensor_feed_widget.setPixmap)
+        self.smoothing.valueChanged.connect(lambda value: self.core.set_analyser_option("smoothing", value))
+        self.estimator_combo.currentTextChanged.connect(lambda value: self.core.set_analyser_option("estimator", value))
+        self.roi_check.toggled.connect(lambda value: self.core.set_analyser_option("roi_enabled", value))
+        self.roi_margin.valueChanged.connect(lambda value: self.core.set_band_option("margin", value))
+        self.roi_rows.valueChanged.connect(lambda value: self.core.set_band_option("row_fraction", value / 100.0))
+        self.preview_rate.valueChanged.connect(lambda value: self.core.set_display_rate(float(value)))
+        start_btn.clicked.connect(self.controller.start_prep)
+        cancel_btn.clicked.connect(self.controller.cancel)
+        self.controller.OnStateChanged.connect(self.check_state_changed)
+        self.controller.OnProgress.connect(
+            lambda done, total: self.check_status.setText(f"{self.controller.state.title()}: {done}/{total}")
+        )
+        self.controller.OnError.connect(lambda message: QMessageBox.warning(self, "Ballbar Check", message))
+        self.sensor_width.textChanged.connect(self.core.set_sensor_width_mm)
         self.sensor_width.setText("5.5")
 
         load_btn.clicked.connect(self.load_data_gui)
+        replay_btn.clicked.connect(self.replay_frames_gui)
 
         self.load_settings()
 
-        # DEBUGGING
-        self.load_pickle("/home/howard/Documents/awesome-ballbar/ballbar_04.pkl")
-
-    def load_data_gui(self):
-        """Open a file dialog to select a pickle file and load its content into self.data."""
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open Pickle File", "", "Pickle Files (*.pkl);;All Files (*)")
+    def load_data_gui(self) -> None:
+        """Open a file dialog to select a run file and load its content into self.samples."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Run", "", "Ballbar Runs (*.bbr *.journal *.pkl);;All Files (*)"
+        )
         if file_path:
             print(f"loading file: {file_path}")
-            self.load_pickle(file_path)
+            self.load_run(file_path)
 
-    def load_pickle(self, file_path):
-        """Load data from a pickle file into self.data."""
-        with open(file_path, "rb") as file:
-            self.data = pickle.load(file)
+    def replay_frames_gui(self) -> None:
+        """Open a file dialog to select a frame recording and replay it through the analyser."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Frame Recording", "", "Frame Recordings (*.frames);;All Files (*)"
+        )
+        if file_path:
+            print(f"replaying file: {file_path}")
+            self.core.start_replay(file_path)
 
+    def load_run(self, file_path: str) -> None:
+        """Load a run file, or a pickle from an older version, into self.samples."""
+        self.samples = open_samples(file_path)
+        self.sample_theta = load_angles(file_path)
         self.update_graph()
 
-    def prep_ballbar(self) -> None:
-        command = "python src/linuxcnc_ballbar_check.py prep"
-
-        # Create and start the worker thread for preparation
-        self.prep_worker = CommandWorker(command)
-        self.prep_worker.finished.connect(self.show_ballbar_message)  # Connect signal to show message
-        self.prep_worker.start()
+    def check_state_changed(self, state: str) -> None:
+        self.check_status.setText(state.title())
+        if state == INSTALL:
+            self.show_ballbar_message()
+        elif state == RUN and self.controller.stat is not None:
+            # Its own stat, the sampler polls from its own thread
+            self.position_sampler = PositionSampler(self.controller.cnc.stat())
+            self.position_sampler.start()
+        elif state in (DONE, CANCELLED, ERROR) and self.journal:
+            self.run_finished()  # Whatever was measured is kept, also when the check stopped early
 
     def show_ballbar_message(self) -> None:
         msg_box = QMessageBox()
@@ -195,61 +291,115 @@ class MainWindow(QMainWindow):  # type: ignore
         continue_button = msg_box.button(QMessageBox.Ok)
         continue_button.setText("Continue")
 
+        msg_box.addButton(QMessageBox.Cancel)
+
         # Show the message box and connect its button click to run_ballbar
         if msg_box.exec() == QMessageBox.Ok:
             self.run_ballbar()
+        else:
+            self.controller.cancel()
 
     def store_data(self, data: FastData) -> None:
-        self.data.append(data.sample_micron_value)
+        if self.journal is None:
+            return  # A frame that was still in flight when the run finished
+        self.journal.append(data)
+
+        # Prefer the camera's clock for the live plot, like update_graph does
+        time_s = data.frame_time_us / 1e6 if data.frame_time_us >= 0 else data.host_time_ns / 1e9
+        self.graph.add_live_sample(data.sample_micron_value, time_s)
+
+    def next_run_name(self) -> str:
+        """Returns the first ballbar_NN name that has not been saved yet."""
+        i = 1
+        while any(os.path.exists(f"ballbar_{i:02d}{ext}") for ext in (RUN_EXTENSION, JOURNAL_EXTENSION, ".pkl")):
+            i += 1
+        return f"ballbar_{i:02d}"
 
     def run_ballbar(self) -> None:
-        # Connect up the data feed and store the result
-        self.data = []
-        self.core.frameWorker.OnAnalyserUpdate.connect(self.store_data)
+        # Connect up the data feed and stream the result to disk, so a crash doesn't lose the run
+        self.samples = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.run_name = self.next_run_name()
+        self.journal = SampleJournal(f"{self.run_name}{JOURNAL_EXTENSION}")
+        self.graph.start_live(lap_time(), OFF_SENSOR_THRESHOLD, self.plot_rate.value())
+        self.core.reset_stats()
+        self.core.OnAnalyserUpdate.connect(self.store_data)
 
-        command = "python src/linuxcnc_ballbar_check.py run"
+        if self.record_frames.isChecked():
+            self.core.start_recording(f"{self.run_name}.frames")
 
-        # Create and start the worker thread for running the ballbar check
-        self.run_worker = CommandWorker(command)
-        self.run_worker.finished.connect(self.run_finished)  # Connect signal to indicate completion
-        self.run_worker.start()
+        self.controller.start_run()
 
     def run_finished(self) -> None:
-        self.core.frameWorker.OnAnalyserUpdate.disconnect(self.store_data)
+        self.core.OnAnalyserUpdate.disconnect(self.store_data)
+        self.core.stop_recording()
         print("Ballbar check finished.")
 
-        print(f"total samples: {len(self.data)} samples per degree = {len(self.data)/360}")
-
+        assert self.journal is not None  # Only a run that was started finishes
+        journal_path = self.journal.path
+        self.journal.close()
+        self.journal = None
+        self.graph.stop_live()
+        samples = np.array(read_journal(journal_path))  # Copied, the journal is removed once the run file is written
+
+        # Place every sample at the machine position it was measured at
+        self.sample_theta = None
+        if self.position_sampler:
+            joined = join_positions(samples["host_time_ns"], self.position_sampler.stop())
+            self.position_sampler = None
+            self.sample_theta = joined["theta"]
+            samples = with_positions(samples, joined)
+
+        dropped = int(samples["sequence"][-1] - samples["sequence"][0] + 1 - len(samples)) if len(samples) else 0
+        print(f"total samples: {len(samples)} samples per degree = {len(samples)/360} dropped frames: {dropped}")
+
+        self.samples = samples
         self.update_graph()
 
-        # Base filename
-        base_filename = "ballbar_"
-        extension = ".pkl"
-        i = 1
-
-        # Determine the correct filename
-        while True:
-            filename = f"{base_filename}{i:02d}{extension}"
-            if not os.path.exists(filename):
-                break
-            i += 1
-
-        # Write the array to a pickle file
-        with open(filename, "wb") as file:
-            pickle.dump(self.data, file)
-
-    def update_graph(self):
-        threshold = 700
-        isolated_data = filter_and_isolate_data(self.data, threshold)
-
-        clockwise = isolated_data["clockwise"][0]
-        clockwise.reverse()
-        counterclockwise = isolated_data["counterclockwise"][0]
+        self.core.stats.dump(f"{self.run_name}_stats.json")
+
+        # Write the samples, with the settings they were measured with, to a run file
+        metadata = {
+            "sensor_width_mm": self.core.session.frameWorkers[0].analyser.sensor_width_mm,
+            "estimator": self.estimator_combo.currentText(),
+            "smoothing": self.smoothing.value(),
+            "track_line": self.roi_check.isChecked(),
+            "received_fps": self.core.stats.summary()["received_fps"],
+            "dropped_frames": dropped,
+            "radius_mm": self.controller.radius,
+            "feed_mm_min": self.controller.operation_feed,
+            "laps": self.controller.laps,
+            "completed": self.controller.state == DONE,
+            "diagnostics": diagnostics_to_dict(self.diagnostics),
+        }
+        write_run(f"{self.run_name}{RUN_EXTENSION}", samples, metadata)
+        os.remove(journal_path)  # The run file has everything now
+
+    def update_graph(self) -> None:
+        radius, laps = self.controller.radius, self.controller.laps
+        if isinstance(self.samples, Run):
+            radius = self.samples.metadata.get("radius_mm", radius)
+            laps = self.samples.metadata.get("laps", laps)
+
+        # Place the samples by frame time when every sample has one, so dropped frames show as gaps. With
+        # the machine positions, the samples of the moves on and off the circle are left out. Every lap is
+        # drawn and counts towards the diagnostics, their angles wrap around.
+        clockwise, counterclockwise, clockwise_theta, counterclockwise_theta = isolate_trace(
+            self.samples,
+            OFF_SENSOR_THRESHOLD,
+            laps,
+            lap=None,
+            theta=self.sample_theta,
+            keep=on_circle(self.samples, radius),
+        )
 
         print("Clockwise Data:", len(clockwise))
         print("Counterclockwise Data:", len(counterclockwise))
 
-        self.graph.set_data(clockwise, counterclockwise)
+        self.graph.set_data(counterclockwise, clockwise, counterclockwise_theta, clockwise_theta)
+
+        self.diagnostics = analyse_trace(clockwise, counterclockwise, clockwise_theta, counterclockwise_theta, radius)
+        for name, value in diagnostics_to_dict(self.diagnostics).items():
+            print(f"{name}: {value}")
 
     def load_settings(self) -> None:
         settings = QSettings("awesome-ballbar", "AwesomeBallbar")
@@ -264,6 +414,20 @@ class MainWindow(QMainWindow):  # type: ignore
             self.right_splitter.setSizes([int(i) for i in settings.value("right_splitter")])
         if settings.contains("smoothing"):
             self.smoothing.setValue(int(settings.value("smoothing")))
+        if settings.contains("estimator") and settings.value("estimator") in estimator_names:
+            self.estimator_combo.setCurrentText(settings.value("estimator"))
+        if settings.contains("roi_enabled"):
+            self.roi_check.setChecked(settings.value("roi_enabled") in (True, "true"))
+        if settings.contains("roi_margin"):
+            self.roi_margin.setValue(int(settings.value("roi_margin")))
+        if settings.contains("roi_rows"):
+            self.roi_rows.setValue(int(settings.value("roi_rows")))
+        if settings.contains("record_frames"):
+            self.record_frames.setChecked(settings.value("record_frames") in (True, "true"))
+        if settings.contains("plot_rate"):
+            self.plot_rate.setValue(int(settings.value("plot_rate")))
+        if settings.contains("preview_rate"):
+            self.preview_rate.setValue(int(settings.value("preview_rate")))
 
     def closeEvent(self, event: QCloseEvent) -> None:
         self.settings = QSettings("awesome-ballbar", "AwesomeBallbar")
@@ -272,12 +436,27 @@ class MainWindow(QMainWindow):  # type: ignore
         self.settings.setValue("middle_splitter", self.middle_splitter.sizes())
         self.settings.setValue("right_splitter", self.right_splitter.sizes())
         self.settings.setValue("smoothing", self.smoothing.value())
+        self.settings.setValue("estimator", self.estimator_combo.currentText())
+        self.settings.setValue("roi_enabled", self.roi_check.isChecked())
+        self.settings.setValue("roi_margin", self.roi_margin.value())
+        self.settings.setValue("roi_rows", self.roi_rows.value())
+        self.settings.setValue("record_frames", self.record_frames.isChecked())
+        self.settings.setValue("plot_rate", self.plot_rate.value())
+        self.settings.setValue("preview_rate", self.preview_rate.value())
+        self.settings.setValue("worker_backend", self.worker_backend.currentText())
 
         # Cleanup the threads
-        self.core.workerThread.quit()
-        self.core.workerThread.wait()
-
-        # Close the ballbar thread
+        self.core.stop_replay()
+        self.core.stop_recording()
+        self.core.shutdown()
+        if self.journal:
+            self.core.OnAnalyserUpdate.disconnect(self.store_data)
+            self.journal.close()  # Left on disk, the interrupted run can be loaded or converted
+
+        # Stop the machine if a check is still going
+        self.controller.cancel()
+        if self.position_sampler:
+            self.position_sampler.stop()
 
         self.deleteLater()
         super().closeEvent(event)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+from typing import List
+
+import numpy as np
+import numpy.typing as npt
+
+
+class ReorderBuffer:
+    """
+    Puts results that finish out of order back into sequence number order.
+
+    Frames are numbered when they are dispatched to a worker, and every dispatched number must
+    come back once, either with `push` or, when the worker could not produce a result, with
+    `skip`. Results are held until all earlier numbers have come back. If more than
+    `max_pending` results are waiting the missing number is given up on, so a lost result can
+    only stall the output briefly.
+    """
+
+    def __init__(self, max_pending: int = 64) -> None:
+        self.max_pending = max_pending
+        self.next_sequence = 0  # the sequence number that is released next
+        self.pending: Dict[int, Any] = {}
+
+    def reset(self, next_sequence: int = 0) -> None:
+        self.next_sequence = next_sequence
+        self.pending.clear()
+
+    def push(self, sequence: int, item: Any) -> List[Any]:
+        """Adds a result and returns the results that are now in order, oldest first."""
+        if sequence < self.next_sequence:
+            return []  # Arrived after it was given up on
+
+        self.pending[sequence] = item
+        return self._release()
+
+    def skip(self, sequence: int) -> List[Any]:
+        """Marks a sequence number that will never produce a result."""
+        return self.push(sequence, None)
+
+    def _release(self) -> List[Any]:
+        released = []
+        while self.pending:
+            if self.next_sequence not in self.pending:
+                if len(self.pending) <= self.max_pending:
+                    break
+                self.next_sequence = min(self.pending)  # Give up on the missing results
+
+            item = self.pending.pop(self.next_sequence)
+            self.next_sequence += 1
+            if item is not None:
+                released.append(item)
+        return released
+
+
+def align_samples(
+    times_ns: npt.ArrayLike, samples: npt.NDArray[np.void], max_gap_ns: int = 50_000_000
+) -> npt.NDArray[np.float64]:
+    """
+    Returns the micron values of one sensor's samples at other times on the shared host clock.
+
+    With two sensors on one Core, e.g. radial and axial, `times_ns` is the host_time_ns of the
+    first sensor's samples and `samples` the second sensor's. Each time is located between two
+    samples with one searchsorted and the value is linearly interpolated between them.
+
+    Args:
+    times_ns: time.monotonic_ns() times to align to.
+    samples: SAMPLE_DTYPE samples in arrival order.
+    max_gap_ns: longest gap between two samples that is interpolated across, longer gaps are dropped frames.
+
+    Returns:
+    One micron value per time, NaN outside the samples or within a longer gap.
+    """
+    times = np.asarray(times_ns, dtype=np.int64)
+    aligned = np.full(times.shape[0], np.nan)
+    arrived = samples["host_time_ns"]
+    if arrived.shape[0] < 2 or not times.size:
+        return aligned
+
+    right = np.clip(np.searchsorted(arrived, times, side="right"), 1, arrived.shape[0] - 1)
+    left = right - 1
+    span = arrived[right] - arrived[left]
+    valid = (times >= arrived[0]) & (times <= arrived[-1]) & (span <= max_gap_ns)
+
+    fraction = np.divide((times - arrived[left]).astype(np.float64), span, out=np.zeros(times.shape[0]), where=span > 0)
+    values = samples["micron"]
+    aligned[valid] = (values[left] + fraction * (values[right] - values[left]))[valid]
+    return aligned
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# One polled machine position, in work coordinates (G54 and G92 offsets removed)
+POSITION_DTYPE = np.dtype(
+    [
+        ("host_time_ns", "<i8"),  # time.monotonic_ns() right after the poll, the clock FastData.host_time_ns uses
+        ("x", "<f8"),
+        ("y", "<f8"),
+        ("z", "<f8"),
+    ]
+)
+
+# Machine position joined to each camera sample, NaN where the sample is outside the polled span
+JOINED_DTYPE = np.dtype(
+    [
+        ("x_mm", "<f8"),
+        ("y_mm", "<f8"),
+        ("theta", "<f8"),  # angle around the circle centre in radians, 0 to 2π counterclockwise from +X
+    ]
+)
+
+# Distance from the circle within which the machine counts as on it, the moves on and off the sensor are 1 mm
+ON_CIRCLE_TOLERANCE_MM = 0.01
+
+
+class PositionSampler:
+    """
+    Polls the machine position at a fixed rate on a background thread while a check is running.
+
+    The positions go into a preallocated array that doubles when it is full, so a poll allocates
+    nothing most of the time. The thread sleeps until each next tick rather than spinning, and
+    late ticks are skipped instead of bunched up.
+
+    Args:
+    stat: a linuxcnc.stat(), or anything with poll(), actual_position, g5x_offset and g92_offset.
+          It is polled from the sampler thread only, so it must not be shared.
+    rate_hz: polls per second.
+    capacity: positions preallocated for.
+    """
+
+    def __init__(self, stat: Any, rate_hz: float = 500.0, capacity: int = 65536) -> None:
+        self.stat = stat
+        self.interval = 1.0 / rate_hz
+        self.buffer = np.zeros(capacity, dtype=POSITION_DTYPE)
+        self.count = 0
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.count = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._poll_positions, name="PositionSampler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> npt.NDArray[np.void]:
+        """Stops polling and returns a copy of the positions, in time order."""
+        if self.thread:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        return self.positions.copy()
+
+    @property
+    def positions(self) -> npt.NDArray[np.void]:
+        return self.buffer[: self.count]
+
+    def poll(self) -> None:
+        """Records one position, called from the sampler thread."""
+        self.stat.poll()
+        now = time.monotonic_ns()
+        position = self.stat.actual_position
+        g5x = self.stat.g5x_offset
+        g92 = self.stat.g92_offset
+
+        if self.count == self.buffer.shape[0]:
+            buffer = np.zeros(2 * self.buffer.shape[0], dtype=POSITION_DTYPE)
+            buffer[: self.count] = self.buffer
+            self.buffer = buffer
+        self.buffer[self.count] = (
+            now,
+            position[0] - g5x[0] - g92[0],
+            position[1] - g5x[1] - g92[1],
+            position[2] - g5x[2] - g92[2],
+        )
+        self.count += 1
+
+    def _poll_positions(self) -> None:
+        deadline = time.monotonic()
+        while not self.stopping.is_set():
+            self.poll()
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline = time.monotonic()  # Fell behind, skip the missed ticks
+                delay = 0
+            self.stopping.wait(delay)
+
+
+def join_positions(
+    sample_times_ns: npt.ArrayLike, positions: npt.NDArray[np.void], centre: Tuple[float, float] = (0.0, 0.0)
+) -> npt.NDArray[np.void]:
+    """
+    Attaches the machine position at the time of every camera sample, an as-of join on the host clock.
+
+    Each sample time is located between two polled positions with one searchsorted, and the X/Y
+    position is linearly interpolated between them. The angle is then taken around `centre`, the
+    circle centre in work coordinates, so feed changes, dwells and acceleration ramps no longer
+    distort where a sample is drawn.
+
+    Args:
+    sample_times_ns: time.monotonic_ns() of each sample, e.g. the host_time_ns field.
+    positions: POSITION_DTYPE positions in time order, from PositionSampler.
+    centre: X/Y of the circle centre.
+
+    Returns:
+    A JOINED_DTYPE array with one record per sample. Samples before the first or after the last
+    position, or without a time, are NaN.
+    """
+    times = np.asarray(sample_times_ns, dtype=np.int64)
+    joined = np.full(times.shape[0], np.nan, dtype=JOINED_DTYPE)
+    if positions.shape[0] < 2 or not times.size:
+        return joined
+
+    polled = positions["host_time_ns"]
+    inside = (times >= polled[0]) & (times <= polled[-1])
+    right = np.clip(np.searchsorted(polled, times, side="right"), 1, polled.shape[0] - 1)
+    left = right - 1
+
+    span = (polled[right] - polled[left]).astype(np.float64)
+    fraction = np.divide((times - polled[left]).astype(np.float64), span, out=np.zeros(times.shape[0]), where=span > 0)
+    for axis, field in (("x", "x_mm"), ("y", "y_mm")):
+        values = positions[axis]
+        joined[field] = np.where(inside, values[left] + fraction * (values[right] - values[left]), np.nan)
+
+    joined["theta"] = np.arctan2(joined["y_mm"] - centre[1], joined["x_mm"] - centre[0]) % (2 * np.pi)
+    return joined
+
+
+def with_positions(samples: npt.NDArray[np.void], joined: npt.NDArray[np.void]) -> npt.NDArray[np.void]:
+    """Returns the samples with the joined position fields added, e.g. to store them in a run file."""
+    combined = np.zeros(samples.shape[0], dtype=np.dtype(samples.dtype.descr + joined.dtype.descr))
+    for array in (samples, joined):
+        for name in array.dtype.names or ():
+            combined[name] = array[name]
+    return combined
+
+
+def on_circle(
+    samples: Any,
+    radius_mm: float,
+    centre: Tuple[float, float] = (0.0, 0.0),
+    tolerance_mm: float = ON_CIRCLE_TOLERANCE_MM,
+) -> Optional[npt.NDArray[np.bool_]]:
+    """
+    Returns which samples were measured with the machine on the circle of the check.
+
+    The samples of the moves on and off the sensor read the move, not the machine errors, so
+    they are left out of the diagnostics. Samples without a position are kept.
+
+    Args:
+    samples: samples with the joined position fields, or a Run with their columns.
+    radius_mm: radius of the circle.
+    centre: X/Y of the circle centre.
+
+    Returns:
+    A boolean mask over the samples, None when they have no positions.
+    """
+    try:
+        x_mm, y_mm = samples["x_mm"], samples["y_mm"]
+    except (KeyError, ValueError):
+        return None
+    off = np.abs(np.hypot(x_mm - centre[0], y_mm - centre[1]) - radius_mm) >= tolerance_mm
+    keep: npt.NDArray[np.bool_] = ~off  # NaN compares False, so samples without a position are kept
+    return keep
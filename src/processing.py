@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.curves import batch_estimators
+from src.curves import default_estimator
+from src.curves import estimators
+from src.curves import tracking_estimators
+from src.instrumentation import PipelineStats
+
+
+class ProfilePlan:
+    """
+    Smooths, resamples and normalises profiles of one fixed size into preallocated buffers.
+
+    A plan is built once per (profile width, smoothing, output size, batch) and then reused for
+    every frame, so the moving-average window and the interpolation grid are only computed once
+    and running it allocates nothing. With a batch size the plan works on (batch, width) stacks.
+
+    Args:
+    width: number of samples in the incoming profile.
+    smoothing: half width of the moving-average window, 0 disables smoothing.
+    size: number of samples in the resampled output.
+    batch: number of profiles processed together, 0 for a single 1D profile.
+    """
+
+    def __init__(self, width: int, smoothing: int, size: int, batch: int = 0) -> None:
+        self.width = width
+        self.window = min(2 * smoothing + 1, width)  # Full width of the moving-average window
+        self.size = size
+        self.batch = batch
+        prefix = (batch,) if batch else ()
+
+        # Moving average through a running sum, equal to np.convolve(profile, kernel, mode="valid")
+        self._cumsum = np.zeros(prefix + (width + 1,))
+        self._smoothed = np.empty(prefix + (width - self.window + 1,))
+
+        # Linear interpolation of the smoothed profile onto `size` evenly spaced points
+        smoothed_width = self._smoothed.shape[-1]
+        x_new = np.linspace(0, smoothed_width - 1, size)
+        self._left = np.clip(np.floor(x_new).astype(np.intp), 0, max(smoothed_width - 2, 0))
+        self._right = np.minimum(self._left + 1, smoothed_width - 1)
+        self._fraction = x_new - self._left
+        self._gathered = np.empty(prefix + (size,))
+        self._resized = np.empty(prefix + (size,))
+        self._scaled = np.empty(prefix + (size,))
+        self._normal = np.empty(prefix + (size,), dtype=np.uint8)
+
+    def smooth(self, profile: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """Returns the moving average of `profile`, a view into the plan's buffer."""
+        window = self.window
+        np.cumsum(profile, axis=-1, out=self._cumsum[..., 1:])
+        np.subtract(self._cumsum[..., window:], self._cumsum[..., :-window], out=self._smoothed)
+        self._smoothed /= window
+        return self._smoothed
+
+    def resample(self, smoothed: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """Linearly interpolates `smoothed` onto the output grid, a view into the plan's buffer."""
+        np.take(smoothed, self._left, axis=-1, out=self._resized)
+        np.take(smoothed, self._right, axis=-1, out=self._gathered)
+        self._gathered -= self._resized
+        self._gathered *= self._fraction
+        self._resized += self._gathered
+        return self._resized
+
+    def scale(self, resized: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """Rescales each profile in `resized` to the 0-255 range as floats, flat profiles become all zeros."""
+        min_value = resized.min(axis=-1, keepdims=True)
+        span = resized.max(axis=-1, keepdims=True) - min_value
+        scale = np.divide(255.0, span, out=np.zeros_like(span), where=span > 0)
+
+        np.subtract(resized, min_value, out=self._scaled)
+        self._scaled *= scale
+        np.clip(self._scaled, 0, 255, out=self._scaled)
+        return self._scaled
+
+    def quantise(self, scaled: npt.NDArray[np.float64]) -> npt.NDArray[np.uint8]:
+        """Converts a scaled profile to uint8, for display."""
+        self._normal[...] = scaled
+        return self._normal
+
+    def normalise(self, resized: npt.NDArray[np.float64]) -> npt.NDArray[np.uint8]:
+        """Rescales each profile in `resized` to the 0-255 range as uint8, flat profiles become all zeros."""
+        return self.quantise(self.scale(resized))
+
+    def run_scaled(self, profile: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """Smooths, resamples and rescales `profile` to 0-255 floats, the profile the estimators measure on."""
+        return self.scale(self.resample(self.smooth(profile)))
+
+    def run(self, profile: npt.NDArray[np.float64]) -> npt.NDArray[np.uint8]:
+        """Smooths, resamples and normalises `profile` to uint8 in one go."""
+        return self.quantise(self.run_scaled(profile))
+
+    def to_profile_position(self, position: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        """Maps positions in the resampled output back to sample positions in the incoming profile."""
+        scale = (self._smoothed.shape[-1] - 1) / (self.size - 1) if self.size > 1 else 0.0
+        return np.asarray(position) * scale + (self.window - 1) / 2
+
+
+class ProfilePlanCache:
+    """Keeps one ProfilePlan per (width, smoothing, size, batch) so changing a setting back is free."""
+
+    def __init__(self, max_plans: int = 8) -> None:
+        self.max_plans = max_plans
+        self._plans: Dict[Tuple[int, int, int, int], ProfilePlan] = {}
+
+    def get(self, width: int, smoothing: int, size: int, batch: int = 0) -> ProfilePlan:
+        key = (width, smoothing, size, batch)
+        plan = self._plans.get(key)
+        if plan is None:
+            # Drop the oldest plan, e.g. from a smoothing slider being dragged through every value
+            if len(self._plans) >= self.max_plans:
+                del self._plans[next(iter(self._plans))]
+            plan = self._plans[key] = ProfilePlan(width, smoothing, size, batch)
+        return plan
+
+
+class BandTracker:
+    """
+    Reduces only the band of the frame around the laser line to a profile.
+
+    The columns are limited to `margin` pixels either side of the last found peak and the rows to
+    the central `row_fraction` of the frame. When there is no peak yet, or the line was lost, the
+    whole width is searched again.
+
+    Args:
+    margin: number of columns kept either side of the tracked peak.
+    row_fraction: fraction of the rows, centred on the frame, that are averaged.
+    min_contrast: smallest peak to background difference, in grey levels, that counts as a line.
+    """
+
+    def __init__(self, margin: int = 64, row_fraction: float = 1.0, min_contrast: float = 8.0) -> None:
+        self.margin = margin
+        self.row_fraction = row_fraction
+        self.min_contrast = min_contrast
+        self.centre: Optional[float] = None  # column of the tracked peak, None when searching
+        self.band = (0, 0)  # columns reduced in the last frame
+
+    def rows(self, height: int) -> Tuple[int, int]:
+        band_height = max(1, int(round(height * min(max(self.row_fraction, 0.0), 1.0))))
+        start = (height - band_height) // 2
+        return start, start + band_height
+
+    def columns(self, width: int) -> Tuple[int, int]:
+        if self.centre is None:
+            return 0, width
+        start = max(0, int(self.centre) - self.margin)
+        stop = min(width, int(self.centre) + self.margin + 1)
+        return (start, stop) if stop - start >= 3 else (0, width)
+
+    def reduce(self, gray: npt.NDArray[np.uint8], out: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """
+        Averages the band rows of `gray` into `out`, which has one value per frame column.
+
+        Columns outside the band are set to the band minimum, so positions in the profile stay
+        in full frame coordinates and the rest of the pipeline does not need to know about the band.
+        """
+        row_start, row_stop = self.rows(gray.shape[0])
+        self.band = start, stop = self.columns(gray.shape[1])
+
+        band = np.mean(gray[row_start:row_stop, start:stop], axis=0, out=out[start:stop])
+        if stop - start < out.shape[0]:
+            background = band.min()
+            out[:start] = background
+            out[stop:] = background
+        return out
+
+    def update(self, peak: float, profile: npt.NDArray[np.float64]) -> None:
+        """Follows the peak found in `profile`, or goes back to searching when the line was lost."""
+        start, stop = self.band
+        band = profile[start:stop]
+        found = start < peak < stop - 1 and band.max() - band.min() >= self.min_contrast
+
+        # A peak pinned to the edge of a narrowed band means the line moved out of it
+        if found and stop - start < profile.shape[0]:
+            found = (start == 0 or peak > start + 2) and (stop == profile.shape[0] or peak < stop - 3)
+
+        self.centre = float(peak) if found else None
+
+
+# One record per analysed frame, returned by FrameAnalyser
+MEASUREMENT_DTYPE = np.dtype(
+    [
+        ("pixel", np.float64),  # peak position in the output profile, 0 when no peak was found
+        ("micron", np.float64),  # peak offset from the middle of the sensor in microns
+        ("contrast", np.float64),  # peak to background difference of the raw profile in grey levels
+    ]
+)
+
+
+class FrameAnalyser:
+    """
+    Turns grayscale frames into laser line measurements without any Qt.
+
+    This is the whole measurement path: rows are averaged into a profile, smoothed, resampled to
+    `output_size` (the native frame width by default) and rescaled to 0-255, then the selected
+    estimator finds the peak and it is converted to microns from the sensor width. The estimators
+    work on the floating point profile, so no precision is lost to a uint8 rounding or a display
+    sized resampling. `analyse_frame` handles one live frame and keeps the region of interest
+    tracking state, `analyse` runs whole (T, H, W) stacks vectorised.
+    """
+
+    def __init__(self) -> None:
+        self.smoothing = 0  # half width of the moving-average window
+        self.estimator = default_estimator  # name of the peak estimator in src.curves.estimator_names
+        self.sensor_width_mm = 10000000.0
+        self.roi_enabled = False  # only reduce the band around the tracked line in analyse_frame
+        self.band_tracker = BandTracker()
+        self.batch_size = 256  # frames processed together by analyse, bounds the memory used
+
+        self.plans = ProfilePlanCache()
+        self.trackers: Dict[str, Callable[[npt.NDArray[np.float64]], float]] = {}  # this analyser's tracking estimators
+        self._profile = np.empty(0)
+        self.estimator_ms = 0.0  # time the estimator took on the last analyse_frame call
+        self.stats: Optional[PipelineStats] = None  # stage timings of analyse_frame are recorded here if set
+
+    def to_micron(self, pixel: npt.ArrayLike, size: int) -> npt.NDArray[np.float64]:
+        """Converts peak positions in a profile of `size` samples to microns from the sensor middle."""
+        pixel_to_micron = self.sensor_width_mm / size * 1000
+        return (np.asarray(pixel) - size / 2) * pixel_to_micron
+
+    def reset_tracking(self) -> None:
+        """Forgets the tracked line, for when the next frame is unrelated to the last one."""
+        self.band_tracker.centre = None
+        self.trackers.clear()
+
+    def is_tracking(self) -> bool:
+        """Returns if a measurement depends on the frames before it, which then have to come in order."""
+        return self.roi_enabled or self.estimator in tracking_estimators
+
+    def frame_estimator(self) -> Callable[[npt.NDArray[np.float64]], float]:
+        """Returns the selected estimator, a tracking one is created on first use and keeps its state."""
+        if self.estimator not in tracking_estimators:
+            return estimators[self.estimator]
+        if self.estimator not in self.trackers:
+            self.trackers[self.estimator] = tracking_estimators[self.estimator]()
+        return self.trackers[self.estimator]
+
+    def analyse_frame(
+        self, gray: npt.NDArray[np.uint8], output_size: Optional[int] = None
+    ) -> Tuple[np.void, npt.NDArray[np.float64]]:
+        """
+        Measures the laser line in one (H, W) grayscale frame.
+
+        Args:
+        gray: 2D array of the frame luma.
+        output_size: number of samples the profile is resampled to, the frame width by default.
+
+        Returns:
+        The measurement record and the profile it was measured on, rescaled to 0-255 floats. The
+        profile is a view into a reused buffer and is only valid until the next call.
+        """
+        size = output_size or gray.shape[1]
+        if self._profile.shape[0] != gray.shape[1]:
+            self._profile = np.empty(gray.shape[1])
+
+        reduction_start = time.perf_counter()
+        if self.roi_enabled:
+            profile = self.band_tracker.reduce(gray, self._profile)
+        else:
+            profile = np.mean(gray, axis=0, out=self._profile)
+
+        smoothing_start = time.perf_counter()
+        plan = self.plans.get(profile.shape[0], self.smoothing, size)
+        scaled = plan.run_scaled(profile)
+
+        # Time the estimator so its cost can be compared
+        estimator_start = time.perf_counter()
+        pixel = self.frame_estimator()(scaled)
+        estimator_stop = time.perf_counter()
+        self.estimator_ms = (estimator_stop - estimator_start) * 1000.0
+
+        if self.stats:
+            self.stats.record("reduction", smoothing_start - reduction_start)
+            self.stats.record("smoothing", estimator_start - smoothing_start)
+            self.stats.record("fit", estimator_stop - estimator_start)
+
+        if self.roi_enabled:
+            self.band_tracker.update(float(plan.to_profile_position(pixel)), profile)
+
+        record: np.void = np.zeros(1, dtype=MEASUREMENT_DTYPE)[0]
+        record["pixel"] = pixel
+        record["micron"] = self.to_micron(pixel, size)
+        record["contrast"] = profile.max() - profile.min()
+        return record, scaled
+
+    def analyse(self, frames: npt.NDArray[np.uint8], output_size: Optional[int] = None) -> npt.NDArray[np.void]:
+        """
+        Measures the laser line in a single (H, W) frame or a (T, H, W) stack of frames.
+
+        All frames in a batch are reduced, smoothed and estimated together, the region of interest
+        tracking is not used. The Gaussian fit estimator uses fit_gaussian_batch. A tracking
+        estimator follows the frames of the whole stack, starting from scratch on every call.
+
+        Returns:
+        A MEASUREMENT_DTYPE array of shape (T,), or a single record for a 2D frame.
+        """
+        frames = np.asarray(frames)
+        stack = frames[None] if frames.ndim == 2 else frames
+        size = output_size or stack.shape[2]
+        results = np.zeros(stack.shape[0], dtype=MEASUREMENT_DTYPE)
+        estimator: Callable[[npt.NDArray[np.float64]], npt.NDArray[np.float64]]
+        if self.estimator in tracking_estimators:
+            estimator = tracking_estimators[self.estimator]().track  # keeps its state from chunk to chunk
+        else:
+            estimator = batch_estimators[self.estimator]
+
+        for start in range(0, stack.shape[0], self.batch_size):
+            stop = start + self.batch_size
+            chunk = stack[start:stop]
+            profiles = chunk.mean(axis=1)
+
+            plan = self.plans.get(profiles.shape[1], self.smoothing, size, profiles.shape[0])
+            pixel = estimator(plan.run_scaled(profiles))
+
+            out = results[start:stop]
+            out["pixel"] = pixel
+            out["micron"] = self.to_micron(pixel, size)
+            out["contrast"] = profiles.max(axis=1) - profiles.min(axis=1)
+
+        return results[0] if frames.ndim == 2 else results
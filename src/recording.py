@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+from typing import Iterator
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+RECORDING_MAGIC = b"BBFRAMES"
+RECORDING_VERSION = 1
+HEADER_SIZE = 4096  # bytes reserved for the header, keeps the data blocks page aligned
+
+# Header at the start of a recording file, updated in place while recording
+RECORDING_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("height", "<u4"),
+        ("width", "<u4"),
+        ("capacity", "<u8"),  # number of frames the ring holds
+        ("count", "<u8"),  # number of frames written, can be more than capacity once the ring wrapped
+    ]
+)
+
+
+def _layout(height: int, width: int, capacity: int) -> Tuple[int, int, int]:
+    """Returns the byte offsets of the timestamps and frames blocks and the total file size."""
+    timestamps_offset = HEADER_SIZE
+    frames_offset = timestamps_offset + -(-capacity * 8 // HEADER_SIZE) * HEADER_SIZE
+    return timestamps_offset, frames_offset, frames_offset + capacity * height * width
+
+
+class FrameRecorder:
+    """
+    Records grayscale frames and their timestamps into a preallocated memory-mapped ring file.
+
+    The file size is fixed when the recorder is created: once `max_bytes` worth of frames have
+    been written the oldest frames are overwritten, so a long run never fills the disk.
+
+    Args:
+    path: file to record to, overwritten if it exists.
+    height: height of the frames in pixels.
+    width: width of the frames in pixels.
+    max_bytes: upper bound for the file size.
+    """
+
+    def __init__(self, path: str, height: int, width: int, max_bytes: int = 2 * 1024**3) -> None:
+        self.path = path
+        self.height = height
+        self.width = width
+        self.capacity = max(1, (max_bytes - 2 * HEADER_SIZE) // (height * width + 8))
+
+        timestamps_offset, frames_offset, size = _layout(height, width, self.capacity)
+        with open(path, "wb") as file:
+            file.truncate(size)
+
+        self.header = np.memmap(path, dtype=RECORDING_HEADER_DTYPE, mode="r+", shape=(1,))
+        self.header["magic"] = RECORDING_MAGIC
+        self.header["version"] = RECORDING_VERSION
+        self.header["height"] = height
+        self.header["width"] = width
+        self.header["capacity"] = self.capacity
+        self.header["count"] = 0
+        self.timestamps = np.memmap(path, dtype="<i8", mode="r+", offset=timestamps_offset, shape=(self.capacity,))
+        self.frames = np.memmap(
+            path, dtype=np.uint8, mode="r+", offset=frames_offset, shape=(self.capacity, height, width)
+        )
+        self.count = 0
+
+    def write(self, gray: npt.NDArray[np.uint8], timestamp_us: int) -> bool:
+        """
+        Appends one frame, returns False if it does not match the recording's frame size.
+        """
+        if gray.shape != (self.height, self.width):
+            return False
+
+        index = self.count % self.capacity
+        self.frames[index] = gray
+        self.timestamps[index] = timestamp_us
+        self.count += 1
+        self.header["count"] = self.count  # Written last, so a reader never sees a half written frame
+        return True
+
+    def close(self) -> None:
+        for array in (self.frames, self.timestamps, self.header):
+            array.flush()
+
+
+class FrameRecording:
+    """
+    Read-only access to a file written by FrameRecorder.
+
+    Frames are memory-mapped views straight into the file, so recordings much larger than the
+    available memory can be replayed. Indexing is in capture order, also after the ring wrapped.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        header = np.fromfile(path, dtype=RECORDING_HEADER_DTYPE, count=1)
+        if not header.size or header["magic"][0] != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a frame recording")
+        if header["version"][0] > RECORDING_VERSION:
+            raise ValueError(f"{path} has unsupported recording version {header['version'][0]}")
+
+        self.height = int(header["height"][0])
+        self.width = int(header["width"][0])
+        self.capacity = int(header["capacity"][0])
+        self.count = int(header["count"][0])
+
+        timestamps_offset, frames_offset, size = _layout(self.height, self.width, self.capacity)
+        if os.path.getsize(path) < size:
+            raise ValueError(f"{path} is truncated")
+
+        self._timestamps = np.memmap(path, dtype="<i8", mode="r", offset=timestamps_offset, shape=(self.capacity,))
+        self._frames = np.memmap(
+            path, dtype=np.uint8, mode="r", offset=frames_offset, shape=(self.capacity, self.height, self.width)
+        )
+
+        # Once the ring wrapped the oldest frame sits right after the newest one
+        self.start = self.count % self.capacity if self.count > self.capacity else 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def frame(self, index: int) -> npt.NDArray[np.uint8]:
+        """Returns the frame at `index` in capture order as a view into the file."""
+        frame: npt.NDArray[np.uint8] = self._frames[(self.start + index) % self.capacity]
+        return frame
+
+    def timestamp(self, index: int) -> int:
+        return int(self._timestamps[(self.start + index) % self.capacity])
+
+    @property
+    def timestamps(self) -> npt.NDArray[np.int64]:
+        """All timestamps in capture order, in microseconds."""
+        return np.roll(self._timestamps[: len(self)], -self.start)
+
+    def segments(self) -> Iterator[npt.NDArray[np.uint8]]:
+        """Yields the frames in capture order as at most two contiguous (T, H, W) views."""
+        start = self.start
+        if start:
+            yield self._frames[start:]
+        yield self._frames[: start or len(self)]
+
+    def __iter__(self) -> Iterator[Tuple[int, npt.NDArray[np.uint8]]]:
+        for index in range(len(self)):
+            yield self.timestamp(index), self.frame(index)
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import sys
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+
+from src.DataClasses import SAMPLE_DTYPE
+from src.DataClasses import SampleBuffer
+from src.journal import JOURNAL_EXTENSION
+from src.journal import read_journal
+
+RUN_EXTENSION = ".bbr"
+RUN_MAGIC = b"BBRUNFMT"
+RUN_VERSION = 1
+COLUMN_ALIGNMENT = 64  # bytes, every column starts on a cache line
+
+# Fixed size header at the start of a run file, followed by the JSON metadata and the columns
+RUN_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("metadata_size", "<u4"),  # bytes of UTF-8 JSON following the header
+        ("count", "<u8"),  # number of samples in every column
+        ("reserved", "V40"),
+    ]
+)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
+
+
+def write_run(path: str, samples: npt.NDArray[np.void], metadata: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Writes a run to a columnar binary file.
+
+    Every field of the structured `samples` array is stored as its own contiguous column, so a
+    single column can be memory-mapped without touching the others. The layout of the columns
+    is described in the JSON metadata block, together with `metadata` (radius, feed, sensor
+    width, fps, ...), so readers don't depend on SAMPLE_DTYPE staying the same.
+
+    Args:
+    path: file to write, overwritten if it exists.
+    samples: structured array of samples, usually SAMPLE_DTYPE.
+    metadata: JSON serialisable description of the run.
+    """
+    names = samples.dtype.names or ()
+    columns: List[Dict[str, Any]] = []
+
+    # Lay out the columns after the header and metadata, which depend on each other's size
+    metadata_size = 0
+    while True:
+        offset = _align(RUN_HEADER_DTYPE.itemsize + metadata_size)
+        columns = []
+        for name in names:
+            dtype = samples.dtype[name]
+            columns.append({"name": name, "dtype": dtype.str, "offset": offset})
+            offset = _align(offset + dtype.itemsize * samples.shape[0])
+
+        block = json.dumps({"metadata": metadata or {}, "columns": columns}).encode("utf-8")
+        if len(block) <= metadata_size:
+            break
+        metadata_size = _align(len(block))
+
+    header = np.zeros(1, dtype=RUN_HEADER_DTYPE)
+    header["magic"] = RUN_MAGIC
+    header["version"] = RUN_VERSION
+    header["metadata_size"] = metadata_size
+    header["count"] = samples.shape[0]
+
+    # Write to a temporary file first so an existing run is never left half overwritten
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header.tobytes())
+        file.write(block.ljust(metadata_size, b" "))
+        for column in columns:
+            file.seek(column["offset"])
+            file.write(np.ascontiguousarray(samples[column["name"]]).tobytes())
+    os.replace(temporary_path, path)
+
+
+class Run:
+    """
+    A run file opened with its columns memory-mapped, so opening is instant whatever the size.
+
+    Columns are read-only views into the file, e.g. `run["micron"]`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        header = np.fromfile(path, dtype=RUN_HEADER_DTYPE, count=1)
+        if not header.size or header["magic"][0] != RUN_MAGIC:
+            raise ValueError(f"{path} is not a ballbar run file")
+        if header["version"][0] > RUN_VERSION:
+            raise ValueError(f"{path} has unsupported run file version {header['version'][0]}")
+
+        self.version = int(header["version"][0])
+        self.count = int(header["count"][0])
+        with open(path, "rb") as file:
+            file.seek(RUN_HEADER_DTYPE.itemsize)
+            block = json.loads(file.read(int(header["metadata_size"][0])).decode("utf-8"))
+
+        self.metadata: Dict[str, Any] = block["metadata"]
+        self.columns: Dict[str, npt.NDArray[Any]] = {}
+        for column in block["columns"]:
+            dtype = np.dtype(column["dtype"])
+            if self.count:
+                self.columns[column["name"]] = np.memmap(
+                    path, dtype=dtype, mode="r", offset=column["offset"], shape=(self.count,)
+                )
+            else:
+                self.columns[column["name"]] = np.empty(0, dtype=dtype)  # Can't map an empty column
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, name: str) -> npt.NDArray[Any]:
+        return self.columns[name]
+
+    def to_samples(self) -> npt.NDArray[np.void]:
+        """Copies the columns into a SAMPLE_DTYPE array, fields missing from the file are -1 or 0."""
+        samples = np.zeros(self.count, dtype=SAMPLE_DTYPE)
+        for name in ("frame_time_us", "host_time_ns"):
+            samples[name] = -1
+        for name, column in self.columns.items():
+            if name in (SAMPLE_DTYPE.names or ()):
+                samples[name] = column
+        return samples
+
+
+def load_run(path: str) -> Run:
+    return Run(path)
+
+
+def load_angles(path: str) -> Optional[npt.NDArray[np.float64]]:
+    """Returns the machine angle of every sample of a run file, None when the run was saved without positions."""
+    if not path.endswith(RUN_EXTENSION):
+        return None
+    run = load_run(path)
+    return run["theta"] if "theta" in run.columns else None
+
+
+def load_samples(path: str) -> SampleBuffer:
+    """Loads a run file, a journal left by an interrupted run or an older pickle into a SampleBuffer."""
+    if path.endswith(JOURNAL_EXTENSION):
+        return SampleBuffer.from_samples(read_journal(path))
+
+    if not path.endswith(".pkl"):
+        return SampleBuffer.from_samples(load_run(path).to_samples())
+
+    # Only for local files written by this tool, unpickling runs arbitrary code
+    with open(path, "rb") as file:
+        data = pickle.load(file)
+
+    # Older runs were saved as a list of micron values
+    if isinstance(data, np.ndarray) and data.dtype.names:
+        return SampleBuffer.from_samples(data.astype(SAMPLE_DTYPE, copy=False))
+    return SampleBuffer.from_values(data)
+
+
+def open_samples(path: str) -> Union[Run, npt.NDArray[np.void]]:
+    """
+    Opens the samples of a run file memory-mapped, or loads those of a journal or an older pickle.
+
+    Both are read by column, e.g. `samples["micron"]`, which is all isolate_trace needs, so a run
+    file is plotted and analysed straight from the mapped columns without a copy.
+    """
+    if path.endswith((JOURNAL_EXTENSION, ".pkl")):
+        return load_samples(path).samples
+    return load_run(path)
+
+
+def convert_pickle(pickle_path: str, run_path: str = "", metadata: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Converts a ballbar_NN.pkl file to the run file format.
+
+    Args:
+    pickle_path: the pickle to convert.
+    run_path: where to write the run, next to the pickle with the .bbr extension by default.
+    metadata: description of the run, it was never stored in the pickles.
+
+    Returns:
+    The path of the written run file.
+    """
+    run_path = run_path or os.path.splitext(pickle_path)[0] + RUN_EXTENSION
+    metadata = {"converted_from": os.path.basename(pickle_path), **(metadata or {})}
+    write_run(run_path, load_samples(pickle_path).samples, metadata)
+    return run_path
+
+
+def convert_journal(journal_path: str, run_path: str = "", metadata: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Writes the samples streamed to a journal to a run file, e.g. to recover a run that crashed.
+
+    Args:
+    journal_path: the journal to convert.
+    run_path: where to write the run, next to the journal with the .bbr extension by default.
+    metadata: description of the run.
+
+    Returns:
+    The path of the written run file.
+    """
+    run_path = run_path or os.path.splitext(journal_path)[0] + RUN_EXTENSION
+    write_run(run_path, read_journal(journal_path), metadata)
+    return run_path
+
+
+if __name__ == "__main__":
+    # python -m src.runfile ballbar_01.pkl ballbar_02.journal ...
+    for file_path in sys.argv[1:]:
+        if file_path.endswith(JOURNAL_EXTENSION):
+            print(f"{file_path} -> {convert_journal(file_path, metadata={'recovered_from': file_path})}")
+        else:
+            print(f"{file_path} -> {convert_pickle(file_path)}")
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from src.DataClasses import Sample
+
+
+def kept_count(size: int, outliers: float) -> int:
+    """Number of values left after dropping `outliers` percent of `size`, always at least one."""
+    return size - min(int(size * outliers / 100.0), size - 1)
+
+
+def trimmed_mean(
+    values: npt.ArrayLike, outliers: float = 0.0, by: Optional[int] = None
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Averages the last axis of `values` without the `outliers` percent furthest from the median.
+
+    The values to keep are found with a partition rather than a sort, O(N) per row.
+
+    Args:
+    values: values to average along the last axis.
+    outliers: percentage of the values dropped.
+    by: row of a 2D `values` whose outliers are dropped from every row, so all the means are
+        taken over the same measurements. Each row is trimmed on its own when None.
+
+    Returns:
+    The trimmed means, and the standard deviations of the values that were kept.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    keep = kept_count(values.shape[-1], outliers)
+
+    if by is not None:
+        key = values[by]
+        deviation = np.abs(key - np.median(key))
+        kept = values[:, np.argpartition(deviation, keep - 1)[:keep]]
+    else:
+        deviation = np.abs(values - np.median(values, axis=-1, keepdims=True))
+        kept = np.take_along_axis(values, np.argpartition(deviation, keep - 1, axis=-1)[..., :keep], axis=-1)
+    return kept.mean(axis=-1), kept.std(axis=-1)
+
+
+class SubsampleBuffer:
+    """
+    Collects consecutive measurements into a preallocated ring buffer and averages them into a Sample.
+
+    Adding a measurement is O(1) and allocates nothing, the trimmed mean is only taken once
+    `subsamples` measurements are in. Once full the oldest measurement is overwritten, so the
+    buffer always holds the latest `subsamples` measurements.
+
+    Args:
+    capacity: measurements preallocated for, grown when a sample needs more.
+    """
+
+    def __init__(self, capacity: int = 256) -> None:
+        self.buffer = np.empty((2, capacity))  # micron and pixel rows
+        self.subsamples = 0  # measurements per sample
+        self.outliers = 0.0  # percentage of the measurements dropped as outliers
+        self.head = 0  # where the next measurement goes
+        self.count = 0  # measurements collected, at most `subsamples`
+        self.active = False
+
+    def start(self, subsamples: int, outliers: float = 0.0) -> None:
+        """Starts collecting a new sample of `subsamples` measurements."""
+        self.subsamples = max(int(subsamples), 1)
+        self.outliers = min(max(float(outliers), 0.0), 100.0)
+        if self.subsamples > self.buffer.shape[1]:
+            self.buffer = np.empty((2, self.subsamples))
+        self.head = 0
+        self.count = 0
+        self.active = True
+
+    def stop(self) -> None:
+        self.active = False
+
+    @property
+    def complete(self) -> bool:
+        return self.count >= self.subsamples > 0
+
+    def push(self, micron: float, pixel: float) -> bool:
+        """Adds a measurement, returns True when the sample is complete."""
+        self.buffer[0, self.head] = micron
+        self.buffer[1, self.head] = pixel
+        self.head = (self.head + 1) % self.subsamples
+        self.count = min(self.count + 1, self.subsamples)
+        return self.count == self.subsamples
+
+    def result(self) -> Optional[Sample]:
+        """Averages the collected measurements, None before any came in."""
+        if not self.count:
+            return None
+
+        count = self.count
+        # Trimmed by the micron values, so the pixel mean is over the same measurements
+        (micron, pixel), spread = trimmed_mean(self.buffer[:, :count], self.outliers, by=0)
+        return Sample(float(micron), float(pixel), kept_count(count, self.outliers), float(spread[0]))
@@ -0,0 +1,503 @@
+from __future__ import annotations
+
+import bisect
+import math
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+from PySide6.QtCore import QObject
+from PySide6.QtCore import Qt
+from PySide6.QtCore import QTimer
+from PySide6.QtCore import Signal
+
+from src.linuxcnc_ballbar_check import BALLBAR_RADIUS
+
+RAPID_FEED = 6000.0  # mm/min of the simulated G0 moves
+NOISE_FRAMES = 4  # pre-rendered noise frames the synthetic camera cycles through
+FRAME_RING = 8  # frames the synthetic camera renders into in turn, more than can be in flight in Core
+TRUTH_FRAMES = 216000  # latest frames the synthetic camera keeps the readings of, half an hour at 120 fps
+
+GCODE_WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+Vector = Tuple[float, float, float]
+Direction = Tuple[float, float]
+
+
+@dataclass
+class MachineErrors:
+    """Geometric errors of the simulated machine, what a ballbar check should find again."""
+
+    scale_x_ppm: float = 15.0  # X travels this much too far
+    scale_y_ppm: float = -10.0
+    squareness_um_per_m: float = 20.0  # X leans this much along Y
+    backlash_x_um: float = 4.0  # lost motion when the axis reverses
+    backlash_y_um: float = 6.0
+    noise_um: float = 0.5  # standard deviation of each ballbar reading
+
+
+class Move:
+    """
+    One queued motion of the simulated machine, a dwell unless a subclass moves, in work coordinates.
+
+    Args:
+    start: simulated time the move starts at, in seconds.
+    origin: position the move starts from.
+    duration: how long the move takes, in seconds.
+    direction: X/Y directions the axes last moved in, which side their backlash is taken up on.
+    """
+
+    def __init__(self, start: float, origin: Vector, duration: float, direction: Direction) -> None:
+        self.start = start
+        self.origin = origin
+        self.duration = duration
+        self.length = duration  # shorter than the duration when the move was aborted
+        self.direction = direction
+
+    @property
+    def end(self) -> float:
+        return self.start + self.length
+
+    def path(self, elapsed: float) -> Tuple[Vector, Direction]:
+        """Returns the position and the X/Y velocity `elapsed` seconds into the move, within its duration."""
+        return self.origin, (0.0, 0.0)
+
+    def at(self, elapsed: float) -> Tuple[Vector, Direction]:
+        """Returns the position and the direction the axes last moved in, `elapsed` seconds into the move."""
+        position, velocity = self.path(min(max(elapsed, 0.0), self.length))
+        if elapsed >= self.length:
+            velocity = (0.0, 0.0)
+        direction = tuple(math.copysign(1.0, speed) if speed else held for speed, held in zip(velocity, self.direction))
+        return position, direction  # type: ignore
+
+
+class LinearMove(Move):
+    def __init__(self, start: float, origin: Vector, target: Vector, feed: float, direction: Direction) -> None:
+        super().__init__(start, origin, math.dist(origin, target) / (feed / 60.0), direction)
+        self.target = target
+
+    def path(self, elapsed: float) -> Tuple[Vector, Direction]:
+        if not self.duration:
+            return self.target, (0.0, 0.0)
+        fraction = elapsed / self.duration
+        position = tuple(a + (b - a) * fraction for a, b in zip(self.origin, self.target))
+        velocity = (
+            (self.target[0] - self.origin[0]) / self.duration,
+            (self.target[1] - self.origin[1]) / self.duration,
+        )
+        return position, velocity  # type: ignore
+
+
+class ArcMove(Move):
+    """An arc in the XY plane around `centre`, counterclockwise for a positive `sweep` in radians."""
+
+    def __init__(
+        self, start: float, origin: Vector, centre: Tuple[float, float], sweep: float, feed: float, direction: Direction
+    ) -> None:
+        self.centre = centre
+        self.radius = math.hypot(origin[0] - centre[0], origin[1] - centre[1])
+        self.angle = math.atan2(origin[1] - centre[1], origin[0] - centre[0])
+        self.sweep = sweep
+        super().__init__(start, origin, abs(sweep) * self.radius / (feed / 60.0), direction)
+
+    def path(self, elapsed: float) -> Tuple[Vector, Direction]:
+        angle = self.angle + self.sweep * (elapsed / self.duration if self.duration else 1.0)
+        cos, sin = math.cos(angle), math.sin(angle)
+        position = (self.centre[0] + self.radius * cos, self.centre[1] + self.radius * sin, self.origin[2])
+        return position, (-sin * self.sweep, cos * self.sweep)
+
+
+class SimulatedLinuxCNC:
+    """
+    Stands in for the linuxcnc module, with a machine that runs the MDI moves of the check in simulated time.
+
+    It has the parts of the stat, command and error_channel API the BallbarController, BallbarCheck
+    and PositionSampler use, and understands the G-code of prep_steps and run_steps: G0/G1 lines,
+    G02/G03 circles with I/J centres and P laps, G4 dwells, G17, G53, G54, G90 and G91. Every
+    command is queued as timed moves when it is issued, and the position at any moment is looked
+    up from the queue, so nothing has to tick in the background.
+
+    The ballbar pivot is the G54 origin. The machine moves with the geometric errors in `errors`,
+    and a reading is the ballbar length minus `radius`, in microns.
+
+    Args:
+    speed: simulated seconds per real second, 10 runs a check ten times faster than a machine would.
+    errors: geometric errors of the machine.
+    radius: length of the simulated ballbar in mm.
+    g5x_offset: X, Y and Z of the G54 origin in machine coordinates.
+    seed: seed of the reading noise.
+    """
+
+    # The constants of the linuxcnc module the project uses, with the same values
+    MODE_MANUAL = 1
+    MODE_AUTO = 2
+    MODE_MDI = 3
+    INTERP_IDLE = 1
+    INTERP_READING = 2
+    INTERP_PAUSED = 3
+    INTERP_WAITING = 4
+    STATE_ESTOP = 1
+    STATE_ESTOP_RESET = 2
+    STATE_OFF = 3
+    STATE_ON = 4
+    RCS_DONE = 1
+    NML_ERROR = 1
+    NML_TEXT = 2
+    NML_DISPLAY = 3
+    OPERATOR_ERROR = 11
+    OPERATOR_TEXT = 12
+    OPERATOR_DISPLAY = 13
+
+    def __init__(
+        self,
+        speed: float = 1.0,
+        errors: Optional[MachineErrors] = None,
+        radius: float = BALLBAR_RADIUS,
+        g5x_offset: Vector = (300.0, 250.0, -100.0),
+        seed: int = 0,
+    ) -> None:
+        self.lock = threading.Lock()  # the position sampler reads the queue from its own thread
+        self.speed = speed
+        self.errors = errors or MachineErrors()
+        self.radius = radius
+        self.g5x_offset = tuple(g5x_offset) + (0.0,) * 6
+        self.rng = np.random.default_rng(seed)
+        self.started = time.monotonic()
+
+        # Start at the machine origin, at rest
+        origin = (-g5x_offset[0], -g5x_offset[1], -g5x_offset[2])
+        self.moves: List[Move] = [Move(0.0, origin, 0.0, (1.0, 1.0))]
+        self.move_starts = [0.0]
+
+        self.mode = self.MODE_MANUAL
+        self.estop = False
+        self.enabled = True
+        self.serial = 0  # serial number of the last MDI command
+        self.messages: List[Tuple[int, str]] = []  # errors waiting on the error channel
+
+        # Modal state of the interpreter
+        self.motion = 0.0  # G0, G1, G2 or G3
+        self.feed = 0.0  # in mm/min
+        self.relative = False
+
+    # The linuxcnc module API
+    def stat(self) -> SimulatedStat:
+        return SimulatedStat(self)
+
+    def command(self) -> SimulatedCommand:
+        return SimulatedCommand(self)
+
+    def error_channel(self) -> SimulatedErrorChannel:
+        return SimulatedErrorChannel(self)
+
+    def now(self) -> float:
+        """Returns the simulated time in seconds."""
+        return (time.monotonic() - self.started) * self.speed
+
+    def state(self, at: float) -> Tuple[Vector, Direction]:
+        """Returns the commanded work position and the directions the axes last moved in at simulated time `at`."""
+        with self.lock:
+            move = self.moves[max(0, bisect.bisect_right(self.move_starts, at) - 1)]
+        return move.at(at - move.start)
+
+    def busy(self, at: float) -> bool:
+        with self.lock:
+            return at < self.moves[-1].end
+
+    def actual_position(self, at: Optional[float] = None) -> Vector:
+        """Returns where the machine really is at simulated time `at`, now by default, in work coordinates."""
+        (x, y, z), (direction_x, direction_y) = self.state(self.now() if at is None else at)
+        errors = self.errors
+
+        # The axes lag half their backlash behind the command, on the side they last moved towards
+        x -= direction_x * errors.backlash_x_um / 2000.0
+        y -= direction_y * errors.backlash_y_um / 2000.0
+        return (
+            x * (1.0 + errors.scale_x_ppm * 1e-6) + y * errors.squareness_um_per_m * 1e-6,
+            y * (1.0 + errors.scale_y_ppm * 1e-6),
+            z,
+        )
+
+    def radial_error_um(self, at: Optional[float] = None) -> float:
+        """Returns the ballbar reading at simulated time `at`, now by default, in microns."""
+        x, y, _ = self.actual_position(at)
+        return (math.hypot(x, y) - self.radius) * 1000.0 + self.rng.normal(0.0, self.errors.noise_um)
+
+    def mdi(self, line: str) -> int:
+        """Queues the moves of one MDI command, returns its serial number. Errors go to the error channel."""
+        self.serial += 1
+        if self.estop or not self.enabled:
+            self.messages.append((self.NML_ERROR, "Can't issue MDI command when the machine is off"))
+        elif self.mode != self.MODE_MDI:
+            self.messages.append((self.NML_ERROR, "Must be in MDI mode to issue MDI command"))
+        else:
+            try:
+                self.execute(line)
+            except ValueError as error:
+                self.messages.append((self.OPERATOR_ERROR, f"{line}: {error}"))
+        return self.serial
+
+    def execute(self, line: str) -> None:
+        text = line.upper().split(";")[0]
+        words = GCODE_WORD.findall(text)
+        if GCODE_WORD.sub("", text).strip():
+            raise ValueError("unknown words")
+
+        codes = [float(value) for letter, value in words if letter == "G"]
+        values = {letter: float(value) for letter, value in words if letter != "G"}
+        machine_coordinates = False
+        dwell = False
+        for code in codes:
+            if code in (0, 1, 2, 3):
+                self.motion = code
+            elif code == 4:
+                dwell = True
+            elif code == 53:
+                machine_coordinates = True
+            elif code in (90, 91):
+                self.relative = code == 91
+            elif code not in (17, 54):  # Only the XY plane and the G54 offset are simulated
+                raise ValueError(f"G{code:g} is not simulated")
+        if "F" in values:
+            self.feed = values["F"]
+
+        at = max(self.now(), self.moves[-1].end)
+        origin, direction = self.state(at)
+        if dwell:
+            self.queue(Move(at, origin, values.get("P", 0.0), direction))
+            return
+        if not any(axis in values for axis in "XYZIJ"):
+            return
+        if self.motion and not self.feed:
+            raise ValueError(f"cannot do G{self.motion:g} with zero feed rate")
+
+        target = []
+        for index, axis in enumerate("XYZ"):
+            value = values.get(axis)
+            if value is None:
+                target.append(origin[index])
+            elif machine_coordinates:
+                target.append(value - self.g5x_offset[index])
+            else:
+                target.append(origin[index] + value if self.relative else value)
+
+        if self.motion in (0, 1):
+            feed = RAPID_FEED if self.motion == 0 else self.feed
+            self.queue(LinearMove(at, origin, tuple(target), feed, direction))  # type: ignore
+            return
+
+        # G02/G03, the centre is relative to the start, a full circle when the end is the start
+        centre = (origin[0] + values.get("I", 0.0), origin[1] + values.get("J", 0.0))
+        start_angle = math.atan2(origin[1] - centre[1], origin[0] - centre[0])
+        end_angle = math.atan2(target[1] - centre[1], target[0] - centre[0])
+        counterclockwise = self.motion == 3
+        sweep = ((end_angle - start_angle) if counterclockwise else (start_angle - end_angle)) % (2 * math.pi)
+        if sweep < 1e-9:
+            sweep = 2 * math.pi
+        sweep += 2 * math.pi * (max(1, int(values.get("P", 1))) - 1)
+        self.queue(ArcMove(at, origin, centre, sweep if counterclockwise else -sweep, self.feed, direction))
+
+    def queue(self, move: Move) -> None:
+        with self.lock:
+            self.moves.append(move)
+            self.move_starts.append(move.start)
+
+    def abort(self) -> None:
+        """Stops the machine where it is, dropping the queued moves."""
+        at = self.now()
+        with self.lock:
+            index = max(0, bisect.bisect_right(self.move_starts, at) - 1)
+            move = self.moves[index]
+            kept = index + 1
+            del self.moves[kept:]
+            del self.move_starts[kept:]
+            move.length = min(move.length, max(0.0, at - move.start))
+
+
+class SimulatedStat:
+    """linuxcnc.stat() of a SimulatedLinuxCNC, the fields are updated by `poll`."""
+
+    def __init__(self, machine: SimulatedLinuxCNC) -> None:
+        self.machine = machine
+        self.joints = 3
+        self.homed = (1, 1, 1) + (0,) * 13
+        self.g92_offset = (0.0,) * 9
+        self.poll()
+
+    def poll(self) -> None:
+        machine = self.machine
+        at = machine.now()
+        position = machine.actual_position(at)
+        self.estop = int(machine.estop)
+        self.enabled = machine.enabled
+        self.task_mode = machine.mode
+        self.echo_serial_number = machine.serial  # Commands are received the moment they are issued
+        self.interp_state = machine.INTERP_READING if machine.busy(at) else machine.INTERP_IDLE
+        self.g5x_offset = machine.g5x_offset
+        self.actual_position = tuple(value + offset for value, offset in zip(position, machine.g5x_offset)) + (0.0,) * 6
+
+
+class SimulatedCommand:
+    """linuxcnc.command() of a SimulatedLinuxCNC."""
+
+    def __init__(self, machine: SimulatedLinuxCNC) -> None:
+        self.machine = machine
+        self.serial = 0
+
+    def mode(self, mode: int) -> None:
+        self.machine.mode = mode
+
+    def state(self, state: int) -> None:
+        """Switches the machine like the estop and power buttons, STATE_ESTOP also stops the motion."""
+        machine = self.machine
+        if state == machine.STATE_ESTOP:
+            machine.abort()
+        machine.estop = state == machine.STATE_ESTOP
+        machine.enabled = state == machine.STATE_ON
+
+    def mdi(self, line: str) -> None:
+        self.serial = self.machine.mdi(line)
+
+    def wait_complete(self, timeout: float = 5.0) -> int:
+        return self.machine.RCS_DONE
+
+    def abort(self) -> None:
+        self.machine.abort()
+
+
+class SimulatedErrorChannel:
+    """linuxcnc.error_channel() of a SimulatedLinuxCNC."""
+
+    def __init__(self, machine: SimulatedLinuxCNC) -> None:
+        self.machine = machine
+
+    def poll(self) -> Optional[Tuple[int, str]]:
+        return self.machine.messages.pop(0) if self.machine.messages else None
+
+
+class SyntheticCamera(QObject):  # type: ignore
+    """
+    Renders frames of the laser line at a fixed rate, placed by the reading of a simulated machine.
+
+    It stands in for the webcam: Core.start_synthetic_camera passes its frames down the same path
+    as the camera's, so the whole pipeline runs headless at any resolution and frame rate. A
+    frame costs one exp over its width and one broadcast add, the line profile onto one of a few
+    pre-rendered noise frames, so the camera keeps up with well over 120 fps.
+
+    Args:
+    machine: gives the ballbar reading at the time of each frame.
+    width: frame width in pixels, the line moves along it.
+    height: frame height in pixels.
+    fps: frames per second.
+    sensor_width_mm: width of the sensor the frame covers, the analyser must use the same.
+    sigma: standard deviation of the line profile in pixels.
+    peak: line brightness above the background, it saturates at 255.
+    background: background level in grey levels.
+    noise: standard deviation of the sensor noise in grey levels.
+    seed: seed of the noise.
+    truth_frames: latest frames `readings` knows, the older ones are dropped so long runs stay bounded.
+    """
+
+    OnFrameChanged = Signal(object, int)  # frame and its start time in simulated microseconds
+
+    def __init__(
+        self,
+        machine: SimulatedLinuxCNC,
+        width: int = 1280,
+        height: int = 720,
+        fps: float = 120.0,
+        sensor_width_mm: float = 4.0,
+        sigma: float = 6.0,
+        peak: float = 200.0,
+        background: float = 20.0,
+        noise: float = 2.0,
+        seed: int = 0,
+        truth_frames: int = TRUTH_FRAMES,
+    ) -> None:
+        super().__init__()
+        self.machine = machine
+        self.fps = fps
+        self.sensor_width_mm = sensor_width_mm
+        self.sigma = sigma
+        self.um_per_pixel = sensor_width_mm * 1000.0 / width
+
+        rng = np.random.default_rng(seed)
+        noise_frames = rng.normal(background, noise, (NOISE_FRAMES, height, width))
+        self.noise_frames = np.clip(noise_frames, 0, 255).astype(np.uint8)
+        self.peak = min(peak, 255.0 - float(self.noise_frames.max()))  # The sum can't overflow a uint8
+        self.frames = np.empty((FRAME_RING, height, width), dtype=np.uint8)
+        self.columns = np.arange(width, dtype=np.float32)
+        self.line = np.empty(width, dtype=np.float32)
+        self.line_u8 = np.empty(width, dtype=np.uint8)
+
+        self.count = 0  # frames rendered
+        self.skipped = 0  # frame times missed because the event loop was late
+        self.truth: Deque[Tuple[int, float]] = deque(maxlen=truth_frames)  # frame time in µs and its reading
+        self.next_due = 0.0
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+
+    def start(self) -> None:
+        self.count = 0
+        self.skipped = 0
+        self.truth.clear()
+        self.next_due = time.monotonic()
+        self.tick()
+
+    def stop(self) -> None:
+        self.timer.stop()
+
+    def render(self, error_um: float) -> npt.NDArray[np.uint8]:
+        """Renders the next frame with the line `error_um` from the middle, off the frame when it is out of range."""
+        position = self.columns.shape[0] / 2 + error_um / self.um_per_pixel
+        np.subtract(self.columns, position, out=self.line)
+        self.line *= 1.0 / self.sigma
+        np.square(self.line, out=self.line)
+        self.line *= -0.5
+        np.exp(self.line, out=self.line)
+        self.line *= self.peak
+        self.line_u8[...] = self.line
+
+        frame: npt.NDArray[np.uint8] = self.frames[self.count % FRAME_RING]
+        np.add(self.noise_frames[self.count % NOISE_FRAMES], self.line_u8[None, :], out=frame)
+        self.count += 1
+        return frame
+
+    def tick(self) -> None:
+        at = self.machine.now()
+        error_um = self.machine.radial_error_um(at)
+        frame_time_us = int(at * 1e6)
+        self.truth.append((frame_time_us, error_um))
+        self.OnFrameChanged.emit(self.render(error_um), frame_time_us)
+
+        # Scheduled from the due times, so the rate holds on average even though the timer has ms resolution
+        period = 1.0 / self.fps
+        now = time.monotonic()
+        self.next_due += period
+        if self.next_due < now:
+            missed = int((now - self.next_due) / period) + 1
+            self.skipped += missed
+            self.next_due += missed * period
+        self.timer.start(max(0, math.ceil((self.next_due - now) * 1000)))
+
+    def readings(self, frame_times_us: npt.ArrayLike) -> npt.NDArray[np.float64]:
+        """Returns the reading each of the frames at `frame_times_us` was rendered at, NaN for the others."""
+        truth = np.array(self.truth, dtype=np.float64).reshape(-1, 2)
+        times = np.asarray(frame_times_us, dtype=np.float64)
+        readings = np.full(times.shape, np.nan)
+        if truth.shape[0]:
+            index = np.minimum(np.searchsorted(truth[:, 0], times), truth.shape[0] - 1)
+            found = truth[index, 0] == times
+            readings[found] = truth[index[found], 1]
+        return readings
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import numpy as np
+import numpy.typing as npt
+
 units_of_measurements = {
     "μm": 1000,
     "mm": 1,
@@ -64,3 +67,31 @@ def sample_to_micron(val: float, sensor_pixel_height: int, sensor_mm_length: flo
     sample_in_mm = val * pixel_to_mm  # Convert sample position to mm
     sample_in_microns = sample_in_mm * -1000  # Convert mm to microns
     return sample_in_microns
+
+
+def angles_from_timestamps(timestamps: npt.ArrayLike, reverse: bool = False) -> npt.NDArray[np.float64]:
+    """
+    Maps the timestamps of one rotation to angles in radians, assuming a constant feed.
+
+    The rotation spans the first to the last timestamp plus one sample interval, so evenly spaced
+    samples get the same angles as np.linspace(0, 2 * np.pi, n, endpoint=False). Dropped frames
+    leave a gap instead of squeezing the rest of the rotation together.
+
+    Args:
+    - timestamps (array): The sample times of one rotation, in any unit.
+    - reverse (bool): Measure the angles back from the last sample, for rotations run clockwise.
+
+    Returns:
+    - array: The angle of each sample in radians.
+    """
+    times = np.asarray(timestamps, dtype=np.float64)
+    if times.size < 2:
+        return np.zeros(times.size)
+
+    period = times[-1] - times[0] + np.median(np.diff(times))
+    if period <= 0:
+        return np.linspace(0, 2 * np.pi, times.size, endpoint=False)
+
+    elapsed = times[-1] - times if reverse else times - times[0]
+    angles: npt.NDArray[np.float64] = 2 * np.pi * elapsed / period
+    return angles
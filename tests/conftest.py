@@ -0,0 +1,6 @@
+from __future__ import annotations
+
+import os
+
+# The tests need no display, this lets them run headless
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
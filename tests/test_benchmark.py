@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import copy
+import json
+from pathlib import Path
+
+from src.benchmark import find_regressions
+from src.benchmark import main
+
+ARGS = ["--resolutions", "640x480", "--estimators", "Centroid", "--frames", "4"]
+
+
+def test_missing_baseline_fails(tmp_path: Path) -> None:
+    assert main(ARGS + ["--baseline", str(tmp_path / "missing.json")]) == 1
+
+
+def test_regressions_against_saved_baseline(tmp_path: Path) -> None:
+    path = tmp_path / "baseline.json"
+    assert main(ARGS + ["--baseline", str(path), "--save-baseline"]) == 0
+    baseline = json.loads(path.read_text())
+    assert find_regressions(baseline, baseline) == []
+
+    slower = copy.deepcopy(baseline)
+    result = slower["640x480/Centroid"]
+    result["fps"] /= 2
+    result["errors"]["noisy"]["rms_px"] += 1.0
+    regressions = find_regressions(slower, baseline)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("640x480/Centroid fps")
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import List
+
+import pytest
+
+from src.controller import BallbarController
+from src.controller import CANCELLED
+from src.controller import DONE
+from src.controller import ERROR
+from src.controller import INSTALL
+from src.controller import PREP
+from src.controller import RUN
+from src.linuxcnc_ballbar_check import prep_steps
+from src.linuxcnc_ballbar_check import run_steps
+from src.simulation import SimulatedCommand
+from src.simulation import SimulatedLinuxCNC
+from src.simulation import SimulatedStat
+
+SPEED = 200.0  # a check takes about a second
+
+
+class DeafStat(SimulatedStat):
+    """A stat of a machine that never receives the MDI commands."""
+
+    def poll(self) -> None:
+        super().poll()
+        self.echo_serial_number = 0
+
+
+class DeafLinuxCNC(SimulatedLinuxCNC):
+    def stat(self) -> DeafStat:
+        return DeafStat(self)
+
+
+@pytest.fixture
+def machine() -> SimulatedLinuxCNC:
+    return SimulatedLinuxCNC(speed=SPEED)
+
+
+@pytest.fixture
+def controller(qtbot: Any, machine: SimulatedLinuxCNC) -> BallbarController:
+    return BallbarController(machine, poll_interval_ms=5)
+
+
+@pytest.fixture
+def states(controller: BallbarController) -> List[str]:
+    """The states the controller went through."""
+    states: List[str] = []
+    controller.OnStateChanged.connect(states.append)
+    return states
+
+
+def wait_for_state(qtbot: Any, controller: BallbarController, state: str, timeout_ms: int = 10000) -> None:
+    qtbot.waitUntil(lambda: controller.state == state, timeout=timeout_ms)
+
+
+def test_check_goes_through_every_state(qtbot: Any, controller: BallbarController, states: List[str]) -> None:
+    commands: List[str] = []
+    controller.OnCommand.connect(commands.append)
+
+    controller.start_prep()
+    assert controller.state == PREP
+    wait_for_state(qtbot, controller, INSTALL)
+    controller.start_run()
+    assert controller.state == RUN
+    wait_for_state(qtbot, controller, DONE)
+
+    assert states == [PREP, INSTALL, RUN, DONE]
+    assert commands == prep_steps(controller.radius) + run_steps(controller.radius, controller.operation_feed)
+    assert not controller.timer.isActive()
+
+
+def test_mode_switch_completes_before_the_first_command(
+    controller: BallbarController, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls: List[str] = []
+    wait_complete = SimulatedCommand.wait_complete
+    mdi = SimulatedCommand.mdi
+
+    def recorded_wait_complete(command: SimulatedCommand, timeout: float = 5.0) -> int:
+        calls.append("wait_complete")
+        return wait_complete(command, timeout)
+
+    def recorded_mdi(command: SimulatedCommand, line: str) -> None:
+        calls.append(line)
+        mdi(command, line)
+
+    monkeypatch.setattr(SimulatedCommand, "wait_complete", recorded_wait_complete)
+    monkeypatch.setattr(SimulatedCommand, "mdi", recorded_mdi)
+    controller.start_prep()
+    controller.cancel()
+    assert calls[:2] == ["wait_complete", "G17"]
+
+
+def test_start_run_needs_install(controller: BallbarController, states: List[str]) -> None:
+    controller.start_run()
+    assert states == []
+
+
+def test_not_ready_machine_fails(controller: BallbarController, machine: SimulatedLinuxCNC) -> None:
+    machine.enabled = False
+    controller.start_prep()
+    assert controller.state == ERROR
+
+
+def test_nml_error_mid_run_fails(qtbot: Any, controller: BallbarController, machine: SimulatedLinuxCNC) -> None:
+    controller.start_prep()
+    wait_for_state(qtbot, controller, INSTALL)
+    controller.start_run()
+
+    with qtbot.waitSignal(controller.OnError, timeout=2000) as blocker:
+        machine.messages.append((machine.NML_ERROR, "joint 0 following error"))
+    assert blocker.args == ["joint 0 following error"]
+    assert controller.state == ERROR
+    assert not machine.busy(machine.now())  # The motion was aborted
+
+
+def test_estop_mid_run_fails(
+    qtbot: Any, controller: BallbarController, machine: SimulatedLinuxCNC, states: List[str]
+) -> None:
+    controller.start_prep()
+    wait_for_state(qtbot, controller, INSTALL)
+    controller.start_run()
+
+    machine.command().state(machine.STATE_ESTOP)
+    wait_for_state(qtbot, controller, ERROR, timeout_ms=2000)
+    assert states == [PREP, INSTALL, RUN, ERROR]
+    assert not machine.busy(machine.now())
+
+
+def test_cancel_aborts(
+    qtbot: Any, controller: BallbarController, machine: SimulatedLinuxCNC, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    controller.start_prep()
+    wait_for_state(qtbot, controller, INSTALL)
+    controller.start_run()
+
+    aborts: List[bool] = []
+    abort = controller.command.abort
+
+    def counted_abort() -> None:
+        aborts.append(True)
+        abort()
+
+    monkeypatch.setattr(controller.command, "abort", counted_abort)
+    controller.cancel()
+    assert aborts == [True]
+    assert controller.state == CANCELLED
+    assert not controller.timer.isActive()
+    assert not machine.busy(machine.now())
+
+    controller.cancel()  # Nothing is left to cancel
+    assert aborts == [True]
+
+
+def test_ack_timeout_fails(qtbot: Any) -> None:
+    controller = BallbarController(DeafLinuxCNC(speed=SPEED), poll_interval_ms=5, ack_timeout_s=0.1)
+    with qtbot.waitSignal(controller.OnError, timeout=2000) as blocker:
+        controller.start_prep()
+    assert blocker.args == ["LinuxCNC did not receive G17"]
+    assert controller.state == ERROR
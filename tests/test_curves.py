@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.curves import batch_estimators
+from src.curves import estimators
+from src.curves import FIT_CONVERGED
+from src.curves import FIT_FAILED
+from src.curves import fit_gaussian
+from src.curves import fit_gaussian_batch
+from src.curves import FIT_MAX_ITERATIONS
+from src.curves import PeakTracker
+
+CENTRES = np.array([100.3, 100.55, 131.77, 64.01])
+
+
+def gaussian_curves(centres: np.ndarray, width: int = 256, sigma: float = 6.0, background: float = 20.0) -> np.ndarray:
+    x = np.arange(width, dtype=np.float64)
+    curves: np.ndarray = background + 200.0 * np.exp(-((x - centres[:, None]) ** 2) / (2 * sigma**2))
+    return curves
+
+
+@pytest.mark.parametrize("name", list(estimators))
+def test_estimator_finds_sub_pixel_centre(name: str) -> None:
+    for centre, curve in zip(CENTRES, gaussian_curves(CENTRES)):
+        assert estimators[name](curve) == pytest.approx(centre, abs=0.01)
+
+
+@pytest.mark.parametrize("name", list(batch_estimators))
+def test_batch_estimator_matches_centres(name: str) -> None:
+    # The Gaussian fit starts from the middle of the curve, like fit_gaussian, so it needs the line near there
+    centres = CENTRES[:3] if name == "Gaussian fit" else CENTRES
+    positions = batch_estimators[name](gaussian_curves(centres))
+    assert positions.shape == centres.shape
+    np.testing.assert_allclose(positions, centres, atol=0.01)
+
+
+def test_fit_gaussian_batch_matches_fit_gaussian() -> None:
+    curves = gaussian_curves(np.linspace(80.0, 175.0, 39) + 0.37)
+    means, _, _, status = fit_gaussian_batch(curves)
+    assert (status == FIT_CONVERGED).all()
+    np.testing.assert_allclose(means, [fit_gaussian(curve) for curve in curves], atol=1e-6)
+
+
+def test_peak_tracker_follows_moving_line() -> None:
+    centres = 120.0 + 30.0 * np.sin(np.arange(60) / 6.0)
+    tracked = PeakTracker().track(gaussian_curves(centres))
+    np.testing.assert_allclose(tracked, centres, atol=0.01)
+
+
+@pytest.mark.filterwarnings("ignore:Degrees of freedom")  # The all NaN row
+def test_fit_gaussian_batch_status() -> None:
+    curves = gaussian_curves(CENTRES[:2], background=0.0)
+    flat = np.zeros((1, curves.shape[1]))
+    missing = np.full((1, curves.shape[1]), np.nan)
+    means, stddevs, amplitudes, status = fit_gaussian_batch(np.vstack([curves, flat, missing]))
+
+    np.testing.assert_array_equal(status, [FIT_CONVERGED, FIT_CONVERGED, FIT_FAILED, FIT_FAILED])
+    np.testing.assert_allclose(means[:2], CENTRES[:2], atol=1e-6)
+    np.testing.assert_allclose(stddevs[:2], 6.0, rtol=1e-6)
+    np.testing.assert_allclose(amplitudes[:2], 200.0, rtol=1e-6)
+    assert not means[2:].any() and not stddevs[2:].any() and not amplitudes[2:].any()
+
+
+def test_fit_gaussian_batch_out_of_iterations() -> None:
+    means, _, _, status = fit_gaussian_batch(gaussian_curves(CENTRES[:1]) + np.linspace(0, 50, 256), max_iterations=1)
+    assert status[0] == FIT_MAX_ITERATIONS
+    assert means[0] == 0.0
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import numpy as np
+
+from src.data_filtering import find_rotations
+from src.data_filtering import find_segments
+from src.data_filtering import isolate_trace
+from src.DataClasses import SAMPLE_DTYPE
+
+OFF = 1000.0  # a value off the sensor
+
+
+def two_rotations(length: int, gap: int = 5) -> np.ndarray:
+    """Off-sensor values, a rotation of `length` samples, a gap, the second rotation and off again."""
+    return np.concatenate([np.full(gap, OFF), np.zeros(length), np.full(gap, OFF), np.zeros(length), np.full(gap, OFF)])
+
+
+def test_find_segments() -> None:
+    data = np.array([OFF, 0, 0, 0, OFF, 0, OFF, 0, 0, np.nan])
+    np.testing.assert_array_equal(find_segments(data, 500), [[1, 4], [7, 9]])  # The single sample is noise
+
+
+def test_find_rotations_splits_laps() -> None:
+    rotations = find_rotations(two_rotations(30), 500, laps=3)
+    np.testing.assert_array_equal(rotations["counterclockwise"], [[5, 15], [15, 25], [25, 35]])
+    np.testing.assert_array_equal(rotations["clockwise"], [[40, 50], [50, 60], [60, 70]])
+
+
+def test_find_rotations_splits_laps_by_time() -> None:
+    data = two_rotations(30)
+    times = np.arange(data.size, dtype=np.float64) * 100
+    times[5:35] = 1000 + np.concatenate([np.arange(10.0), 10 + np.arange(20) * 0.5])  # The second lap at twice the rate
+    rotations = find_rotations(data, 500, times, laps=2)
+    np.testing.assert_array_equal(rotations["counterclockwise"], [[5, 15], [15, 35]])
+
+
+def test_find_rotations_labels_by_machine_angle() -> None:
+    data = two_rotations(30)
+    theta = np.full(data.size, np.nan)
+    theta[5:35] = np.linspace(4 * np.pi, 0, 30)  # The first rotation runs clockwise
+    theta[40:70] = np.linspace(0, 4 * np.pi, 30)
+    rotations = find_rotations(data, 500, laps=2, theta=theta)
+    np.testing.assert_array_equal(rotations["clockwise"], [[5, 20], [20, 35]])
+    np.testing.assert_array_equal(rotations["counterclockwise"], [[40, 55], [55, 70]])
+
+
+def test_isolate_trace_all_laps_and_kept_samples() -> None:
+    data = two_rotations(30)
+    samples = np.zeros(data.size, dtype=SAMPLE_DTYPE)
+    samples["frame_time_us"] = np.arange(data.size) * 8333
+    samples["micron"] = data
+    samples["micron"][5:35] = np.arange(30)
+    samples["micron"][40:70] = -np.arange(30)
+
+    clockwise, counterclockwise, clockwise_theta, counterclockwise_theta = isolate_trace(samples, 500, 3, lap=None)
+    np.testing.assert_array_equal(counterclockwise, np.arange(30))
+    laps = [-np.arange(lap * 10, lap * 10 + 10)[::-1] for lap in range(3)]  # Each lap reversed on its own
+    np.testing.assert_array_equal(clockwise, np.concatenate(laps))
+    assert clockwise_theta is not None and clockwise_theta.shape == clockwise.shape
+    assert counterclockwise_theta is not None and counterclockwise_theta.shape == counterclockwise.shape
+
+    keep = np.ones(data.size, dtype=bool)
+    keep[5:8] = False  # The move onto the circle
+    _, counterclockwise, _, counterclockwise_theta = isolate_trace(samples, 500, 3, lap=None, keep=keep)
+    np.testing.assert_array_equal(counterclockwise, np.arange(3, 30))
+    assert counterclockwise_theta is not None and counterclockwise_theta.shape == (27,)
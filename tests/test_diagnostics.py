@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+
+import numpy as np
+import pytest
+
+from src.diagnostics import analyse_trace
+from src.diagnostics import diagnostics_to_dict
+
+RADIUS_MM = 100.0
+
+
+def measured_deviation(
+    theta: np.ndarray, scale_x_ppm: float = 0.0, scale_y_ppm: float = 0.0, squareness_um_per_m: float = 0.0
+) -> np.ndarray:
+    """Ballbar reading in microns of a machine with these errors, moving around a circle of RADIUS_MM."""
+    x, y = RADIUS_MM * np.cos(theta), RADIUS_MM * np.sin(theta)
+    actual_x = x * (1 + scale_x_ppm * 1e-6) + y * squareness_um_per_m * 1e-6
+    actual_y = y * (1 + scale_y_ppm * 1e-6)
+    deviation: np.ndarray = (np.hypot(actual_x, actual_y) - RADIUS_MM) * 1000.0
+    return deviation
+
+
+def analyse(**errors: float) -> Dict[str, Any]:
+    counterclockwise_theta = np.linspace(0, 2 * np.pi, 3600, endpoint=False)
+    clockwise_theta = counterclockwise_theta[::-1]
+    result = analyse_trace(
+        measured_deviation(clockwise_theta, **errors),
+        measured_deviation(counterclockwise_theta, **errors),
+        clockwise_theta,
+        counterclockwise_theta,
+        radius_mm=RADIUS_MM,
+    )
+    return diagnostics_to_dict(result)
+
+
+def test_recovers_scale_mismatch() -> None:
+    diagnostics = analyse(scale_x_ppm=15.0, scale_y_ppm=-10.0)
+    assert diagnostics["scale_mismatch_um"] == pytest.approx(25.0 * RADIUS_MM * 1e-3, rel=1e-3)
+    assert diagnostics["squareness_um_per_m"] == pytest.approx(0.0, abs=1e-3)
+    assert diagnostics["radius_error_um"] == pytest.approx((15.0 - 10.0) / 2 * RADIUS_MM * 1e-3, rel=1e-3)
+
+
+def test_recovers_squareness() -> None:
+    diagnostics = analyse(squareness_um_per_m=20.0)
+    assert diagnostics["squareness_um_per_m"] == pytest.approx(20.0, rel=1e-3)
+    assert diagnostics["scale_mismatch_um"] == pytest.approx(0.0, abs=1e-3)
+
+
+def test_perfect_machine() -> None:
+    diagnostics = analyse()
+    assert diagnostics["samples"] == 7200
+    for name in ("radius_error_um", "scale_mismatch_um", "squareness_um_per_m", "circularity_um"):
+        assert diagnostics[name] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_missing_direction_is_nan() -> None:
+    theta = np.linspace(0, 2 * np.pi, 360, endpoint=False)
+    diagnostics = analyse_trace([], measured_deviation(theta), None, theta, radius_mm=RADIUS_MM)
+    assert np.isnan(diagnostics["circularity_cw_um"])
+    assert np.isfinite(diagnostics["circularity_ccw_um"])
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+
+from src.instrumentation import LatencyHistogram
+from src.instrumentation import PIPELINE_STAGES
+from src.instrumentation import PipelineStats
+
+
+def test_histogram_buckets_by_decade() -> None:
+    histogram = LatencyHistogram(bins_per_decade=1)
+    np.testing.assert_allclose(histogram.edges, 10.0 ** np.arange(-6, 2))
+    for seconds in (1e-7, 5e-6, 5e-6, 2e-3, 20.0):
+        histogram.add(seconds)
+
+    # Below the first edge, in [1 µs, 10 µs) twice, in [1 ms, 10 ms) and past the last edge
+    np.testing.assert_array_equal(histogram.counts, [1, 2, 0, 0, 1, 0, 0, 0, 1])
+    assert histogram.count == 5
+    assert histogram.max == 20.0
+    assert histogram.mean == pytest.approx((1e-7 + 1e-5 + 2e-3 + 20.0) / 5)
+
+
+def test_histogram_percentiles_are_bin_upper_edges() -> None:
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    for _ in range(98):
+        histogram.add(1.5e-3)
+    histogram.add(0.15)
+    histogram.add(1000.0)  # Past the last edge, reported as the last edge
+
+    p50, p99, p100 = histogram.percentile(50), histogram.percentile(99), histogram.percentile(100)
+    assert 1.5e-3 <= p50 <= 1.5e-3 * 10 ** (1 / 10)
+    assert 0.15 <= p99 <= 0.15 * 10 ** (1 / 10)
+    assert p100 == 10.0
+
+    summary = histogram.summary()
+    assert summary["p50_ms"] == pytest.approx(p50 * 1000.0)
+    assert summary["count"] == 100 and sum(summary["counts"]) == 100
+
+
+def test_stats_count_from_several_threads(tmp_path: Path) -> None:
+    stats = PipelineStats()
+
+    def work() -> None:
+        for _ in range(1000):
+            stats.count("received")
+            stats.count("processed")
+            stats.record("fit", 1e-3)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.count("dropped")
+
+    summary = stats.summary()
+    assert (summary["received"], summary["processed"], summary["dropped"]) == (4000, 4000, 1)
+    assert set(summary["stages"]) == set(PIPELINE_STAGES)
+    assert summary["stages"]["fit"]["count"] == 4000
+
+    stats.dump(str(tmp_path / "stats.json"))
+    assert json.loads((tmp_path / "stats.json").read_text())["processed"] == 4000
+    stats.reset()
+    assert stats.summary()["received"] == 0
+
+
+def test_session_counts_frames_dropped_while_workers_are_busy(qtbot: Any) -> None:
+    pytest.importorskip("PySide6.QtMultimedia", exc_type=ImportError)  # CameraSession needs the camera classes
+    from src.Core import CameraSession
+
+    session = CameraSession(num_workers=2)
+    try:
+        dispatched = [session.dispatch(index * 8333, index * 8_333_333) for index in range(3)]
+        assert [entry[:2] if entry else None for entry in dispatched] == [(0, 0), (1, 1), None]
+
+        session.frameWorkers[0].ready = True  # The first worker finished its frame
+        assert session.dispatch(3 * 8333, 3 * 8_333_333) == (0, 2, False)
+    finally:
+        session.shutdown()
+    assert (session.stats.received, session.stats.dropped) == (4, 1)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.DataClasses import FastData
+from src.DataClasses import SAMPLE_DTYPE
+from src.journal import JOURNAL_HEADER_DTYPE
+from src.journal import read_journal
+from src.journal import SampleJournal
+
+
+def fast_data(index: int) -> FastData:
+    return FastData(None, 320.0 + index, index * 1.5, sequence=index, frame_time_us=index * 8333, host_time_ns=index)
+
+
+def wait_for_records(path: str, count: int, timeout: float = 5.0) -> None:
+    size = JOURNAL_HEADER_DTYPE.itemsize + count * SAMPLE_DTYPE.itemsize
+    deadline = time.monotonic() + timeout
+    while os.path.getsize(path) < size:
+        assert time.monotonic() < deadline, "the journal writer did not write the chunks"
+        time.sleep(0.01)
+
+
+def test_close_writes_every_sample(tmp_path: Path) -> None:
+    path = str(tmp_path / "run.journal")
+    journal = SampleJournal(path, chunk_size=4)
+    for index in range(10):
+        journal.append(fast_data(index))
+    journal.close()
+
+    samples = read_journal(path)
+    np.testing.assert_array_equal(samples["sequence"], np.arange(10))
+    np.testing.assert_array_equal(samples["micron"], np.arange(10) * 1.5)
+
+
+def test_recovers_after_unclean_close(tmp_path: Path) -> None:
+    path = str(tmp_path / "run.journal")
+    journal = SampleJournal(path, chunk_size=4, flush_interval=0.05)
+    for index in range(10):
+        journal.append(fast_data(index))
+    wait_for_records(path, 8)  # The two full chunks, the last two samples are still in memory
+
+    # A copy of the file as a crash would leave it, with a record cut short at the end
+    crashed = str(tmp_path / "crashed.journal")
+    shutil.copyfile(path, crashed)
+    with open(crashed, "ab") as file:
+        file.write(b"\x00" * (SAMPLE_DTYPE.itemsize // 2))
+    journal.close()
+
+    samples = read_journal(crashed)
+    assert len(samples) >= 8  # More when a slow run handed off the last chunk on time
+    np.testing.assert_array_equal(samples["sequence"], np.arange(len(samples)))
+    np.testing.assert_array_equal(samples["frame_time_us"], np.arange(len(samples)) * 8333)
+
+
+def test_rejects_other_files(tmp_path: Path) -> None:
+    path = tmp_path / "not.journal"
+    path.write_bytes(b"something else entirely" * 4)
+    with pytest.raises(ValueError):
+        read_journal(str(path))
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import numpy as np
+
+from src.lod import TracePyramid
+
+
+def test_levels_keep_min_and_max() -> None:
+    r = np.zeros(1000)
+    r[123] = 5.0
+    r[777] = -3.0
+    pyramid = TracePyramid(np.linspace(0, 2 * np.pi, 1000, endpoint=False), r)
+    assert pyramid.r_range == (-3.0, 5.0)
+    for _, low, high in pyramid.levels:
+        assert low.min() == -3.0 and high.max() == 5.0
+
+
+def test_merged_angles_stay_on_the_trace_across_zero() -> None:
+    theta = np.linspace(5.5, 5.5 + 1.5, 1001) % (2 * np.pi)  # crosses 2π back to 0
+    pyramid = TracePyramid(theta, np.ones(theta.size))
+    for angles, _, _ in pyramid.levels:
+        angles = angles % (2 * np.pi)
+        assert ((angles >= 5.5 - 1e-9) | (angles <= 0.72)).all()  # none land on the opposite side
+
+    drawn, r = pyramid.points(64, closed=False)
+    assert drawn.size <= 2 * 64
+    kept = ~np.isnan(drawn)
+    assert ((drawn[kept] % (2 * np.pi) >= 5.5 - 1e-9) | (drawn[kept] % (2 * np.pi) <= 0.72)).all()
+    np.testing.assert_array_equal(r[kept], 1.0)
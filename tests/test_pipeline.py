@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.benchmark import synthetic_frames
+from src.DataClasses import FastData
+from src.DataClasses import SAMPLE_DTYPE
+from src.pipeline import align_samples
+from src.pipeline import ReorderBuffer
+
+
+def test_push_releases_in_sequence_order() -> None:
+    buffer = ReorderBuffer()
+    assert buffer.push(1, "b") == []
+    assert buffer.push(2, "c") == []
+    assert buffer.push(0, "a") == ["a", "b", "c"]
+    assert buffer.push(3, "d") == ["d"]
+    assert not buffer.pending
+
+
+def test_skip_releases_the_results_after_it() -> None:
+    buffer = ReorderBuffer()
+    assert buffer.push(1, "b") == []
+    assert buffer.skip(0) == ["b"]
+    assert buffer.skip(2) == []
+    assert buffer.push(3, "d") == ["d"]
+
+
+def test_overflow_gives_up_on_missing_result() -> None:
+    buffer = ReorderBuffer(max_pending=2)
+    assert buffer.push(1, "b") == []
+    assert buffer.push(2, "c") == []
+    assert buffer.push(3, "d") == ["b", "c", "d"]  # 0 is given up on
+    assert buffer.push(0, "a") == []  # and dropped when it turns up late
+    assert buffer.next_sequence == 4
+
+
+def test_align_samples_interpolates_on_host_clock() -> None:
+    samples = np.zeros(3, dtype=SAMPLE_DTYPE)
+    samples["host_time_ns"] = [0, 10_000_000, 100_000_000]
+    samples["micron"] = [0.0, 10.0, 20.0]
+
+    aligned = align_samples([-1, 5_000_000, 7_500_000, 50_000_000], samples)
+    np.testing.assert_allclose(aligned[1:3], [5.0, 7.5])
+    assert np.isnan(aligned[0])  # Before the first sample
+    assert np.isnan(aligned[3])  # Within a gap longer than max_gap_ns
+
+
+def sensor_samples(host_time_ns: np.ndarray, frame_time_origin_us: int) -> np.ndarray:
+    """Samples of a sensor whose reading rises 1 µm per ms of host time, stamped by its own camera clock."""
+    samples = np.zeros(host_time_ns.size, dtype=SAMPLE_DTYPE)
+    samples["host_time_ns"] = host_time_ns
+    samples["frame_time_us"] = frame_time_origin_us + (host_time_ns - host_time_ns[0]) // 1000
+    samples["micron"] = (host_time_ns - 10**9) / 1e6
+    return samples
+
+
+def test_align_samples_of_sensors_with_offset_clocks() -> None:
+    radial = sensor_samples(10**9 + np.arange(20) * 8_333_333, frame_time_origin_us=0)
+    axial_times = 10**9 + 3_000_000 + np.arange(20) * 8_333_333
+    axial_times[10:] += 60_000_000  # Dropped frames
+    axial = sensor_samples(axial_times, frame_time_origin_us=987_654_321)
+
+    aligned = align_samples(radial["host_time_ns"], axial)
+    assert np.isnan(aligned[0])  # Before the axial sensor's first frame
+    inside = np.flatnonzero(~np.isnan(aligned))
+    np.testing.assert_allclose(aligned[inside], radial["micron"][inside])  # The camera clocks play no part
+    gap = (radial["host_time_ns"] > axial_times[9]) & (radial["host_time_ns"] < axial_times[10])
+    assert gap.any() and np.isnan(aligned[gap]).all()
+    assert inside.size == 20 - 1 - gap.sum()
+
+
+def test_core_sessions_share_the_host_clock(qtbot: Any) -> None:
+    pytest.importorskip("PySide6.QtMultimedia", exc_type=ImportError)  # Core needs the camera classes
+    from src.Core import Core
+
+    core = Core(num_workers=1, num_sensors=2)
+    assert all(session.clock is core.clock for session in core.sessions)
+    ticks = iter(range(10**9, 2 * 10**9, 5_000_000))
+    core.clock = lambda: next(ticks)
+    for session in core.sessions:
+        session.clock = core.clock
+    results: List[List[FastData]] = [[], []]
+    for sensor, session in enumerate(core.sessions):
+        session.OnAnalyserUpdate.connect(results[sensor].append)
+
+    frames, _ = synthetic_frames(16, 128, 8)
+    try:
+        for index, frame in enumerate(frames):
+            for sensor, session in enumerate(core.sessions):  # Each camera with its own clock origin
+                qtbot.waitUntil(lambda: session.frameWorkers[0].ready, timeout=5000)
+                session.onGrayFramePassed(frame, sensor * 10**9 + index * 8333)
+        qtbot.waitUntil(lambda: all(len(sensor) == len(frames) for sensor in results), timeout=5000)
+    finally:
+        core.shutdown()
+
+    times = [np.array([data.host_time_ns for data in sensor]) for sensor in results]
+    np.testing.assert_array_equal(times[1] - times[0], 5_000_000)  # Stamped in turn from the one clock
+    assert [data.frame_time_us for data in results[1]] == [10**9 + index * 8333 for index in range(len(frames))]
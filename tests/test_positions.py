@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import time
+from typing import List
+
+import numpy as np
+import pytest
+
+from src.positions import join_positions
+from src.positions import on_circle
+from src.positions import POSITION_DTYPE
+from src.positions import PositionSampler
+from src.positions import with_positions
+from src.simulation import MachineErrors
+from src.simulation import SimulatedLinuxCNC
+
+NO_ERRORS = MachineErrors(0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def positions(times_ns: List[int], x: List[float], y: List[float]) -> np.ndarray:
+    log = np.zeros(len(times_ns), dtype=POSITION_DTYPE)
+    log["host_time_ns"] = times_ns
+    log["x"] = x
+    log["y"] = y
+    return log
+
+
+def test_sampler_records_work_coordinates() -> None:
+    machine = SimulatedLinuxCNC(errors=NO_ERRORS)
+    sampler = PositionSampler(machine.stat(), capacity=2)
+    for _ in range(5):  # More than the capacity, the buffer grows
+        sampler.poll()
+
+    log = sampler.positions
+    assert log.shape == (5,)
+    assert (np.diff(log["host_time_ns"]) >= 0).all()
+    np.testing.assert_allclose(log["x"], -machine.g5x_offset[0])  # At the machine origin, G54 removed
+    np.testing.assert_allclose(log["y"], -machine.g5x_offset[1])
+    np.testing.assert_allclose(log["z"], -machine.g5x_offset[2])
+
+
+def test_sampler_thread_joins_to_the_machine_position() -> None:
+    machine = SimulatedLinuxCNC(speed=1000.0, errors=NO_ERRORS)
+    command = machine.command()
+    command.mode(machine.MODE_MDI)
+    command.mdi("G0 X10 Y10")
+    while machine.busy(machine.now()):
+        time.sleep(0.001)
+
+    sampler = PositionSampler(machine.stat(), rate_hz=1000.0)
+    sampler.start()
+    time.sleep(0.05)
+    log = sampler.stop()
+    assert log.shape[0] >= 2 and not sampler.thread
+
+    times = np.linspace(log["host_time_ns"][0], log["host_time_ns"][-1], 7).astype(np.int64)
+    joined = join_positions(times, log)
+    np.testing.assert_allclose(joined["x_mm"], 10.0)
+    np.testing.assert_allclose(joined["y_mm"], 10.0)
+    np.testing.assert_allclose(joined["theta"], np.pi / 4)
+
+
+def test_join_at_boundaries_and_outside() -> None:
+    log = positions([1000, 2000, 3000], [1.0, 0.0, -1.0], [0.0, 1.0, 0.0])
+    joined = join_positions([999, 1000, 1500, 2000, 3000, 3001, -1], log)
+
+    np.testing.assert_allclose(joined["x_mm"][1:5], [1.0, 0.5, 0.0, -1.0])  # The first and last polls are inside
+    np.testing.assert_allclose(joined["y_mm"][1:5], [0.0, 0.5, 1.0, 0.0])
+    np.testing.assert_allclose(joined["theta"][1:5], [0.0, np.pi / 4, np.pi / 2, np.pi])
+    for index in (0, 5, 6):  # Before the first poll, after the last and without a time
+        assert np.isnan(joined[index]["x_mm"]) and np.isnan(joined[index]["theta"])
+
+
+def test_join_angle_is_around_the_centre_from_zero_to_two_pi() -> None:
+    log = positions([0, 10], [5.0, 5.0], [1.0, -1.0])
+    joined = join_positions([0, 10], log, centre=(4.0, 0.0))
+    np.testing.assert_allclose(joined["theta"], [np.pi / 4, 7 * np.pi / 4])
+
+
+@pytest.mark.parametrize("count", [0, 1])
+def test_join_without_enough_positions(count: int) -> None:
+    log = positions([1000] * count, [1.0] * count, [0.0] * count)
+    joined = join_positions([1000, 2000], log)
+    assert joined.shape == (2,)
+    assert np.isnan(joined["x_mm"]).all() and np.isnan(joined["theta"]).all()
+
+
+def test_on_circle_leaves_out_the_moves_on_and_off() -> None:
+    log = positions([0, 10, 20, 30], [100.0, 101.0, 0.0, 0.0], [0.0, 0.0, 100.0, 100.0])
+    samples = np.zeros(4, dtype=[("micron", "<f8"), ("host_time_ns", "<i8")])
+    samples["host_time_ns"] = [0, 10, 20, 40]
+    combined = with_positions(samples, join_positions(samples["host_time_ns"], log))
+
+    np.testing.assert_array_equal(on_circle(combined, 100.0), [True, False, True, True])  # The last has no position
+    assert on_circle(samples, 100.0) is None
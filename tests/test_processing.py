@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.benchmark import synthetic_frames
+from src.curves import estimator_names
+from src.processing import BandTracker
+from src.processing import FrameAnalyser
+
+
+@pytest.mark.parametrize("name", estimator_names)
+def test_frame_analyser_measures_synthetic_frames(name: str) -> None:
+    frames, positions = synthetic_frames(48, 320, 40)
+    analyser = FrameAnalyser()
+    analyser.estimator = name
+    tolerance = 0.25 if name == "Log-parabola" else 0.05  # Three samples only
+
+    batch = analyser.analyse(frames)["pixel"]
+    single = np.array([analyser.analyse_frame(frame)[0]["pixel"] for frame in frames])
+    np.testing.assert_allclose(batch, positions, atol=tolerance)
+    np.testing.assert_allclose(single, positions, atol=tolerance)
+
+
+def test_tracked_batch_keeps_state_across_chunks() -> None:
+    frames, _ = synthetic_frames(48, 320, 40)
+    analyser = FrameAnalyser()
+    analyser.estimator = "Tracked Gaussian"
+    whole = analyser.analyse(frames)["pixel"]
+    analyser.batch_size = 7
+    np.testing.assert_array_equal(analyser.analyse(frames)["pixel"], whole)
+
+
+def line_frame(position: float, height: int = 16, width: int = 320, peak: float = 200.0) -> np.ndarray:
+    """A noise free frame of a vertical Gaussian line on a background of 20."""
+    columns = np.arange(width, dtype=np.float64)
+    row = 20.0 + peak * np.exp(-0.5 * ((columns - position) / 6.0) ** 2)
+    frame: np.ndarray = np.repeat(row[None, :], height, axis=0).round().astype(np.uint8)
+    return frame
+
+
+def roi_analyser() -> FrameAnalyser:
+    analyser = FrameAnalyser()
+    analyser.estimator = "Linear Gaussian"
+    analyser.roi_enabled = True
+    analyser.band_tracker.margin = 32
+    return analyser
+
+
+def test_band_columns_are_clamped_to_the_frame() -> None:
+    tracker = BandTracker(margin=32)
+    assert tracker.columns(320) == (0, 320)  # Searching
+    tracker.centre = 10.0
+    assert tracker.columns(320) == (0, 43)
+    tracker.centre = 310.5
+    assert tracker.columns(320) == (278, 320)
+    tracker.centre = 400.0  # Off the frame, the band would be empty
+    assert tracker.columns(320) == (0, 320)
+
+    tracker.row_fraction = 0.5
+    assert tracker.rows(48) == (12, 36)
+
+
+def test_band_reduce_fills_outside_with_the_band_minimum() -> None:
+    tracker = BandTracker(margin=32)
+    tracker.centre = 300.0
+    frame = line_frame(300.0)
+    frame[:, :200] = 255  # Outside the band, must not be read
+    profile = tracker.reduce(frame, np.empty(320))
+
+    assert tracker.band == (268, 320)
+    np.testing.assert_array_equal(profile[268:], frame[0, 268:])
+    np.testing.assert_array_equal(profile[:268], frame[0, 268:].min())
+
+
+def test_roi_follows_the_line_into_the_frame_edge() -> None:
+    analyser = roi_analyser()
+    for position in np.arange(60.0, 15.0, -3.7):
+        record, _ = analyser.analyse_frame(line_frame(position))
+        assert record["pixel"] == pytest.approx(position, abs=0.05)
+    assert analyser.band_tracker.band[0] == 0  # Clamped at the left edge
+    assert analyser.band_tracker.centre == pytest.approx(position, abs=0.05)
+
+
+def test_roi_searches_again_after_losing_the_line() -> None:
+    analyser = roi_analyser()
+    analyser.analyse_frame(line_frame(100.3))
+    assert analyser.band_tracker.band == (0, 320)
+    analyser.analyse_frame(line_frame(100.3))
+    assert analyser.band_tracker.band == (68, 133)
+
+    analyser.analyse_frame(line_frame(100.3, peak=0.0))  # The line is gone
+    assert analyser.band_tracker.centre is None
+
+    record, _ = analyser.analyse_frame(line_frame(250.6))  # Back somewhere else, outside the old band
+    assert analyser.band_tracker.band == (0, 320)
+    assert record["pixel"] == pytest.approx(250.6, abs=0.05)
+    assert analyser.band_tracker.centre == pytest.approx(250.6, abs=0.05)
+
+
+def test_roi_reacquires_a_line_that_jumped_out_of_the_band() -> None:
+    analyser = roi_analyser()
+    analyser.analyse_frame(line_frame(100.3))
+    analyser.analyse_frame(line_frame(200.8))  # Measured on the old band, where the line is not
+    assert analyser.band_tracker.centre is None
+
+    record, _ = analyser.analyse_frame(line_frame(200.8))
+    assert record["pixel"] == pytest.approx(200.8, abs=0.05)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.recording import FrameRecorder
+from src.recording import FrameRecording
+from src.recording import HEADER_SIZE
+
+HEIGHT, WIDTH = 4, 6
+CAPACITY = 5
+MAX_BYTES = 2 * HEADER_SIZE + CAPACITY * (HEIGHT * WIDTH + 8)  # The header and timestamps blocks, then 5 frames
+
+
+def record(path: str, count: int) -> FrameRecorder:
+    recorder = FrameRecorder(path, HEIGHT, WIDTH, MAX_BYTES)
+    for index in range(count):
+        assert recorder.write(np.full((HEIGHT, WIDTH), index, dtype=np.uint8), 1000 + index * 8333)
+    return recorder
+
+
+def test_round_trip_before_the_ring_wraps(tmp_path: Path) -> None:
+    path = str(tmp_path / "run.frames")
+    record(path, 3).close()
+
+    recording = FrameRecording(path)
+    assert (recording.height, recording.width, recording.capacity, recording.count) == (HEIGHT, WIDTH, CAPACITY, 3)
+    assert len(recording) == 3
+    np.testing.assert_array_equal(recording.timestamps, 1000 + np.arange(3) * 8333)
+    for index, (timestamp, frame) in enumerate(recording):
+        assert timestamp == 1000 + index * 8333
+        np.testing.assert_array_equal(frame, index)
+    np.testing.assert_array_equal(np.concatenate(list(recording.segments()))[:, 0, 0], [0, 1, 2])
+
+
+def test_overwriting_the_ring_keeps_the_newest_frames_in_order(tmp_path: Path) -> None:
+    path = str(tmp_path / "run.frames")
+    record(path, 12).close()
+
+    recording = FrameRecording(path)
+    assert recording.count == 12 and len(recording) == CAPACITY
+    newest = np.arange(7, 12)
+    np.testing.assert_array_equal([recording.frame(index)[0, 0] for index in range(CAPACITY)], newest)
+    np.testing.assert_array_equal(recording.timestamps, 1000 + newest * 8333)
+    segments = list(recording.segments())
+    assert len(segments) == 2  # The ring wrapped in the middle of the file
+    np.testing.assert_array_equal(np.concatenate(segments)[:, 0, 0], newest)
+
+
+def test_reader_sees_the_frames_written_so_far(tmp_path: Path) -> None:
+    path = str(tmp_path / "run.frames")
+    recorder = record(path, 2)
+    recorder.frames.flush()
+    recorder.timestamps.flush()
+    recorder.header.flush()
+    assert len(FrameRecording(path)) == 2
+
+    assert not recorder.write(np.zeros((HEIGHT + 1, WIDTH), dtype=np.uint8), 0)  # Another frame size
+    recorder.close()
+    assert len(FrameRecording(path)) == 2
+
+
+def test_rejects_other_and_truncated_files(tmp_path: Path) -> None:
+    other = tmp_path / "other.frames"
+    other.write_bytes(b"not a recording" * 100)
+    with pytest.raises(ValueError):
+        FrameRecording(str(other))
+
+    path = str(tmp_path / "run.frames")
+    record(path, 3).close()
+    with open(path, "r+b") as file:
+        file.truncate(HEADER_SIZE + 8)
+    with pytest.raises(ValueError):
+        FrameRecording(path)
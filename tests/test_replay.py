@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from src.benchmark import synthetic_frames
+from src.recording import FrameRecorder
+
+pytest.importorskip("PySide6.QtMultimedia", exc_type=ImportError)  # CameraSession needs the camera classes
+
+
+def record(path: str, frames: npt.NDArray[np.uint8]) -> None:
+    recorder = FrameRecorder(path, frames.shape[1], frames.shape[2])
+    for index, frame in enumerate(frames):
+        recorder.write(frame, index * 8333)
+    recorder.close()
+
+
+def test_replay_moves_on_after_a_frame_that_cannot_be_analysed(
+    qtbot: Any, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    from src.Core import CameraSession
+
+    frames, _ = synthetic_frames(32, 64, 5)
+    frames[2] = 0  # A blank frame the worker fails on
+    path = str(tmp_path / "run.rec")
+    record(path, frames)
+
+    session = CameraSession(num_workers=1)
+    worker = session.frameWorkers[0]
+    analyse_frame = worker.analyse_frame
+
+    def failing_analyse_frame(
+        gray: npt.NDArray[np.uint8], with_profile: bool
+    ) -> Tuple[np.void, Optional[npt.NDArray[np.float64]]]:
+        if not gray.any():
+            raise ValueError("no laser line")
+        return analyse_frame(gray, with_profile)
+
+    monkeypatch.setattr(worker, "analyse_frame", failing_analyse_frame)
+    analysed: List[int] = []
+    session.OnAnalyserUpdate.connect(lambda data: analysed.append(data.sequence))
+    try:
+        session.start_replay(path, recorded_speed=False)
+        qtbot.waitUntil(lambda: session.replayer is None, timeout=5000)
+    finally:
+        session.shutdown()
+    assert analysed == [0, 1, 3, 4]
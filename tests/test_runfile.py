@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from src.DataClasses import SAMPLE_DTYPE
+from src.runfile import convert_pickle
+from src.runfile import open_samples
+from src.runfile import Run
+from src.runfile import write_run
+
+
+def make_samples(count: int) -> np.ndarray:
+    samples = np.zeros(count, dtype=SAMPLE_DTYPE)
+    samples["sequence"] = np.arange(count)
+    samples["frame_time_us"] = np.arange(count) * 8333
+    samples["host_time_ns"] = 10**12 + np.arange(count) * 8_333_333
+    samples["micron"] = np.sin(np.arange(count) / 10.0) * 50.0
+    samples["pixel"] = 320.0 + samples["micron"] / 10.0
+    samples["contrast"] = 180.0
+    return samples
+
+
+def test_write_run_round_trip(tmp_path: Path) -> None:
+    samples = make_samples(1000)
+    path = str(tmp_path / "run.bbr")
+    write_run(path, samples, {"radius_mm": 100.0, "laps": 2})
+
+    run = Run(path)
+    assert len(run) == 1000
+    assert run.metadata == {"radius_mm": 100.0, "laps": 2}
+    for name in SAMPLE_DTYPE.names or ():
+        np.testing.assert_array_equal(run[name], samples[name])
+    np.testing.assert_array_equal(run.to_samples(), samples)
+    assert isinstance(open_samples(path), Run)
+
+
+def test_write_run_extra_columns_and_empty(tmp_path: Path) -> None:
+    extra = np.zeros(3, dtype=[("micron", "<f8"), ("theta", "<f8")])
+    extra["theta"] = [0.0, 1.0, 2.0]
+    write_run(str(tmp_path / "extra.bbr"), extra)
+    run = Run(str(tmp_path / "extra.bbr"))
+    np.testing.assert_array_equal(run["theta"], extra["theta"])
+    np.testing.assert_array_equal(run.to_samples()["frame_time_us"], -1)  # Missing times are unknown
+
+    write_run(str(tmp_path / "empty.bbr"), np.zeros(0, dtype=SAMPLE_DTYPE))
+    assert len(Run(str(tmp_path / "empty.bbr")).to_samples()) == 0
+
+
+def test_convert_pickle_of_structured_samples(tmp_path: Path) -> None:
+    samples = make_samples(50)
+    pickle_path = tmp_path / "ballbar_01.pkl"
+    pickle_path.write_bytes(pickle.dumps(samples))
+
+    run = Run(convert_pickle(str(pickle_path), metadata={"radius_mm": 50.0}))
+    assert run.path == str(tmp_path / "ballbar_01.bbr")
+    assert run.metadata == {"converted_from": "ballbar_01.pkl", "radius_mm": 50.0}
+    np.testing.assert_array_equal(run.to_samples(), samples)
+
+
+def test_convert_pickle_of_micron_list(tmp_path: Path) -> None:
+    values = [1.5, -2.0, 3.25]
+    pickle_path = tmp_path / "old.pkl"
+    pickle_path.write_bytes(pickle.dumps(values))
+
+    run = Run(convert_pickle(str(pickle_path), str(tmp_path / "converted.bbr")))
+    np.testing.assert_array_equal(run["micron"], values)
+    np.testing.assert_array_equal(run["host_time_ns"], -1)
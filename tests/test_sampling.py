@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from src.sampling import kept_count
+from src.sampling import SubsampleBuffer
+from src.sampling import trimmed_mean
+
+
+def test_kept_count_keeps_at_least_one() -> None:
+    assert kept_count(10, 20.0) == 8
+    assert kept_count(10, 100.0) == 1
+    assert kept_count(1, 50.0) == 1
+
+
+def test_trimmed_mean_drops_the_values_furthest_from_the_median() -> None:
+    means, spreads = trimmed_mean([[1.0, 2.0, 3.0, 100.0], [10.0, -50.0, 11.0, 12.0]], outliers=25.0)
+    np.testing.assert_allclose(means, [2.0, 11.0])
+    np.testing.assert_allclose(spreads, np.std([1.0, 2.0, 3.0]))
+
+
+def test_trimmed_mean_by_one_row_keeps_the_same_measurements() -> None:
+    values = [[1.0, 2.0, 3.0, 100.0], [10.0, -50.0, 11.0, 12.0]]
+    means, _ = trimmed_mean(values, outliers=25.0, by=0)
+    np.testing.assert_allclose(means, [2.0, -29.0 / 3])  # The last measurement left out of both rows
+
+
+def test_subsample_buffer_averages_the_same_measurements() -> None:
+    buffer = SubsampleBuffer(capacity=2)
+    assert buffer.result() is None
+    buffer.start(5, outliers=20.0)  # Grows the buffer
+    measurements = [(1.0, 10.0), (2.0, 20.0), (3.0, 30.0), (4.0, 40.0), (90.0, 35.0)]
+    assert [buffer.push(micron, pixel) for micron, pixel in measurements] == [False] * 4 + [True]
+    assert buffer.complete
+
+    sample = buffer.result()
+    assert sample is not None
+    assert sample.subsamples == 4
+    assert sample.micron == pytest.approx(2.5)
+    assert sample.pixel == pytest.approx(25.0)  # Not 31.25 from trimming the pixel row on its own
+    assert sample.spread_um == pytest.approx(np.std([1.0, 2.0, 3.0, 4.0]))
+
+
+def test_subsample_buffer_keeps_the_latest_measurements() -> None:
+    buffer = SubsampleBuffer()
+    buffer.start(3)
+    for value in range(6):
+        buffer.push(float(value), 2.0 * value)
+    sample = buffer.result()
+    assert sample is not None
+    assert sample.micron == pytest.approx(4.0)
+    assert sample.pixel == pytest.approx(8.0)
+    assert sample.subsamples == 3
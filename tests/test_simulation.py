@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import List
+
+import numpy as np
+
+from src.simulation import SimulatedLinuxCNC
+from src.simulation import SyntheticCamera
+
+
+def test_camera_keeps_only_the_latest_readings(qtbot: Any) -> None:
+    machine = SimulatedLinuxCNC(speed=1000.0)
+    camera = SyntheticCamera(machine, width=64, height=8, truth_frames=3)
+    frame_times: List[int] = []
+    camera.OnFrameChanged.connect(lambda frame, frame_time_us: frame_times.append(frame_time_us))
+    camera.start()
+    for _ in range(4):
+        camera.tick()
+    camera.stop()
+
+    assert len(frame_times) == 5 and len(camera.truth) == 3
+    readings = camera.readings(frame_times)
+    assert np.isnan(readings[:2]).all()  # Dropped, only the latest three are kept
+    np.testing.assert_array_equal(readings[2:], [reading for _, reading in camera.truth])
+
+    camera.start()
+    camera.stop()
+    assert len(camera.truth) == 1